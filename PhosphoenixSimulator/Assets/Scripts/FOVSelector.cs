@@ -43,8 +43,8 @@ public class FOVSelector : MonoBehaviour
     private UdpClient udpClient;
     private const string serverIp = "127.0.0.1";
     private const int serverPort = 4906;
-    private byte[] frameDelimiter = System.Text.Encoding.ASCII.GetBytes("FRAME_DEL");
-    private byte[] exitCode = System.Text.Encoding.ASCII.GetBytes("EXIT_CODE");
+    private FrameProtocol.Sender frameSender;   // Splits frames into datagrams (see FrameProtocol.cs)
+    private byte[] sendBuffer;                  // The image, rotated by 180 degrees, that is being sent
 
     //Flags
     private bool sendingActive = false;
@@ -125,6 +125,8 @@ public class FOVSelector : MonoBehaviour
             try
             {
                 udpClient = new UdpClient(serverIp, serverPort);
+                udpClient.Client.SendBufferSize = FrameProtocol.SocketBufferSize;
+                frameSender = new FrameProtocol.Sender(udpClient);
                 Debug.Log("camera socket (out) working from Unity side");
             }
             catch (Exception e)
@@ -148,6 +150,16 @@ public class FOVSelector : MonoBehaviour
         return (int)(Math.Round(view_angle / fovDegreeVarjoVert * resolutionPixelsVert));
     }
 
+    public string return_serverIp()
+    {
+        return serverIp;
+    }
+
+    public int return_serverPort()
+    {
+        return serverPort;
+    }
+
     private void captureAndPrepareImage()
     {
         // Render and capture the frame
@@ -224,23 +236,16 @@ public class FOVSelector : MonoBehaviour
             return;
         }
 
-        // Send the data in chunks over UDP
-        int CHUNK_SIZE = 1024;
-        for (int i = imageData.Length - CHUNK_SIZE; i >= 0; i -= CHUNK_SIZE)
+        // The image is sent rotated by 180 degrees (i.e. with its bytes reversed)
+        if (sendBuffer == null || sendBuffer.Length != imageData.Length)
         {
-            int chunkSize = Mathf.Min(CHUNK_SIZE, imageData.Length - i);
-            byte[] chunk = new byte[chunkSize];
-            for(int j = 0; j < chunkSize; j++)
-            {
-                chunk[j] = imageData[i + chunkSize - 1 - j];
-            }
-            //Array.Copy(imageData, i, chunk, 0, chunkSize);
-            udpClient.Send(chunk, chunk.Length);
+            sendBuffer = new byte[imageData.Length];
         }
+        Buffer.BlockCopy(imageData, 0, sendBuffer, 0, imageData.Length);
+        Array.Reverse(sendBuffer);
 
-        // Send frame delimiter
-        udpClient.Send(frameDelimiter, frameDelimiter.Length);
-        
+        // Send the frame in as few datagrams as possible
+        frameSender.Send(sendBuffer, sendBuffer.Length);
     }
 
     public bool is_sending_active()
@@ -250,7 +255,7 @@ public class FOVSelector : MonoBehaviour
 
     void OnDestroy()
     {     
-        udpClient.Send(exitCode, exitCode.Length);  
+        frameSender.SendExit();
         udpClient.Close();
     }
 
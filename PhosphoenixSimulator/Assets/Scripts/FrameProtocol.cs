@@ -0,0 +1,335 @@
+using System;
+using System.IO;
+using System.IO.Compression;
+using System.Net;
+using System.Net.Sockets;
+
+// Wire format of the frames that are exchanged with Python over UDP (version 1),
+// see StreamingAssets/streaming/protocol.py. Every datagram starts with a
+// 16-byte little-endian header:
+//
+//     magic ("PX") | version (byte) | kind (byte) | frame id (uint32) | offset (uint32) | total length (uint32)
+//
+// followed by the bytes [offset, offset + payload length) of the frame. The
+// datagrams of a frame are sent in order; a frame with a missing datagram is dropped.
+// Datagrams of kind Exit end a stream, and one of kind Shutdown stops the Python server.
+//
+// Frames of kind EncodedFrame are compressed (see StreamingAssets/streaming/encoding.py),
+// and start with a 12-byte little-endian header:
+//
+//     encoding (byte) | 3 reserved bytes | reference frame id (uint32) | decoded length (uint32)
+//
+// Raw: the frame. Rle: the number of runs n (uint32), n (zeros, nonzero bytes) pairs of
+// uint16, and the nonzero bytes of all runs. Delta: the Rle of the difference (modulo 256)
+// with the frame with the reference frame id. Deflate: a raw deflate stream.
+public static class FrameProtocol
+{
+    public const byte Version = 1;
+    public const byte KindFrame = 0;
+    public const byte KindExit = 1;
+    public const byte KindShutdown = 2;
+    public const byte KindEncodedFrame = 3;
+    public const byte EncodingRaw = 0;
+    public const byte EncodingRle = 1;
+    public const byte EncodingDelta = 2;
+    public const byte EncodingDeflate = 3;
+    public const int HeaderSize = 16;
+    public const int EncodingHeaderSize = 12;
+    public const int MaxDatagramSize = 65507;           // Largest UDP payload over IPv4
+    public const int SocketBufferSize = 1 << 20;        // Room for several frames in the OS buffers
+
+    private static void WriteUInt32(byte[] buffer, int index, uint value)
+    {
+        buffer[index] = (byte)value;
+        buffer[index + 1] = (byte)(value >> 8);
+        buffer[index + 2] = (byte)(value >> 16);
+        buffer[index + 3] = (byte)(value >> 24);
+    }
+
+    private static uint ReadUInt32(byte[] buffer, int index)
+    {
+        return (uint)(buffer[index] | buffer[index + 1] << 8 | buffer[index + 2] << 16 | buffer[index + 3] << 24);
+    }
+
+    private static void WriteHeader(byte[] datagram, byte kind, uint frameId, int offset, int totalLength)
+    {
+        datagram[0] = (byte)'P';
+        datagram[1] = (byte)'X';
+        datagram[2] = Version;
+        datagram[3] = kind;
+        WriteUInt32(datagram, 4, frameId);
+        WriteUInt32(datagram, 8, (uint)offset);
+        WriteUInt32(datagram, 12, (uint)totalLength);
+    }
+
+    // Ask the Python server listening on the given port to stop
+    public static void SendShutdown(UdpClient udpClient, string ip, int port)
+    {
+        byte[] datagram = new byte[HeaderSize];
+        WriteHeader(datagram, KindShutdown, 0, 0, 0);
+        udpClient.Send(datagram, HeaderSize, ip, port);
+    }
+
+    public class Sender
+    {
+        private UdpClient udpClient;
+        private byte[] datagram = new byte[MaxDatagramSize];   // Reused for every datagram
+        private uint frameId = 0;
+
+        public Sender(UdpClient udpClient)
+        {
+            this.udpClient = udpClient;
+        }
+
+        // Send the first `length` bytes of data as one frame
+        public void Send(byte[] data, int length)
+        {
+            frameId++;
+            int maxPayload = MaxDatagramSize - HeaderSize;
+            for (int offset = 0; offset < length; offset += maxPayload)
+            {
+                int payloadLength = Math.Min(maxPayload, length - offset);
+                WriteHeader(datagram, KindFrame, frameId, offset, length);
+                Buffer.BlockCopy(data, offset, datagram, HeaderSize, payloadLength);
+                udpClient.Send(datagram, HeaderSize + payloadLength);
+            }
+        }
+
+        public void SendExit()
+        {
+            WriteHeader(datagram, KindExit, frameId, 0, 0);
+            udpClient.Send(datagram, HeaderSize);
+        }
+    }
+
+    public class Receiver
+    {
+        private UdpClient udpClient;
+        private IPEndPoint remoteEndPoint = new IPEndPoint(IPAddress.Any, 0);
+        private bool skipping = false;  // Whether the rest of frame skippedFrameId is ignored
+        private uint skippedFrameId;
+        private byte[] encoded;         // Encoded frame being reassembled
+        private byte[] reference;       // Last decoded frame, to which Delta frames refer
+        private bool hasReference = false;
+        private uint referenceId;
+
+        // Statistics
+        public int framesReceived = 0;
+        public int framesDropped = 0;
+        public int invalidDatagrams = 0;
+        public int invalidFrames = 0;
+        public int framesWithoutReference = 0;
+
+        public Receiver(UdpClient udpClient)
+        {
+            this.udpClient = udpClient;
+        }
+
+        private void Drop(uint frameId)
+        {
+            framesDropped++;
+            skipping = true;
+            skippedFrameId = frameId;
+        }
+
+        // Receive datagrams until a frame of exactly frame.Length bytes is complete (and decoded,
+        // if it is encoded). Returns false if the stream ended.
+        public bool Receive(byte[] frame)
+        {
+            if (encoded == null || encoded.Length != EncodingHeaderSize + frame.Length)
+            {
+                encoded = new byte[EncodingHeaderSize + frame.Length];
+                reference = new byte[frame.Length];
+                hasReference = false;
+            }
+
+            bool assembling = false;
+            byte[] target = frame;
+            uint frameId = 0;
+            int length = 0;
+            int received = 0;
+            while (true)
+            {
+                byte[] datagram = udpClient.Receive(ref remoteEndPoint);
+                if (datagram.Length < HeaderSize || datagram[0] != (byte)'P' || datagram[1] != (byte)'X' || datagram[2] != Version)
+                {
+                    invalidDatagrams++;
+                    continue;
+                }
+
+                byte kind = datagram[3];
+                uint datagramFrameId = ReadUInt32(datagram, 4);
+                int offset = (int)ReadUInt32(datagram, 8);
+                int totalLength = (int)ReadUInt32(datagram, 12);
+                int payloadLength = datagram.Length - HeaderSize;
+
+                if (kind == KindExit || kind == KindShutdown)
+                {
+                    if (assembling)
+                    {
+                        framesDropped++;
+                    }
+                    return false;
+                }
+                if ((kind != KindFrame && kind != KindEncodedFrame) || (skipping && datagramFrameId == skippedFrameId))
+                {
+                    continue;
+                }
+
+                if (!assembling || datagramFrameId != frameId)
+                {
+                    if (assembling)
+                    {
+                        // A new frame started before the current one completed
+                        framesDropped++;
+                    }
+                    assembling = false;
+                    target = kind == KindFrame ? frame : encoded;
+                    if (offset != 0 || (kind == KindFrame ? totalLength != frame.Length : totalLength > encoded.Length))
+                    {
+                        // Missed the start of the frame, or it has the wrong size
+                        Drop(datagramFrameId);
+                        continue;
+                    }
+                    assembling = true;
+                    frameId = datagramFrameId;
+                    length = totalLength;
+                    received = 0;
+                }
+                else if (offset != received)
+                {
+                    // A datagram of this frame got lost
+                    assembling = false;
+                    Drop(frameId);
+                    continue;
+                }
+
+                payloadLength = Math.Min(payloadLength, length - received);
+                Buffer.BlockCopy(datagram, HeaderSize, target, received, payloadLength);
+                received += payloadLength;
+                if (received == length)
+                {
+                    assembling = false;
+                    if (target == encoded && !Decode(length, frameId, frame))
+                    {
+                        continue;
+                    }
+                    framesReceived++;
+                    return true;
+                }
+            }
+        }
+
+        // Decode the first `length` bytes of the encoded buffer into frame. Returns false (leaving
+        // frame partly written) if the frame is invalid, or a Delta frame of which the reference
+        // was not received.
+        private bool Decode(int length, uint frameId, byte[] frame)
+        {
+            if (length < EncodingHeaderSize || ReadUInt32(encoded, 8) != (uint)frame.Length)
+            {
+                invalidFrames++;
+                return false;
+            }
+            byte encoding = encoded[0];
+            bool valid;
+            switch (encoding)
+            {
+                case EncodingRaw:
+                    valid = length == EncodingHeaderSize + frame.Length;
+                    if (valid)
+                    {
+                        Buffer.BlockCopy(encoded, EncodingHeaderSize, frame, 0, frame.Length);
+                    }
+                    break;
+                case EncodingRle:
+                    valid = DecodeRuns(encoded, EncodingHeaderSize, length, frame);
+                    break;
+                case EncodingDelta:
+                    if (!hasReference || ReadUInt32(encoded, 4) != referenceId)
+                    {
+                        framesWithoutReference++;
+                        return false;
+                    }
+                    valid = DecodeRuns(encoded, EncodingHeaderSize, length, frame);
+                    if (valid)
+                    {
+                        for (int i = 0; i < frame.Length; i++)
+                        {
+                            frame[i] += reference[i];
+                        }
+                    }
+                    break;
+                case EncodingDeflate:
+                    valid = Inflate(encoded, EncodingHeaderSize, length, frame);
+                    break;
+                default:
+                    valid = false;
+                    break;
+            }
+            if (!valid)
+            {
+                invalidFrames++;
+                hasReference = false;
+                return false;
+            }
+            Buffer.BlockCopy(frame, 0, reference, 0, frame.Length);
+            hasReference = true;
+            referenceId = frameId;
+            return true;
+        }
+
+        // Decode the runs in data[start, end) into frame
+        private static bool DecodeRuns(byte[] data, int start, int end, byte[] frame)
+        {
+            if (end - start < 4)
+            {
+                return false;
+            }
+            long numRuns = ReadUInt32(data, start);
+            int runs = start + 4;
+            if (runs + 4 * numRuns > end)
+            {
+                return false;
+            }
+            int values = runs + 4 * (int)numRuns;
+            int position = 0;
+            for (long i = 0; i < numRuns; i++, runs += 4)
+            {
+                int zeros = data[runs] | data[runs + 1] << 8;
+                int literals = data[runs + 2] | data[runs + 3] << 8;
+                if (position + zeros + literals > frame.Length || values + literals > end)
+                {
+                    return false;
+                }
+                Array.Clear(frame, position, zeros);
+                position += zeros;
+                Buffer.BlockCopy(data, values, frame, position, literals);
+                position += literals;
+                values += literals;
+            }
+            return position == frame.Length && values == end;
+        }
+
+        // Inflate the deflate stream in data[start, end) into frame
+        private static bool Inflate(byte[] data, int start, int end, byte[] frame)
+        {
+            try
+            {
+                using (DeflateStream stream = new DeflateStream(new MemoryStream(data, start, end - start), CompressionMode.Decompress))
+                {
+                    int position = 0;
+                    int read;
+                    while (position < frame.Length && (read = stream.Read(frame, position, frame.Length - position)) > 0)
+                    {
+                        position += read;
+                    }
+                    return position == frame.Length && stream.ReadByte() == -1;
+                }
+            }
+            catch (InvalidDataException)
+            {
+                return false;
+            }
+        }
+    }
+}
@@ -28,7 +28,7 @@ public class PhospheneRenderer : MonoBehaviour
     // variables for receiving data from the python script
     private UdpClient udpClient;
     private int port = 9003;
-    private byte[] frameDelimiter = System.Text.Encoding.ASCII.GetBytes("FRAME_DEL");
+    private FrameProtocol.Receiver frameReceiver;   // Reassembles frames from datagrams (see FrameProtocol.cs)
 
     // Variables for activating the Python script
     private Process pythonProcess;
@@ -97,6 +97,8 @@ public class PhospheneRenderer : MonoBehaviour
 
         // Make UDP port ready to receive phosphene data
         udpClient = new UdpClient(port);
+        udpClient.Client.ReceiveBufferSize = FrameProtocol.SocketBufferSize;
+        frameReceiver = new FrameProtocol.Receiver(udpClient);
         UdpClientActive = true;
         Debug.Log("phosphene socket (in) working from Unity side");
         
@@ -135,7 +137,8 @@ public class PhospheneRenderer : MonoBehaviour
     // Background thread for receiving image data
     private void ReceiveImageData()
     {
-        IPEndPoint remoteEndPoint = new IPEndPoint(IPAddress.Any, port);
+        // Buffer for the received grayscale image
+        byte[] receivedData = new byte[cropWidthPixels * cropHeightPixels];
 
         while (true)  // Continuously listen for UDP data
         {   
@@ -144,52 +147,25 @@ public class PhospheneRenderer : MonoBehaviour
                 break;
             }
 
-            // Buffer for the received grayscale image
-            byte[] receivedData = new byte[cropWidthPixels * cropHeightPixels];
-            int received = 0;
-            bool newFrameStarted = false;
-
 #if MEASURE_TIMES
-            bool started_recoring_times = false;
             Stopwatch timer = new Stopwatch();
+            timer.Start();
 #endif
-            // Continuously receive data until a full frame is reconstructed
-            while (received < receivedData.Length)
+            // Receive datagrams until a full frame is reconstructed
+            try
             {
-                try
+                if (!frameReceiver.Receive(receivedData))
                 {
-                    byte[] packet = udpClient.Receive(ref remoteEndPoint);
-#if MEASURE_TIMES
-                    if(!started_recoring_times)
-                    {
-                        started_recoring_times = true;
-                        timer.Start();
-                    }
-#endif
-                    // Check for frame delimiter
-                    if (packet.Length == frameDelimiter.Length)
-                    { 
-                        if (CompareArrays(packet, frameDelimiter))
-                        {
-                            newFrameStarted = true;
-                            received = 0;  // Start receiving a new frame
-                            continue; // do not copy frame delimiter into data!
-                        }
-                    }
-
-                    if (newFrameStarted)
-                    {
-                        int bytesToCopy = Math.Min(packet.Length, receivedData.Length - received);
-                        
-                        // Copy packet data into the frame buffer
-                        Array.Copy(packet, 0, receivedData, received, bytesToCopy);
-                        received += bytesToCopy;
-                    }
+                    break;
                 }
-                catch (SocketException ex)
+            }
+            catch (SocketException ex)
+            {
+                if (!kappenNu)
                 {
                     Debug.LogError("Error receiving UDP data: " + ex.Message);
                 }
+                continue;
             }
 
             // Store the received frame in the shared buffer and signal the main thread
@@ -291,12 +267,10 @@ public class PhospheneRenderer : MonoBehaviour
         // flag to stop background process that receives phosphene images
         kappenNu = true;
 
-        // close UDP socket
+        // tell Python to stop, and close UDP socket
+        FrameProtocol.SendShutdown(udpClient, fovSelector.return_serverIp(), fovSelector.return_serverPort());
         udpClient.Close();
         UdpClientActive = false;
-        
-        // create file to tell Python to stop
-        File.WriteAllText(shutdownFilePath, "shutdown");
     }
 
     public bool isPythonActive()
@@ -304,21 +278,6 @@ public class PhospheneRenderer : MonoBehaviour
         return pythonActive;
     }
 
-    private bool CompareArrays(byte[] a1, byte[] a2)
-    {
-        if (a1.Length != a2.Length)
-        {
-            return false;
-        }
-
-        for (int i = 0; i < a1.Length; i++)
-        {
-            if (a1[i] != a2[i])
-                return false;
-        }
-        return true;
-    }
-
 #if MEASURE_TIMES
     private void AppendMeasurementToJsonFile(long measurement, ref int measurementCounter, string filePath)
     {
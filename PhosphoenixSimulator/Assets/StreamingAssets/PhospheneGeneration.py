@@ -1,296 +1,467 @@
-import sys
 import time
+START_TIME = time.perf_counter()  # Start of the startup-time report, before the (slow) imports
+
+import argparse
+import os
+import sys
 import cv2
 import numpy as np
 import socket
-import struct
-import os
+import signal
 import threading
-import tkinter as tk
-from tkinter import ttk
-import importlib
-import inspect
-import json
-
-from dynaphos.image_processing import sobel_processor, canny_processor
-from dynaphos.simulator import GaussianSimulator
-from dynaphos.utils import load_params, load_coordinates_from_yaml, Map
-from dynaphos.cortex_models import get_visual_field_coordinates_from_cortex_full
-
-from base_processing_algorithm import BaseProcessingAlgorithm
-
-MEASURE_TIMES = False # Set to True to measure the times of receiving, processing and sending images
-N_TIME_MEASUREMENTS = 1000
-elapsed_times_r1 = []
-elapsed_times_proc = []
-elapsed_times_s2 = []
-
-# Paths for storing the files (hard-coded, please change them to match your desired directory)
-file_path_r1 = 'C:/Users/XR Zone/Documents/measurements_r1.json'
-file_path_proc = 'C:/Users/XR Zone/Documents/measurements_proc.json'
-file_path_s2 = 'C:/Users/XR Zone/Documents/measurements_s2.json'
-
-def write_measurements_to_json(file_path, elapsed_times):
-    stringified_times_ms = [str(round(t * 1000)) for t in elapsed_times]
-    data = {"measurements": stringified_times_ms}
-    with open(file_path, 'w') as json_file:
-        json.dump(data, json_file)
-    print("File stored at " + file_path + " is complete")
+import torch
+
+from dynaphos.cache import GeometryCache
+from dynaphos.simulator import REBUILD_PARAMS, GaussianSimulator, depends_on, get_changed_params
+from dynaphos.utils import load_params, set_thread_affinity
+from dynaphos.cortex_models import load_visual_field_coordinates
+from dynaphos.image_processing import Buffers
+
+from base_processing_algorithm import load_algorithm
+from streaming.buffers import TripleBuffer
+from streaming.encoding import FrameEncoder
+from streaming.instrumentation import Instrumentation, StartupTimer
+from streaming.pipeline import Pipeline
+from streaming.reload import ParamsWatcher
+from streaming.protocol import FRAME, SHUTDOWN, FrameBuffer, FrameReceiver, FrameSender, send_control
+from streaming.scheduler import FrameScheduler
+from streaming.shared_memory import FrameRing, SharedMemoryReceiver, SharedMemorySender, ring_name
 
 print("Python is running!")
+startup = StartupTimer(START_TIME)
+startup.mark('imports')
 
-if MEASURE_TIMES:
-    print("The timing files will be saved to: " + file_path_r1 + ", " + file_path_proc + " and " + file_path_s2)
-
-# UDP settings
-CHUNK_SIZE = 1024
-FRAME_DELIMITER = b"FRAME_DEL"
-EXIT_CODE = b"EXIT_CODE"
-
-# Set up server socket
+# Set up server socket (the ports are set per session in params.yaml)
 IP_IN = 'localhost'
-PORT_IN = 4906  # Port to listen on
 IP_OUT = 'localhost'
-PORT_OUT = 9003
 
-# flag if first image hath been received
-first_image_received = False
 
 
+# Get the shutdown file path from the command-line arguments. The file is no longer polled: Unity asks the server to
+# stop with a SHUTDOWN datagram (see streaming/protocol.py).
+parser = argparse.ArgumentParser(description="Phosphene simulation server for the Unity simulator.")
+parser.add_argument('shutdown_file')
+parser.add_argument('python_dir', help="Directory of this script, with params.yaml and the processing algorithms.")
+# resolution of phosphenes that are sent back to Unity
+parser.add_argument('cropWidthPixels', type=int)
+parser.add_argument('cropHeightPixels', type=int)
+parser.add_argument('--algorithm', default=None,
+                    help="Processing algorithm (class name) to start with, without the selection window. Overrides "
+                         "the algorithm in params.yaml.")
+args = parser.parse_args()
+shutdown_file = args.shutdown_file.strip('"')
+python_dir = args.python_dir.strip('"')
+cropWidthPixels = args.cropWidthPixels
+cropHeightPixels = args.cropHeightPixels
+
+class Session:
+    """A camera stream from Unity (e.g. one eye of a headset, or one of several headsets). Each session has its own
+    receiving socket and image buffers, its own batch element in the simulator (and thereby its own temporal state), and
+    its own port to which its phosphene images are sent.
+
+    Frames are transported either as UDP datagrams (see streaming/protocol.py), or through shared-memory rings (see
+    streaming/shared_memory.py), in which case the sockets only carry the wakeup signals."""
+
+    def __init__(self, index, port_in, port_out, server_params, scheduler, instrumentation):
+        self.index = index
+        self.port_in = port_in
+        self.port_out = port_out
+        self.scheduler = scheduler
+        self.instrumentation = instrumentation
+        # Cores of the receiving thread (see thread_cpus in params.yaml)
+        self.receive_cpus = (server_params['thread_cpus'] or {}).get('receive')
+        max_datagram_size = server_params['max_datagram_size']
+        frame_size = cropWidthPixels * cropHeightPixels
+
+        # Frames are received directly into the back buffer, and the main loop always takes the newest complete one
+        self.frames = TripleBuffer([FrameBuffer(frame_size, max_datagram_size) for _ in range(3)])
+        # The resized frame is reused as well
+        self.buffers = Buffers()
+
+        # flag if the stream has ended
+        self.stream_ended = False
+
+        # Open UDP sockets to receive data from Unity and to send data back
+        self.socket_in = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_in.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)  # Extra large buffer
+        self.socket_in.bind((IP_IN, self.port_in))
+        self.socket_out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_out.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+
+        transport = server_params['transport']
+        if transport == 'udp':
+            self.rings = []
+            self.receiver = FrameReceiver(self.socket_in, max_datagram_size)
+            # The phosphene frames are compressed, unless that does not pay off (see streaming/encoding.py)
+            self.encoder = None
+            if server_params['output_encoding'] != 'raw':
+                self.encoder = FrameEncoder(server_params['output_encoding'], frame_size,
+                                            server_params['output_max_ratio'], server_params['key_frame_interval'])
+            self.sender = FrameSender(self.socket_out, max_datagram_size, self.encoder)
+        elif transport == 'shared_memory':
+            num_slots = server_params['shared_memory_slots']
+            self.rings = [FrameRing.create(ring_name(port), frame_size, num_slots) for port in (port_in, port_out)]
+            self.receiver = SharedMemoryReceiver(self.socket_in, self.rings[0])
+            self.encoder = None
+            self.sender = SharedMemorySender(self.socket_out, self.rings[1])
+        else:
+            raise NotImplementedError(f"Unknown transport: {transport}")
+        print(f"Camera {transport} transport (in) working from Python side on port {self.port_in}")
+
+        self.receive_thread = threading.Thread(target=self.background_receive)
+
+    @property
+    def first_image_received(self):
+        return self.frames.produced > 0
+
+    @property
+    def active(self):
+        """Whether the session is streaming images."""
+        return self.first_image_received and not self.stream_ended
+
+    def read_frame(self, resolution):
+        """Read the most recent frame, resized to the simulation resolution (width, height). Also returns the id of the
+        frame and the time at which it started to arrive."""
+        frame = self.frames.acquire()
+        image = frame.image((cropHeightPixels, cropWidthPixels))
+        resized = self.buffers.get('resized', (resolution[1], resolution[0]), np.uint8)
+        return (cv2.resize(image, resolution, dst=resized, interpolation=cv2.INTER_LINEAR), frame.frame_id,
+                frame.received_at)
+
+    def send(self, image, trace=None):
+        """Send a phosphene image back to Unity. The encoding (see output_encoding in params.yaml) and the sending are
+        recorded as separate stages. Returns the time at which it was sent, if the frame is traced."""
+        start = self.instrumentation.now(trace)
+        if self.encoder is not None:
+            encoded = self.sender.encode(image)
+            start = self.instrumentation.record('encode', start, trace)
+            self.sender.send_encoded(encoded, (IP_OUT, self.port_out))
+        else:
+            self.sender.send(image, (IP_OUT, self.port_out))
+        return self.instrumentation.record('send', start, trace)
+
+    def stop(self):
+        """Wake up and stop the receiving thread."""
+        send_control(self.socket_out, (IP_IN, self.port_in), SHUTDOWN)
+        self.receive_thread.join()
+
+    def close(self):
+        self.socket_in.close()
+        self.socket_out.close()
+        for ring in self.rings:
+            ring.close()
+
+    # Function to receive a frame in the background
+    def background_receive(self):
+        IMAGE_SIZE = cropWidthPixels * cropHeightPixels
+        set_thread_affinity(self.receive_cpus)
+
+        while True:
+            try:
+                # Receive the next frame straight into the buffer that is being written
+                frame = self.frames.back
+                if not self.receiver.receive_into(frame):
+                    self.stream_ended = True
+                    if self.receiver.shutdown_requested:
+                        print(f"Background thread: shutdown requested on port {self.port_in}. Stopping.")
+                        self.scheduler.request_shutdown()
+                        break
+                    # Keep listening, as the stream may be restarted
+                    print(f"Background thread: exit code detected on port {self.port_in}.")
+                    self.scheduler.notify()
+                    continue
+                if frame.kind != FRAME or frame.length != IMAGE_SIZE:
+                    print(f"Dropped a frame of {frame.length} bytes (expected {IMAGE_SIZE})")
+                    continue
+                print("Frame Complete")
+
+                if self.instrumentation.sampled(frame.frame_id):
+                    self.instrumentation.record_duration('receive', frame.completed_at - frame.received_at)
+                    self.instrumentation.record_duration('reassembly', time.perf_counter() - frame.completed_at)
+
+                # Hand the frame over to the main loop
+                self.stream_ended = False
+                self.frames.publish()
+                self.scheduler.notify()
+
+            except socket.error as e:
+                print(f"Socket error: {e}")
+                break
 
-# Get the shutdown file path from the command-line argument
-if len(sys.argv) == 5:
-    shutdown_file = sys.argv[1].strip('"')
-    python_dir = sys.argv[2].strip('"')
-
-    # resolution of phosphenes that are sent back to Unity
-    cropWidthPixels = int(sys.argv[3])
-    cropHeightPixels = int(sys.argv[4])
+        print(f"Port {self.port_in}: received {self.receiver.frames_received} frames and dropped "
+              f"{self.receiver.frames_dropped}; processed {self.frames.consumed} and skipped {self.frames.overwritten}")
 
-else:
-    print("Incorrect program arguments! We need 4 of them.", flush=True)
-    sys.exit(1)
 
-# Buffers and control variables
-buffers = [np.zeros((cropHeightPixels, cropWidthPixels), dtype=np.uint8) for _ in range(2)]
-most_recent_image = 0
-is_reading_image_buffer = False
-image_being_written = 1
+def load_simulator(params: dict, cache=None):
+    """Sample the phosphene locations from the electrode layout and set up a simulator for them."""
+    coordinates_visual_field = load_visual_field_coordinates(
+        params['cortex_model'], python_dir + '/grid_coords_dipole_valid.npz',
+        n_coordinates=params['server']['num_electrodes'], seed=params['run']['seed'], cache=cache)
+    return GaussianSimulator(params, coordinates_visual_field, cache=cache)
 
-# Function to receive a frame in the background
-def background_receive(socket_in):
-    global most_recent_image, is_reading_image_buffer, image_being_written, first_image_received, elapsed_times_r1
-    frame_data = bytearray()  # Accumulate image data here
-    IMAGE_SIZE = cropWidthPixels * cropHeightPixels  # Adjust this to your image size
-    
-    started_recording_time = False
 
-    while True:
-        if os.path.exists(shutdown_file):
-            print("Background thread: Shutdown file detected. Stopping.")
+def main(params: dict, algorithm, FilterApp=None):
+    # Load coordinates and set up simulator
+    if FilterApp is not None:
+        FilterApp.destroy()
+    startup.mark('algorithm_selected')
+
+    # Threads of torch, and the cores of the threads, so that the stages do not compete for them (see torch_threads and
+    # thread_cpus in params.yaml). The threads that are started later take over the number of torch threads.
+    if params['server']['torch_threads']:
+        torch.set_num_threads(params['server']['torch_threads'])
+    thread_cpus = params['server']['thread_cpus'] or {}
+    if thread_cpus and not hasattr(os, 'sched_setaffinity'):
+        print("Threads can only be pinned to cores on Linux; thread_cpus is ignored.")
+    set_thread_affinity(thread_cpus.get('main'))
+
+    # One session per camera stream. When serving several streams (e.g. both eyes, or several headsets), their frames
+    # are processed as one batch, with one batch element (and thereby separate temporal dynamics) per session.
+    scheduler = FrameScheduler(params['run']['fps'], params['server']['schedule'])
+    instrumentation = Instrumentation(**params['server']['instrumentation'], startup=startup)
+    sessions = [Session(i, port_in, port_out, params['server'], scheduler, instrumentation)
+                for i, (port_in, port_out) in enumerate(params['server']['sessions'])]
+    batched = len(sessions) > 1
+
+    def set_server_params(run_params: dict, server_params: dict):
+        """Settings of the simulator that follow from the server: the sessions are simulated as one batch, and
+        rendered at the size of the images sent to Unity (see render_at_crop_size in params.yaml)."""
+        if batched:
+            run_params['batch_size'] = len(sessions)
+        if server_params['render_at_crop_size']:
+            run_params['output_resolution'] = [cropWidthPixels, cropHeightPixels]
+
+    set_server_params(params['run'], params['server'])
+
+    # The phosphene locations and the geometry of the simulator are loaded from the cache when they were computed
+    # before with the same parameters
+    cache = None
+    if params['run']['cache_dir'] is not None:
+        cache = GeometryCache(params['run']['cache_dir'], params['run']['cache_max_entries'])
+    simulator = load_simulator(params, cache)
+    no_stimulation = torch.zeros(simulator.num_phosphenes, **simulator.data_kwargs)
+    startup.mark('simulator')
+
+    # Stop when Unity asks for it, or on Ctrl+C
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGINT, scheduler.request_shutdown)
+        signal.signal(signal.SIGTERM, scheduler.request_shutdown)
+
+    # Start background threads to receive images from Unity
+    for session in sessions:
+        session.receive_thread.start()
+
+    while not any(session.first_image_received for session in sessions):
+        if not scheduler.wait_for_frame():
             break
-
-        try:
-            # Receive data
-            chunk, addr = socket_in.recvfrom(CHUNK_SIZE)
-
-            # Check for exit code
-            if chunk == EXIT_CODE:
-                print("Background thread: exit code detected. Stopping.")
-                break
-
-            # Check for the frame delimiter
-            if chunk == FRAME_DELIMITER:
-                if len(frame_data) >= IMAGE_SIZE:
-                    print("Frame Complete")
-
-                    # Convert the frame data into an image buffer
-                    frame_array = np.frombuffer(frame_data[:IMAGE_SIZE], dtype=np.uint8)
-                    frame_array = frame_array.reshape((cropHeightPixels, cropWidthPixels))
-
-                    # Write the frame to the buffer
-                    buffers[image_being_written][:] = frame_array
-
-                    # Switch to the next buffer
-                    next_buffer = (image_being_written + 1) % 2
-                    if not is_reading_image_buffer:
-                        most_recent_image = image_being_written
-                        image_being_written = next_buffer
-
-                    # Reset for the next frame
-                    frame_data = bytearray()
-
-                    # Signal that the first image has been received
-                    if not first_image_received:
-                        first_image_received = True
-                    
-                    if MEASURE_TIMES:
-                        end_time = time.time()
-                        elapsed_time = end_time - start_time  # Calculate elapsed time in seconds
-                        print("timed something")
-                        if len(elapsed_times_r1) < N_TIME_MEASUREMENTS:
-                            elapsed_times_r1.append(elapsed_time)  # Store the elapsed time
-                        elif len(elapsed_times_r1) == N_TIME_MEASUREMENTS:
-                            write_measurements_to_json(file_path_r1, elapsed_times_r1)
-                        started_recording_time = False  
+    startup.mark('first_camera_frame')
+
+    # The processing of a frame is split into three stages, which either run in sequence, or as a pipeline of worker
+    # threads (see the pipelined setting in params.yaml)
+    was_active = [False] * len(sessions)
+
+    # Changes of params.yaml are applied between frames (see reconfigure below): the new simulator and algorithm are
+    # prepared while the frames continue, and then swapped in. The lock only guards the references to them, which each
+    # stage takes at the start of a frame, and frames that were preprocessed for a previous simulator (generation)
+    # with other phosphenes are dropped.
+    simulator_lock = threading.Lock()
+    generation = 0
+    # The simulator the simulate stage renders with (the previous one until it switches, between two frames)
+    current_simulator = simulator
+
+    # The frames are rendered into a ring of buffers, so that a buffer is only reused once its frame was sent
+    output_buffers = Buffers()
+    num_output_buffers = params['server']['queue_depths'][2] + 2
+    frames_rendered = 0
+
+    # Each frame carries its trace (None if the frame is not sampled by the instrumentation), the generation of the
+    # simulator, whether each session was active, and the id and arrival time of the camera frame of each session
+    def preprocess(tick):
+        trace = instrumentation.start_trace(tick)
+        with simulator_lock:
+            item_params, item_algorithm, item_simulator, item_generation = params, algorithm, simulator, generation
+            item_no_stimulation = no_stimulation
+        resolution = item_params['run']['resolution']
+        active = [session.active for session in sessions]
+        sources = []
+        stim_patterns = []
+        for session, is_active in zip(sessions, active):
+            if is_active:
+                # Process the most recent frame of each session using the selected algorithm
+                start = instrumentation.now(trace)
+                frame, frame_id, received_at = session.read_frame(resolution)
+                start = instrumentation.record('resize', start, trace)
+                stim_patterns.append(item_algorithm.process(frame, item_params, item_simulator))
+                instrumentation.record('algorithm', start, trace)
+                sources.append((frame_id, received_at))
             else:
-                if MEASURE_TIMES and not started_recording_time:
-                    start_time = time.time() 
-                    started_recording_time = True
-                # Accumulate the data from each chunk
-                frame_data.extend(chunk)
-
-        except socket.error as e:
-            print(f"Socket error: {e}")
-            break
-
-
-# Initialize the GUI application
-class FilterApp(tk.Tk):
-    def __init__(self):
-        super().__init__()
-        self.title("Algorithm Selection")
-
-        # Dropdown for selecting filters
-        self.filter_var = tk.StringVar(self)
-        self.filter_dropdown = ttk.Combobox(self, textvariable=self.filter_var)
-        self.filter_dropdown.set("Select Algorithm")  # Set default value
-        self.filter_dropdown.pack(pady=10)
-
-        # Button to start the video processing
-        self.start_button = ttk.Button(self, text="Start Simulation", command=self.start_processing)
-        self.start_button.pack(pady=10)
-
-        # Populate the dropdown with available formatters
-        self.algorithms = self.get_algorithms()
-        self.filter_dropdown['values'] = list(self.algorithms.keys())
-
-    def get_algorithms(self):
-        # Dictionary to hold algorithm classes
-        algorithms_dict = {}
-
-        # Loop through all the files in the algorithms/ directory.
-        for file in [f for f in os.listdir(python_dir + "/processing_algorithms") if f.endswith(".py") and not f.startswith("__")]:
-            module_name = file.split(".")[0]
-            if module_name:
-                try:
-                    # Import that module dynamically.
-                    module = importlib.import_module(f"processing_algorithms.{module_name}")
-                    # Get all the classes present in the module.
-                    classes = inspect.getmembers(module, inspect.isclass)
-
-                    for name, algorithm_class in classes:
-                        if issubclass(algorithm_class, BaseProcessingAlgorithm) and name != "BaseProcessingAlgorithm":
-                            algorithms_dict[name] = algorithm_class
-                except ModuleNotFoundError as e:
-                    print(f"Error importing {module_name}: {e}")
-        return algorithms_dict
-
-    def start_processing(self):
-        # Get the selected filter
-        algorithm_name = self.filter_var.get()
-        if algorithm_name in self.algorithms:
-            algorithm_class = self.algorithms[algorithm_name]
-            algorithm = algorithm_class()
-
-            _params = load_params(python_dir + '/params.yaml')
-            #_in_video = 0  # use 0 for webcam, or string with video path
-            main(_params, algorithm, self)  # Pass selected filter
+                stim_patterns.append(item_no_stimulation)
+                sources.append((None, None))
+        print("Read a new frame")
+        return trace, item_generation, active, sources, stim_patterns
+
+    def simulate(item):
+        nonlocal frames_rendered, current_simulator
+        trace, item_generation, active, sources, stim_patterns = item
+        with simulator_lock:
+            item_simulator, current_generation = simulator, generation
+        if item_generation != current_generation:
+            return None
+        if item_simulator is not current_simulator:
+            # Switch to the new simulator, which continues from the state of the previous one (if it is a reconfigured
+            # copy of it)
+            item_simulator.take_state(current_simulator)
+            current_simulator.close()
+            current_simulator = item_simulator
+        for session, is_active in zip(sessions, active):
+            # Sessions that are not streaming (yet) are not stimulated, and start from a clean state
+            if was_active[session.index] and not is_active:
+                item_simulator.reset(session.index)
+            was_active[session.index] = is_active
+
+        # Generate phosphenes for all sessions at once
+        stim_pattern = torch.stack(stim_patterns) if batched else stim_patterns[0]
+        width, height = item_simulator.output_resolution
+        phosphenes = output_buffers.get(f'phosphenes{frames_rendered % num_output_buffers}',
+                                        (len(sessions), height, width), np.uint8)
+        frames_rendered += 1
+        out = torch.from_numpy(phosphenes if batched else phosphenes[0])
+        start = instrumentation.now(trace)
+        if item_simulator.compiled:
+            # The update and render are one graph, timed as the render
+            item_simulator.step(stim_pattern, out=out)
         else:
-            print("Please select a valid filter!")
-
+            item_simulator.update(stim_pattern)
+            start = instrumentation.record('update', start, trace)
+            item_simulator.render_frame(out=out)
+        instrumentation.record('render', start, trace)
+        return trace, active, sources, phosphenes
+
+    def send(item):
+        trace, active, sources, phosphenes = item
+        output_ids = []
+        glass_to_glass = []
+        for session, is_active, (_, received_at), session_phosphenes in zip(sessions, active, sources, phosphenes):
+            if not is_active:
+                output_ids.append(None)
+                glass_to_glass.append(None)
+                continue
+
+            if session_phosphenes.shape != (cropHeightPixels, cropWidthPixels):
+                # Not rendered at the crop size (see render_at_crop_size in params.yaml)
+                start = instrumentation.now(trace)
+                session_phosphenes = cv2.resize(session_phosphenes, (cropWidthPixels, cropHeightPixels),
+                                                interpolation=cv2.INTER_LINEAR)
+                instrumentation.record('output_resize', start, trace)
+
+            # Send data back to Unity
+            end = session.send(session_phosphenes, trace)
+            output_ids.append(session.sender.frame_id)
+            if trace is not None:
+                # From the arrival of the camera frame until its phosphenes were sent
+                instrumentation.record_duration('glass_to_glass', end - received_at)
+                glass_to_glass.append((end - received_at) * 1000)
+        if startup.mark('first_phosphene_frame'):
+            print(f"Startup: {startup.format()}")
+        instrumentation.finish_trace(trace, frame_ids=[frame_id for frame_id, _ in sources], output_ids=output_ids,
+                                     glass_to_glass=glass_to_glass)
+
+    def reconfigure(new_params):
+        """Apply changed parameters while the streams continue: switch to another algorithm, and change the simulator
+        in place where possible (see GaussianSimulator.reconfigure), or replace it by a new one."""
+        nonlocal params, algorithm, simulator, no_stimulation, generation
+        set_server_params(new_params['run'], new_params['server'])
+        changed = get_changed_params(params, new_params)
+        restart = sorted(f'server.{key}' for section, key in changed if section == 'server' and
+                         key not in ('algorithm', 'num_electrodes', 'reload_interval', 'render_at_crop_size'))
+        if restart:
+            print(f"Restart the server to apply the changes of {', '.join(restart)}.")
+
+        # The new algorithm and simulator are prepared while the frames continue with the current ones (this thread
+        # is the only one that changes the references, so they can be read without the lock)
+        new_algorithm = algorithm
+        name = new_params['server']['algorithm']
+        if ('server', 'algorithm') in changed and name:
+            new_algorithm = load_algorithm(name, python_dir + "/processing_algorithms")()
+        new_simulator = simulator
+        parts = []
+        if depends_on(changed, {**REBUILD_PARAMS, 'server': ('num_electrodes',)}):
+            new_simulator = load_simulator(new_params, cache)
+            parts = ['simulator']
+        elif any(section != 'server' for section, _ in changed):
+            # A copy is reconfigured, so that a failure leaves the current simulator as it is
+            new_simulator = simulator.copy()
+            try:
+                parts = new_simulator.reconfigure(new_params)
+            except Exception:
+                new_simulator.close()
+                raise
+        new_no_stimulation = no_stimulation
+        if new_simulator.num_phosphenes != simulator.num_phosphenes or 'simulator' in parts:
+            new_no_stimulation = torch.zeros(new_simulator.num_phosphenes, **new_simulator.data_kwargs)
+
+        with simulator_lock:
+            if new_no_stimulation is not no_stimulation:
+                generation += 1
+            simulator, algorithm, no_stimulation, params = new_simulator, new_algorithm, new_no_stimulation, new_params
+        scheduler.period = 1 / params['run']['fps']
+        print(f"Applied the new parameters (algorithm: {type(algorithm).__name__}; recomputed: "
+              f"{', '.join(parts) or 'nothing'}).")
+
+    watcher = None
+    if params['server']['reload_params']:
+        watcher = ParamsWatcher(python_dir + '/params.yaml', load_params, params['server']['reload_interval'])
+
+    pipeline = None
+    if params['server']['pipelined']:
+        # While frame k is simulated, frame k + 1 is preprocessed and frame k - 1 is sent. When a stage falls behind,
+        # the oldest frame in its queue is dropped.
+        pipeline = Pipeline([('preprocess', preprocess), ('simulate', simulate), ('send', send)],
+                            params['server']['queue_depths'], thread_cpus)
+        pipeline.start()
+
+    # Main loop, which sleeps until the next frame is due (see the schedule setting in params.yaml)
+    instrumentation.start()
+    tick = 0
+    while scheduler.wait():
+        new_params = watcher.poll() if watcher is not None else None
+        if new_params is not None:
+            try:
+                reconfigure(new_params)
+            except Exception as e:
+                print(f"Could not apply the new parameters: {e!r}")
+        if pipeline is not None:
+            pipeline.submit(tick)
+        else:
+            send(simulate(preprocess(tick)))
+        tick += 1
+
+    print("Python received a shutdown request! Stopping now.")
+    print(f"Main loop: {scheduler.summary()}")
+    if pipeline is not None:
+        pipeline.close()
+        print(f"Pipeline: {pipeline.summary()}")
+    instrumentation.stop()
+    print(f"Latency per stage:\n{instrumentation.format_summary()}")
+    for session in sessions:
+        session.stop()
+        session.close()
+        if session.encoder is not None:
+            print(f"Port {session.port_out}: {session.encoder.summary()}")
 
-def main(params: dict, algorithm, FilterApp):
-    global data, is_reading_image_buffer
-    # Load coordinates and set up simulator
-    FilterApp.destroy()
-    coordinates_cortex = load_coordinates_from_yaml(python_dir + '/grid_coords_dipole_valid.yaml', n_coordinates=1500)
-    coordinates_cortex = Map(*coordinates_cortex)
-    coordinates_visual_field = get_visual_field_coordinates_from_cortex_full(params['cortex_model'], coordinates_cortex)
-    simulator = GaussianSimulator(params, coordinates_visual_field)
-    resolution = params['run']['resolution']
-    fps = params['run']['fps']
-
-    # Open a UDP socket to receive data from Unity
-    socket_in = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    socket_in.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)  # Extra large buffer
-    socket_in.bind((IP_IN, PORT_IN))
-    print("Camera socket (in) working from Python side")
-
-    # Open out socket to send data back to Unity (UDP)
-    socket_out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    print("Phosphene socket (out) working from Python side")
-
-    # Start background thread to receive image from Unity
-    receive_thread = threading.Thread(target=background_receive, args=(socket_in,))
-    receive_thread.start()
-
-    while not first_image_received:
-        time.sleep(0.1)
-
-    # Main loop
-    prev = 0
-
-    while True:
-        if os.path.exists(shutdown_file):
-            print("Python found a shutdown file! Stopping now.")
-            break
+    print("Python is done <3")
 
-        # Fix the framerate
-        time_elapsed = time.time() - prev
-        if time_elapsed > 1 / fps:
-            if MEASURE_TIMES:
-                start_time = time.time() 
-            prev = time.time()
-
-            # Read the frame from the buffer and apply Gaussian blur
-            is_reading_image_buffer = True
-            frame = cv2.resize(buffers[most_recent_image], resolution, cv2.INTER_LINEAR)
-            is_reading_image_buffer = False
-            print("Read a new frame")
-
-            # Process the frame using the selected algorithm
-            stim_pattern = algorithm.process(frame, params, simulator)
-            #start_time = time.time()
-
-            # Generate phosphenes
-            phosphenes = simulator(stim_pattern)
-            phosphenes = phosphenes.cpu().numpy() * 255
-            phosphenes = np.round(phosphenes).astype('uint8')
-
-            resizedPhosphenes = cv2.resize(phosphenes, (cropWidthPixels, cropHeightPixels), interpolation=cv2.INTER_LINEAR)
-            data = resizedPhosphenes.tobytes()
-
-            if MEASURE_TIMES:
-                end_time = time.time()
-                elapsed_time = end_time - start_time  # Calculate elapsed time in seconds
-                if len(elapsed_times_proc) < N_TIME_MEASUREMENTS:
-                    elapsed_times_proc.append(elapsed_time)  # Store the elapsed time
-                elif len(elapsed_times_proc) == N_TIME_MEASUREMENTS:
-                    write_measurements_to_json(file_path_proc, elapsed_times_proc)
-                start_time = time.time()
-
-            # Send data via UDP
-            socket_out.sendto(FRAME_DELIMITER, (IP_OUT, PORT_OUT))
-            for i in range(0, len(data), CHUNK_SIZE):
-                socket_out.sendto(data[i:min(i + CHUNK_SIZE, len(data))], (IP_OUT, PORT_OUT))
-            if MEASURE_TIMES:
-                end_time = time.time()
-                elapsed_time = end_time - start_time  # Calculate elapsed time in seconds
-                if len(elapsed_times_s2) < N_TIME_MEASUREMENTS:
-                    elapsed_times_s2.append(elapsed_time)  # Store the elapsed time
-                elif len(elapsed_times_s2) == N_TIME_MEASUREMENTS:
-                    write_measurements_to_json(file_path_s2, elapsed_times_s2)
-            
-
-
-    receive_thread.join()
-    socket_in.close()
-    socket_out.close()
+def start(algorithm, app=None):
+    main(load_params(python_dir + '/params.yaml'), algorithm, app)
 
-    print("Python is done <3")
 
 if __name__ == '__main__':
-    app = FilterApp()
-    app.mainloop()
+    algorithm_name = args.algorithm or load_params(python_dir + '/params.yaml')['server']['algorithm']
+    if algorithm_name:
+        # Headless: start right away, without importing tkinter
+        start(load_algorithm(algorithm_name, python_dir + "/processing_algorithms")())
+    else:
+        from filter_app import FilterApp
+        app = FilterApp(python_dir, start)
+        app.mainloop()
     sys.exit()
\ No newline at end of file
@@ -1,12 +1,76 @@
 from abc import ABC, abstractmethod
+import ast
+import importlib
+import os
+from typing import TYPE_CHECKING, Dict
 
-import numpy as np
-import torch
-from dynaphos.simulator import GaussianSimulator
+if TYPE_CHECKING:
+    # Only imported for the annotations, so that algorithms can be found without importing torch
+    import numpy as np
+    import torch
+    from dynaphos.simulator import GaussianSimulator
 
 class BaseProcessingAlgorithm(ABC):
     "Defines an interface for all image processing algorithms."
 
+    def __init__(self):
+        # Images that are reused between frames (see dynaphos.image_processing.Buffers), imported here so that algorithms
+        # can be found without importing cv2 and torch
+        from dynaphos.image_processing import Buffers
+        self.buffers = Buffers()
+
     @abstractmethod
-    def process(self, data: np.ndarray, params: dict, simulator: GaussianSimulator) -> torch.Tensor:
+    def process(self, data: 'np.ndarray', params: dict, simulator: 'GaussianSimulator') -> 'torch.Tensor':
         raise NotImplementedError
+
+
+def find_algorithms(directory: str) -> Dict[str, str]:
+    """Find all algorithms (subclasses of BaseProcessingAlgorithm) in the modules of a package directory, without
+    importing them: the source of each module is parsed instead. Subclasses of algorithms in other modules of the
+    directory are found as well, as long as the base class is referred to by its name.
+
+    :param directory: Directory of the package.
+    :return: Names of the modules the algorithm classes are defined in, by class name.
+    """
+    bases = {}
+    modules = {}
+    for file in sorted(f for f in os.listdir(directory) if f.endswith(".py") and not f.startswith("__")):
+        module_name = file.split(".")[0]
+        with open(os.path.join(directory, file), 'rb') as f:
+            try:
+                tree = ast.parse(f.read(), file)
+            except SyntaxError as e:
+                print(f"Error parsing {module_name}: {e}")
+                continue
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef):
+                bases[node.name] = [base.attr if isinstance(base, ast.Attribute) else getattr(base, 'id', None)
+                                    for base in node.bases]
+                modules[node.name] = module_name
+
+    algorithms = {}
+    found = True
+    while found:
+        found = False
+        for name, class_bases in bases.items():
+            if name not in algorithms and any(base == BaseProcessingAlgorithm.__name__ or base in algorithms
+                                              for base in class_bases):
+                algorithms[name] = modules[name]
+                found = True
+    return dict(sorted(algorithms.items()))
+
+
+def load_algorithm(name: str, directory: str, package: str = 'processing_algorithms') -> type:
+    """Import the module of one algorithm (see find_algorithms) and return its class.
+
+    :param name: Class name of the algorithm.
+    :param directory: Directory of the package.
+    :param package: Name under which the package is imported.
+    """
+    algorithms = find_algorithms(directory)
+    if name not in algorithms:
+        raise ValueError(f"Unknown algorithm: {name} (available: {', '.join(algorithms)})")
+    algorithm_class = getattr(importlib.import_module(f"{package}.{algorithms[name]}"), name)
+    if not issubclass(algorithm_class, BaseProcessingAlgorithm):
+        raise ValueError(f"{name} is not a BaseProcessingAlgorithm.")
+    return algorithm_class
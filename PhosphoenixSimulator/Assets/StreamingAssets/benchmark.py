@@ -0,0 +1,396 @@
+"""Offline benchmark of the phosphene pipeline, without Unity.
+
+Feeds recorded (--video) or synthetic grayscale frames of the size Unity sends
+through the same steps as the main loop of PhospheneGeneration.py: resizing to
+the simulation resolution, the processing algorithm, the simulator update and
+render (into a reused uint8 buffer), and resizing to the output size if the
+phosphenes are not rendered at that size (see render_at_crop_size in
+params.yaml). The network is left out.
+
+The tiled renderer can be measured with different numbers of render workers
+(--render-workers 1 2 4 8); the scaling w.r.t. one worker is then reported.
+
+Every combination of the swept settings runs in a fresh process, so that the
+peak memory of one configuration does not carry over to the next. The results
+(frames per second, latency percentiles per stage and peak RSS, plus the
+versions and commit they were measured on) are written as JSON, and can be
+compared against an earlier run with --compare.
+
+Example:
+
+    python benchmark.py --electrodes 500 1500 --resolutions 128 256 \\
+        --algorithms Canny100DefaultAlgorithm --output results.json
+"""
+import argparse
+import copy
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+from base_processing_algorithm import find_algorithms, load_algorithm
+from dynaphos.cache import GeometryCache
+from dynaphos.cortex_models import load_visual_field_coordinates
+from dynaphos.simulator import GaussianSimulator
+from dynaphos.utils import get_num_cpus, load_params
+from streaming.instrumentation import Instrumentation
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+STAGES = ('resize', 'algorithm', 'update', 'render', 'output_resize',
+          'frame')
+
+# Settings that are swept, and the entry of the params they set.
+SWEEP = (('electrodes', None), ('resolution', ('run', 'resolution')),
+         ('dtype', ('run', 'dtype')),
+         ('sampling_method', ('sampling', 'sampling_method')),
+         ('renderer', ('run', 'renderer')),
+         ('render_workers', ('run', 'render_workers')), ('algorithm', None))
+
+
+def parse_resolution(text: str) -> List[int]:
+    """'256' or '256x192' (width x height)."""
+    width, _, height = text.lower().partition('x')
+    return [int(width), int(height or width)]
+
+
+def get_peak_rss() -> Optional[float]:
+    """Peak resident set size of this process, in MB (None if unknown)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=DIRECTORY, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_frames(video: Optional[str], size: Tuple[int, int],
+                num_frames: int) -> List[np.ndarray]:
+    """Grayscale uint8 frames of the given (width, height) size.
+
+    :param video: Video (or image sequence) readable by cv2.VideoCapture. If
+        None, synthetic frames are generated: a moving gradient with moving
+        bars and discs, so that the edge detectors have edges to find.
+    :param size: Frame size (width, height).
+    :param num_frames: Maximum number of frames. The frames are repeated when
+        the benchmark runs longer.
+    """
+    width, height = size
+    frames = []
+    if video is not None:
+        capture = cv2.VideoCapture(video)
+        while len(frames) < num_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if frame.ndim == 3:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            frames.append(cv2.resize(frame, size))
+        capture.release()
+        if not frames:
+            raise ValueError(f"Could not read any frames from {video}.")
+        return frames
+
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[:height, :width]
+    discs = rng.uniform(0, 1, (8, 4))  # x, y, radius, speed
+    for i in range(num_frames):
+        t = i / num_frames
+        frame = (64 + 64 * np.sin(2 * np.pi * (x / width + t))).astype(np.uint8)
+        for j in range(4):
+            offset = int((j / 4 + t) * width) % width
+            frame[:, offset:offset + width // 40] = 255
+        for cx, cy, radius, speed in discs:
+            cx = (cx + speed * t) % 1 * width
+            cy = (cy + speed * t / 2) % 1 * height
+            inside = (x - cx) ** 2 + (y - cy) ** 2 < \
+                (radius * min(width, height) / 6) ** 2
+            frame[inside] = 200
+        frames.append(frame)
+    return frames
+
+
+def run_configuration(config: dict, args: argparse.Namespace) -> dict:
+    """Benchmark one configuration (one combination of the swept
+    settings)."""
+    params = load_params(args.params)
+    for name, key in SWEEP:
+        if key is not None:
+            section, entry = key
+            params[section][entry] = copy.deepcopy(config[name])
+    output_size = tuple(args.output_size)
+    if params['server']['render_at_crop_size']:
+        params['run']['output_resolution'] = list(output_size)
+    if args.compile:
+        params['run']['compile'] = True
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    start = time.perf_counter()
+    algorithm = load_algorithm(config['algorithm'], os.path.join(
+        DIRECTORY, 'processing_algorithms'))()
+    cache = None if args.cache_dir is None else GeometryCache(args.cache_dir)
+    coordinates_visual_field = load_visual_field_coordinates(
+        params['cortex_model'],
+        os.path.join(DIRECTORY, 'grid_coords_dipole_valid.npz'),
+        config['electrodes'], params['run']['seed'], cache)
+    simulator = GaussianSimulator(params, coordinates_visual_field,
+                                  cache=cache)
+    setup_time = time.perf_counter() - start
+
+    resolution = params['run']['resolution']
+    width, height = simulator.output_resolution
+    phosphenes = np.empty((height, width), np.uint8)
+    output = torch.from_numpy(phosphenes)
+    frames = load_frames(args.video, output_size,
+                         min(args.frames + args.warmup, 256))
+    instrumentation = Instrumentation(stages=STAGES)
+
+    def process(frame: np.ndarray, trace: Optional[dict]):
+        # The steps of the main loop of PhospheneGeneration.py
+        start = instrumentation.now(trace)
+        frame = cv2.resize(frame, resolution, cv2.INTER_LINEAR)
+        start = instrumentation.record('resize', start, trace)
+        stim_pattern = algorithm.process(frame, params, simulator)
+        start = instrumentation.record('algorithm', start, trace)
+        if simulator.compiled:
+            simulator.step(stim_pattern, out=output)
+        else:
+            simulator.update(stim_pattern)
+            start = instrumentation.record('update', start, trace)
+            simulator.render_frame(out=output)
+        start = instrumentation.record('render', start, trace)
+        if (width, height) != output_size:
+            cv2.resize(phosphenes, output_size,
+                       interpolation=cv2.INTER_LINEAR)
+            instrumentation.record('output_resize', start, trace)
+
+    for i in range(args.warmup):
+        process(frames[i % len(frames)], None)
+
+    start = time.perf_counter()
+    for i in range(args.frames):
+        trace = instrumentation.start_trace(i)
+        frame_start = instrumentation.now(trace)
+        process(frames[(args.warmup + i) % len(frames)], trace)
+        instrumentation.record('frame', frame_start, trace)
+    elapsed = time.perf_counter() - start
+
+    stages = instrumentation.summary()
+    return dict(config=config, num_phosphenes=simulator.num_phosphenes,
+                output_resolution=[width, height],
+                compiled=simulator.compiled,
+                frames=args.frames, fps=args.frames / elapsed,
+                p50_ms=stages['frame']['p50'], p99_ms=stages['frame']['p99'],
+                stages=stages, setup_s=setup_time,
+                peak_rss_mb=get_peak_rss(),
+                torch_threads=torch.get_num_threads())
+
+
+def _run_in_child(config: dict, args: argparse.Namespace,
+                  connection) -> None:
+    try:
+        connection.send(run_configuration(config, args))
+    except Exception as e:
+        connection.send(dict(config=config, error=repr(e)))
+    connection.close()
+
+
+def run_isolated(config: dict, args: argparse.Namespace) -> dict:
+    """Benchmark a configuration in a fresh process."""
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_in_child,
+                              args=(config, args, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = dict(config=config, error=f"Benchmark process exited with "
+                                           f"code {process.exitcode}")
+    process.join()
+    return result
+
+
+def get_configurations(args: argparse.Namespace) -> List[dict]:
+    params = load_params(args.params)
+    algorithms = list(find_algorithms(os.path.join(DIRECTORY,
+                                                   'processing_algorithms')))
+    for algorithm in args.algorithms or []:
+        if algorithm not in algorithms:
+            raise ValueError(f"Unknown algorithm: {algorithm} (available: "
+                             f"{', '.join(algorithms)})")
+    values = dict(
+        electrodes=args.electrodes,
+        resolution=args.resolutions or [params['run']['resolution']],
+        dtype=args.dtypes or [params['run']['dtype']],
+        sampling_method=args.sampling_methods or
+        [params['sampling']['sampling_method']],
+        renderer=args.renderers or [params['run']['renderer']],
+        render_workers=args.render_workers or
+        [params['run']['render_workers']],
+        algorithm=args.algorithms or algorithms)
+    configurations = [dict(zip(values, combination)) for combination in
+                      itertools.product(*values.values())]
+    # The number of render workers only matters for the tiled renderer.
+    return [config for config in configurations if
+            config['renderer'] == 'tiled' or
+            config['render_workers'] == values['render_workers'][0]]
+
+
+def format_config(config: dict) -> str:
+    width, height = config['resolution']
+    renderer = config['renderer']
+    if renderer == 'tiled':
+        workers = config['render_workers']
+        renderer += f" ({workers or 'all'} worker{'' if workers == 1 else 's'})"
+    return (f"{config['electrodes']} electrodes, {width}x{height}, "
+            f"{config['dtype']}, {config['sampling_method']}, "
+            f"{renderer}, {config['algorithm']}")
+
+
+def print_scaling(results: List[dict]):
+    """Print the speedup of the render stage and the frame rate with more
+    render workers, w.r.t. one worker (tiled renderer)."""
+    one_worker = {}
+    for result in results:
+        config = result['config']
+        if 'error' not in result and config['renderer'] == 'tiled' and \
+                config['render_workers'] == 1:
+            one_worker[json.dumps({**config, 'render_workers': None},
+                                  sort_keys=True)] = result
+    lines = []
+    for result in results:
+        config = result['config']
+        base = one_worker.get(json.dumps({**config, 'render_workers': None},
+                                         sort_keys=True))
+        if base is None or 'error' in result or base is result:
+            continue
+        render_speedup = base['stages']['render']['p50'] / \
+            result['stages']['render']['p50']
+        lines.append(f"{format_config(config)}: render {render_speedup:.2f}x, "
+                     f"frames/s {result['fps'] / base['fps']:.2f}x")
+    if lines:
+        print(f"\nScaling w.r.t. one render worker ({get_num_cpus()} cores "
+              f"available):")
+        print('\n'.join(lines))
+
+
+def compare(results: List[dict], baseline_path: str):
+    """Print the change in frame rate and latency w.r.t. an earlier run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {json.dumps(result['config'], sort_keys=True): result
+                for result in baseline['results'] if 'error' not in result}
+    print(f"\nCompared to {baseline_path} (commit "
+          f"{baseline['environment']['commit']}):")
+    for result in results:
+        old = previous.get(json.dumps(result['config'], sort_keys=True))
+        if old is None or 'error' in result:
+            continue
+        print(f"{format_config(result['config'])}: "
+              f"{(result['fps'] / old['fps'] - 1) * 100:+.1f}% frames/s, "
+              f"{(result['p99_ms'] / old['p99_ms'] - 1) * 100:+.1f}% p99")
+
+
+def get_environment(args: argparse.Namespace) -> Dict[str, object]:
+    return dict(commit=get_commit(), time=time.time(),
+                python=platform.python_version(), torch=torch.__version__,
+                numpy=np.__version__, cv2=cv2.__version__,
+                platform=platform.platform(), processor=platform.processor(),
+                cpu_count=os.cpu_count(), available_cpus=get_num_cpus(),
+                source=args.video or 'synthetic',
+                output_size=list(args.output_size))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the phosphene pipeline on recorded or "
+                    "synthetic frames.")
+    parser.add_argument('--params', default=os.path.join(DIRECTORY,
+                                                         'params.yaml'))
+    parser.add_argument('--video', default=None,
+                        help="Video to take the frames from (default: "
+                             "synthetic frames).")
+    parser.add_argument('--frames', type=int, default=200,
+                        help="Number of measured frames per configuration.")
+    parser.add_argument('--warmup', type=int, default=10,
+                        help="Number of unmeasured frames first.")
+    parser.add_argument('--output-size', type=int, nargs=2,
+                        default=[401, 484], metavar=('WIDTH', 'HEIGHT'),
+                        help="Size of the frames Unity sends and receives.")
+    parser.add_argument('--electrodes', type=int, nargs='+', default=[1500])
+    parser.add_argument('--resolutions', type=parse_resolution, nargs='+',
+                        help="E.g. 256 or 256x192 (default: from params).")
+    parser.add_argument('--dtypes', nargs='+')
+    parser.add_argument('--sampling-methods', nargs='+')
+    parser.add_argument('--renderers', nargs='+')
+    parser.add_argument('--render-workers', type=int, nargs='+',
+                        help="Numbers of render workers of the tiled "
+                             "renderer, e.g. 1 2 4 8 (0: one per core; "
+                             "default: from params).")
+    parser.add_argument('--algorithms', nargs='+',
+                        help="Class names (default: all algorithms in "
+                             "processing_algorithms/).")
+    parser.add_argument('--compile', action='store_true',
+                        help="Compile the update and render (see compile in "
+                             "params.yaml). Compare with a run without it "
+                             "through --compare.")
+    parser.add_argument('--threads', type=int, default=0,
+                        help="Torch threads (default: torch's default).")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Geometry cache to use, to measure warm starts "
+                             "(default: none).")
+    parser.add_argument('--output', default=None,
+                        help="JSON file to write the results to.")
+    parser.add_argument('--compare', default=None,
+                        help="JSON file of an earlier run to compare to.")
+    args = parser.parse_args()
+
+    results = []
+    for config in get_configurations(args):
+        result = run_isolated(config, args)
+        results.append(result)
+        if 'error' in result:
+            print(f"{format_config(config)}: failed ({result['error']})")
+        else:
+            print(f"{format_config(config)}: {result['fps']:.1f} frames/s, "
+                  f"p50 {result['p50_ms']:.2f} ms, p99 "
+                  f"{result['p99_ms']:.2f} ms, peak RSS "
+                  f"{result['peak_rss_mb'] or float('nan'):.0f} MB")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(dict(environment=get_environment(args),
+                           results=results), f, indent=1)
+    print_scaling(results)
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
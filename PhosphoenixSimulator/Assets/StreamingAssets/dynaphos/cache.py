@@ -0,0 +1,147 @@
+"""Content-addressed on-disk cache of precomputed arrays, such as the
+geometry of a simulator (phosphene maps, receptive fields, etc.).
+
+Each entry is a directory named after a hash of everything its arrays were
+computed from: the relevant parameters, the inputs (e.g. the electrode
+coordinates), and the source code of the dynaphos package, so that entries
+made by other versions of the code are never used. Entries are therefore never
+out of date; entries that are no longer used are removed once the cache holds
+more than `max_entries` of them (least recently used first).
+
+The arrays are stored as .npy files, and memory-mapped when they are loaded:
+loading takes milliseconds regardless of their size, and pages are only read
+from disk when they are used.
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import torch
+
+_TEMPORARY_PREFIX = '.tmp-'
+
+
+@functools.lru_cache()
+def get_source_hash() -> bytes:
+    """Hash of the source code of the dynaphos package."""
+    hasher = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for file in sorted(os.listdir(directory)):
+        if file.endswith('.py'):
+            with open(os.path.join(directory, file), 'rb') as f:
+                hasher.update(f.read())
+    return hasher.digest()
+
+
+class GeometryCache:
+    def __init__(self, directory: str, max_entries: Optional[int] = 8):
+        """On-disk cache of arrays, keyed by (a hash of) what they were
+        computed from.
+
+        :param directory: Directory of the cache ('~' is expanded).
+        :param max_entries: Number of entries to keep.
+        """
+        self.directory = os.path.expanduser(directory)
+        self.max_entries = max_entries
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Hash of the parts (arrays, tensors, bytes, or anything that can
+        be represented as JSON, e.g. params sections) and of the source code
+        of dynaphos."""
+        hasher = hashlib.sha256(get_source_hash())
+        for part in parts:
+            if isinstance(part, torch.Tensor):
+                part = part.cpu().numpy()
+            if isinstance(part, np.ndarray):
+                hasher.update(f'{part.dtype.str}{part.shape}'.encode())
+                hasher.update(np.ascontiguousarray(part).tobytes())
+            elif isinstance(part, bytes):
+                hasher.update(part)
+            else:
+                hasher.update(json.dumps(part, sort_keys=True,
+                                         default=str).encode())
+        return hasher.hexdigest()
+
+    @staticmethod
+    def file_key(path: str) -> bytes:
+        """Hash of the contents of a (source) file, to use as part of a
+        key."""
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).digest()
+
+    def load(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """Memory-map the arrays of an entry.
+
+        :return: The arrays by name (copy-on-write: changing them does not
+            change the entry), or None if there is no such entry.
+        """
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            arrays = {file[:-len('.npy')]: np.load(os.path.join(path, file),
+                                                   mmap_mode='c')
+                      for file in os.listdir(path) if file.endswith('.npy')}
+            os.utime(path)  # Mark the entry as recently used.
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load cache entry {key}: {e}")
+            return None
+        return arrays
+
+    def store(self, key: str, arrays: Dict[str, np.ndarray]):
+        """Store the arrays (or tensors) of an entry. The entry appears at
+        once, so other processes never load a partial entry."""
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = tempfile.mkdtemp(prefix=_TEMPORARY_PREFIX,
+                                          dir=self.directory)
+        try:
+            for name, array in arrays.items():
+                if isinstance(array, torch.Tensor):
+                    array = array.cpu().numpy()
+                np.save(os.path.join(temporary_path, name + '.npy'), array)
+            os.rename(temporary_path, os.path.join(self.directory, key))
+        except OSError as e:
+            # E.g. another process stored the same entry first.
+            logging.debug(f"Could not store cache entry {key}: {e}")
+            shutil.rmtree(temporary_path, ignore_errors=True)
+        self.prune()
+
+    def get(self, key: str, compute: Callable[[], Dict[str, np.ndarray]]
+            ) -> Dict[str, np.ndarray]:
+        """Load an entry, or compute and store it if there is none."""
+        arrays = self.load(key)
+        if arrays is None:
+            arrays = compute()
+            self.store(key, arrays)
+        return arrays
+
+    def prune(self):
+        """Remove the least recently used entries beyond max_entries."""
+        if self.max_entries is None:
+            return
+        # Other processes may prune the cache at the same time, so any entry
+        # can disappear while we look at it.
+        entries = []
+        for entry in os.listdir(self.directory):
+            if entry.startswith(_TEMPORARY_PREFIX):
+                continue
+            path = os.path.join(self.directory, entry)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                continue
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries:]:
+            try:
+                shutil.rmtree(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Could not remove cache entry {path}: {e}")
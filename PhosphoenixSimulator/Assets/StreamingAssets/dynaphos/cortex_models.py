@@ -4,8 +4,9 @@ from typing import Optional, Tuple, Callable, Union
 
 import numpy as np
 
+from dynaphos.cache import GeometryCache
 from dynaphos.utils import (Map, cartesian_to_complex, polar_to_complex,
-                            complex_to_polar)
+                            complex_to_polar, load_coordinates_from_yaml)
 
 
 def get_visual_field_coordinates_from_cortex(
@@ -53,6 +54,43 @@ def get_visual_field_coordinates_from_cortex_full(
     return Map(r=r, phi=phi)
 
 
+def load_visual_field_coordinates(
+        params: dict, path: str, n_coordinates: Optional[int] = None,
+        seed: Optional[int] = None,
+        cache: Optional[GeometryCache] = None) -> Map:
+    """Load electrode locations on the cortex from a layout file, and map them
+    to phosphene locations in the full field of view.
+
+    :param params: Parameters of the visuotopic model (the 'cortex_model'
+        section).
+    :param path: Layout with the cortex coordinates (see
+        load_coordinates_from_yaml).
+    :param n_coordinates: Number of coordinates to sample from the file (None:
+        all of them).
+    :param seed: Seed of the sampling and of the noise and dropout of the
+        visuotopic model (None: a different sample every time, which is never
+        cached).
+    :param cache: Cache of the phosphene locations, keyed by the file
+        contents, n_coordinates, the seed and the visuotopic model parameters.
+    :return: Phosphene locations.
+    """
+    def get_coordinates():
+        rng = np.random.default_rng(seed)
+        coordinates_cortex = Map(*load_coordinates_from_yaml(
+            path, n_coordinates, rng))
+        r, phi = get_visual_field_coordinates_from_cortex_full(
+            params, coordinates_cortex, rng).polar
+        return dict(r=r, phi=phi)
+
+    if cache is None or seed is None:
+        coordinates = get_coordinates()
+    else:
+        coordinates = cache.get(cache.key(
+            'coordinates', cache.file_key(path), n_coordinates, seed, params),
+            get_coordinates)
+    return Map(r=np.array(coordinates['r']), phi=np.array(coordinates['phi']))
+
+
 def get_visual_field_coordinates_probabilistically(
         params: dict, n_phosphenes: int,
         rng: Optional[np.random.Generator] = None) -> Map:
@@ -171,12 +209,18 @@ def get_cortical_magnification(
     raise NotImplementedError
 
 
-def remove_out_of_view(z: np.ndarray) -> np.ndarray:
+def get_in_hemifield(z: np.ndarray) -> np.ndarray:
+    """Whether each location lies within the visual hemifield."""
     r, phi = complex_to_polar(z)
+    return (r >= 0) & (r <= 90) & (phi > -np.pi / 2) & (phi < np.pi / 2)
+
+
+def remove_out_of_view(z: np.ndarray) -> np.ndarray:
+    num_locations = len(z)
 
-    z = z[(r >= 0) & (r <= 90) & (phi > -np.pi / 2) & (phi < np.pi / 2)]
+    z = z[get_in_hemifield(z)]
 
-    logging.info(f"Removed {len(r) - len(z)} of {len(r)} phosphene locations.")
+    logging.info(f"Removed {num_locations - len(z)} of {num_locations} phosphene locations.")
 
     return z
 
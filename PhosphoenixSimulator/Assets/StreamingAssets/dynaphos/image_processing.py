@@ -1,22 +1,213 @@
 import torch
-from typing import Optional, Union
+import torch.nn.functional as F
+from typing import Dict, Optional, Sequence, Tuple, Union
 
 import cv2
 import numpy as np
 
+# The processors below accept a frame as numpy array, which is processed with
+# cv2, or as tensor (e.g. on the GPU, see to_device), which is processed with
+# the torch versions of the cv2 functions (gaussian_blur, sobel_magnitude and
+# canny), so that it stays on its device. With Buffers, the numpy versions
+# write their results (and intermediate images) into buffers that are reused
+# between frames, so that they allocate no memory once the buffers exist. For
+# tensors, the buffers are not used: torch's caching allocator already reuses
+# the device memory.
 
-def canny_processor(frame: np.ndarray, threshold_low: float,
-                    threshold_high: float) -> np.ndarray:
-    return cv2.Canny(frame, threshold_low, threshold_high)
+# Kernels of cv2.getGaussianKernel for small sizes, when sigma is not given.
+_SMALL_GAUSSIAN_KERNELS = {
+    1: [1.],
+    3: [0.25, 0.5, 0.25],
+    5: [0.0625, 0.25, 0.375, 0.25, 0.0625],
+    7: [0.03125, 0.109375, 0.21875, 0.28125, 0.21875, 0.109375, 0.03125]}
 
+# tan(22.5 degrees) in the fixed point (15 bits) representation of cv2.Canny,
+# which decides the direction of the gradient.
+_CANNY_TAN_22_5 = 13573
+_CANNY_ONE = 1 << 15
 
-def sobel_processor(frame: np.ndarray) -> np.ndarray:
+
+class Buffers:
+    def __init__(self):
+        """Images that are reused between frames (e.g. by a processing
+        algorithm), by name."""
+        self._buffers: Dict[str, np.ndarray] = {}
+
+    def get(self, name: str, shape: Tuple[int, ...],
+            dtype: np.dtype) -> np.ndarray:
+        """The buffer with the given name, which is (re)allocated when it is
+        first used, or when its shape or dtype changes."""
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or \
+                buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(shape, dtype)
+        return buffer
+
+
+def to_device(frame: np.ndarray, device: str, dtype: torch.dtype
+              ) -> Union[np.ndarray, torch.Tensor]:
+    """Move a frame to the device and dtype of the simulator (see
+    get_data_kwargs), with one copy, so that it can be processed and sampled
+    there. On the CPU, the frame is returned as is: there the cv2 versions of
+    the processors are faster, and sample_stimulus converts their result.
+    """
+    if torch.device(device).type == 'cpu':
+        return frame
+    return torch.from_numpy(frame).to(device=device, dtype=dtype)
+
+
+def _filter(image: torch.Tensor, kernel_y: Sequence[float],
+            kernel_x: Sequence[float], padding_mode: str) -> torch.Tensor:
+    """Correlate an image (..., H, W) with a separable kernel.
+
+    :param padding_mode: 'reflect' (cv2.BORDER_REFLECT_101, cv2's default) or
+        'replicate' (cv2.BORDER_REPLICATE).
+    """
+    shape = image.shape
+    kwargs = dict(dtype=image.dtype, device=image.device)
+    kernel_y = torch.tensor(kernel_y, **kwargs).view(1, 1, -1, 1)
+    kernel_x = torch.tensor(kernel_x, **kwargs).view(1, 1, 1, -1)
+    pad_y, pad_x = kernel_y.shape[2] // 2, kernel_x.shape[3] // 2
+    image = F.pad(image.reshape(-1, 1, *shape[-2:]),
+                  (pad_x, pad_x, pad_y, pad_y), mode=padding_mode)
+    return F.conv2d(F.conv2d(image, kernel_y), kernel_x).view(shape)
+
+
+def _sobel(image: torch.Tensor, padding_mode: Optional[str] = 'reflect'
+           ) -> Sequence[torch.Tensor]:
+    """Horizontal and vertical derivatives, like cv2.Sobel with ksize=3."""
+    return (_filter(image, (1, 2, 1), (-1, 0, 1), padding_mode),
+            _filter(image, (-1, 0, 1), (1, 2, 1), padding_mode))
+
+
+def gaussian_blur(image: torch.Tensor, kernel_size: Optional[int] = 3,
+                  sigma: Optional[float] = 0) -> torch.Tensor:
+    """Gaussian blur of a floating point image (..., H, W), like
+    cv2.GaussianBlur (without rounding the result).
+
+    :param kernel_size: Size of the (square) kernel, odd.
+    :param sigma: Standard deviation in pixels; if 0, it is computed from the
+        kernel size, like cv2 does.
+    """
+    if sigma <= 0 and kernel_size in _SMALL_GAUSSIAN_KERNELS:
+        kernel = _SMALL_GAUSSIAN_KERNELS[kernel_size]
+    else:
+        if sigma <= 0:
+            sigma = 0.3 * ((kernel_size - 1) * 0.5 - 1) + 0.8
+        x = np.arange(kernel_size) - (kernel_size - 1) / 2
+        kernel = np.exp(-x ** 2 / (2 * sigma ** 2))
+        kernel = (kernel / kernel.sum()).tolist()
+    return _filter(image, kernel, kernel, 'reflect')
+
+
+def sobel_magnitude(image: torch.Tensor) -> torch.Tensor:
+    """Magnitude of the gradient of a floating point image (..., H, W), like
+    sobel_processor."""
+    return torch.hypot(*_sobel(image))
+
+
+def canny(image: torch.Tensor, threshold_low: float,
+          threshold_high: float) -> torch.Tensor:
+    """Canny edge detector for a floating point image (..., H, W) with values
+    in [0, 255], like cv2.Canny (with the L1 gradient magnitude): for images
+    with integer values, the edges are the same.
+
+    :return: The edges (255) in the dtype of the image.
+    """
+    grad_x, grad_y = _sobel(image, 'replicate')
+    abs_x, abs_y = grad_x.abs(), grad_y.abs()
+    magnitude = abs_x + abs_y
+
+    # Non-maximum suppression: keep the pixels whose magnitude is a maximum
+    # along the (horizontal, vertical or diagonal) direction of the gradient,
+    # with the asymmetric comparisons of cv2.
+    padded = F.pad(magnitude, (1, 1, 1, 1))
+    height, width = magnitude.shape[-2:]
+
+    def neighbour(dy, dx):
+        return padded[..., 1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+
+    # Written so that the products are exact for integer gradients.
+    horizontal = abs_y * _CANNY_ONE < abs_x * _CANNY_TAN_22_5
+    vertical = (abs_y - 2 * abs_x) * _CANNY_ONE > abs_x * _CANNY_TAN_22_5
+    s = torch.where(grad_x * grad_y < 0, -1, 1)
+    diagonal = torch.where(
+        s > 0, (magnitude > neighbour(-1, -1)) & (magnitude > neighbour(1, 1)),
+        (magnitude > neighbour(-1, 1)) & (magnitude > neighbour(1, -1)))
+    maximum = torch.where(
+        horizontal,
+        (magnitude > neighbour(0, -1)) & (magnitude >= neighbour(0, 1)),
+        torch.where(
+            vertical,
+            (magnitude > neighbour(-1, 0)) & (magnitude >= neighbour(1, 0)),
+            diagonal))
+    candidates = maximum & (magnitude > threshold_low)
+
+    # Hysteresis: grow the strong edges into the connected candidates until
+    # they no longer change (checking every few steps, to synchronize with the
+    # device less often).
+    candidates = candidates.reshape(-1, 1, height, width)
+    edges = (candidates & (magnitude.view(candidates.shape) >
+                           threshold_high)).to(image.dtype)
+    candidates = candidates.to(image.dtype)
+    while True:
+        previous = edges
+        for _ in range(8):
+            edges = F.max_pool2d(edges, 3, stride=1, padding=1) * candidates
+        if torch.equal(edges, previous):
+            break
+    return (edges * 255).view(image.shape)
+
+
+def blur_processor(frame: Union[np.ndarray, torch.Tensor],
+                   kernel_size: Optional[int] = 3,
+                   buffers: Optional[Buffers] = None
+                   ) -> Union[np.ndarray, torch.Tensor]:
+    """Gaussian blur, in the dtype of the frame.
+
+    :param buffers: If given, the result is written into the buffer 'blur'.
+    """
+    if isinstance(frame, torch.Tensor):
+        return gaussian_blur(frame, kernel_size)
+    dst = None if buffers is None else \
+        buffers.get('blur', frame.shape, frame.dtype)
+    return cv2.GaussianBlur(frame, (kernel_size, kernel_size), 0, dst=dst)
+
+
+def canny_processor(frame: Union[np.ndarray, torch.Tensor],
+                    threshold_low: float, threshold_high: float,
+                    buffers: Optional[Buffers] = None
+                    ) -> Union[np.ndarray, torch.Tensor]:
+    """Canny edges (255), as uint8 (or in the dtype of a tensor).
+
+    :param buffers: If given, the result is written into the buffer 'canny'.
+    """
+    if isinstance(frame, torch.Tensor):
+        return canny(frame, threshold_low, threshold_high)
+    edges = None if buffers is None else \
+        buffers.get('canny', frame.shape, np.uint8)
+    return cv2.Canny(frame, threshold_low, threshold_high, edges=edges)
+
+
+def sobel_processor(frame: Union[np.ndarray, torch.Tensor],
+                    buffers: Optional[Buffers] = None
+                    ) -> Union[np.ndarray, torch.Tensor]:
+    """Magnitude of the gradient (3x3 Sobel), as float32 (or in the dtype of
+    a tensor).
+
+    :param buffers: If given, the result is written into the buffer 'sobel',
+        and the gradients into 'sobel_x' and 'sobel_y'.
+    """
+    if isinstance(frame, torch.Tensor):
+        return sobel_magnitude(frame)
+    grad_x = grad_y = magnitude = None
+    if buffers is not None:
+        grad_x, grad_y, magnitude = (buffers.get(name, frame.shape, np.float32)
+                                     for name in ('sobel_x', 'sobel_y', 'sobel'))
     kwargs = dict(ksize=3, scale=1, delta=0, borderType=cv2.BORDER_DEFAULT)
-    grad_x = cv2.Sobel(frame, cv2.CV_16S, 1, 0, **kwargs)
-    grad_y = cv2.Sobel(frame, cv2.CV_16S, 0, 1, **kwargs)
-    xy = np.stack([grad_x, grad_y])
-    grad = np.linalg.norm(xy, axis=0)
-    return grad
+    grad_x = cv2.Sobel(frame, cv2.CV_32F, 1, 0, dst=grad_x, **kwargs)
+    grad_y = cv2.Sobel(frame, cv2.CV_32F, 0, 1, dst=grad_y, **kwargs)
+    return cv2.magnitude(grad_x, grad_y, magnitude=magnitude)
 
 
 def to_n_dim(image: Union[np.ndarray, torch.Tensor], n: Optional[int] = 3
@@ -0,0 +1,162 @@
+"""Compiled electrode layouts.
+
+A layout (the x and y coordinates of the electrodes on the cortex, in mm) is
+compiled from YAML into an .npz file with float64 arrays 'x' and 'y'. While
+compiling, duplicate electrodes are removed, electrodes whose phosphenes can
+never be in view are removed (if the parameters are given), and the
+electrodes are sorted along a Hilbert curve, so that electrodes that are close
+on the cortex (and therefore their phosphenes) are close in memory as well.
+
+Compile a layout with:
+
+    python -m dynaphos.layouts grid_coords_dipole_valid.yaml --params params.yaml
+
+load_coordinates_from_yaml (and thereby load_visual_field_coordinates) reads
+both formats.
+"""
+import argparse
+import logging
+import os
+from typing import Optional
+
+import numpy as np
+
+from dynaphos.cortex_models import (get_in_hemifield,
+                                    get_mapping_from_cortex_to_visual_field)
+from dynaphos.utils import (cartesian_to_complex, complex_to_cartesian,
+                            load_coordinates_from_yaml, load_params)
+
+
+def get_hilbert_order(x: np.ndarray, y: np.ndarray,
+                      bits: Optional[int] = 16) -> np.ndarray:
+    """Order of the points along a Hilbert curve through their bounding box,
+    i.e. a spatially coherent order.
+
+    :param x: Horizontal coordinates.
+    :param y: Vertical coordinates.
+    :param bits: The bounding box is divided into 2 ** bits by 2 ** bits
+        cells.
+    :return: Indices that sort the points.
+    """
+    n = 1 << bits
+
+    def quantize(v):
+        span = np.ptp(v) if len(v) else 0
+        if span == 0:
+            return np.zeros(len(v), np.int64)
+        return np.minimum((v - v.min()) / span * n, n - 1).astype(np.int64)
+
+    qx, qy = quantize(x), quantize(y)
+    distance = np.zeros(len(x), np.int64)
+    s = n // 2
+    while s > 0:
+        rx = (qx & s) > 0
+        ry = (qy & s) > 0
+        distance += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant, so that the curve continues within it.
+        flip = ~ry & rx
+        qx = np.where(flip, n - 1 - qx, qx)
+        qy = np.where(flip, n - 1 - qy, qy)
+        swap = ~ry
+        qx, qy = np.where(swap, qy, qx), np.where(swap, qx, qy)
+        s //= 2
+    return np.argsort(distance, kind='stable')
+
+
+def get_in_view(x: np.ndarray, y: np.ndarray, params: dict,
+                margin: Optional[float] = 4) -> np.ndarray:
+    """Whether the phosphenes of each electrode can be in view.
+
+    An electrode is kept when its phosphene in either hemifield lies within
+    the simulated field of view, for any displacement on the cortex of up to
+    `margin` times the noise of the visuotopic model (checked at the center
+    and at 16 points around it).
+
+    :param x: Horizontal electrode coordinates on the cortex.
+    :param y: Vertical electrode coordinates on the cortex.
+    :param params: All parameters (the 'cortex_model' and 'run' sections are
+        used).
+    :param margin: Displacement (in standard deviations of the noise) up to
+        which electrodes are kept.
+    :return: Boolean mask of the electrodes to keep.
+    """
+    cortex_to_visual_field = get_mapping_from_cortex_to_visual_field(
+        params['cortex_model'])
+    x_org, y_org = params['run']['origin']
+    hemi_fov = params['run']['view_angle'] / 2
+    radius = margin * params['cortex_model']['noise_scale']
+    angles = np.linspace(0, 2 * np.pi, 16, endpoint=False)
+    offsets = np.concatenate([[0], radius * np.exp(1j * angles)]) \
+        if radius > 0 else np.zeros(1)
+
+    z = cartesian_to_complex(x, y)[:, None] + offsets[None]
+    visual_field = cortex_to_visual_field(z.ravel())
+    # The same as remove_out_of_view, flip and
+    # get_visual_field_coordinates_from_cortex_full do.
+    kept = get_in_hemifield(visual_field)
+    vx, vy = complex_to_cartesian(visual_field)
+    vx, vy = -vx, -vy
+    in_view = np.zeros_like(kept)
+    for hemifield_x in (vx, -vx):
+        in_view |= (np.abs(hemifield_x - x_org) <= hemi_fov) & \
+                   (np.abs(vy - y_org) <= hemi_fov)
+    return (kept & in_view).reshape(z.shape).any(axis=1)
+
+
+def compile_layout(path: str, output_path: Optional[str] = None,
+                   params: Optional[dict] = None,
+                   margin: Optional[float] = 4) -> str:
+    """Compile a YAML layout into an .npz layout.
+
+    :param path: YAML file with lists 'x' and 'y'.
+    :param output_path: Output file (default: the path, with .npz as
+        extension).
+    :param params: If given, electrodes that are never in view are removed
+        (see get_in_view).
+    :param margin: See get_in_view.
+    :return: The output path.
+    """
+    if output_path is None:
+        output_path = os.path.splitext(path)[0] + '.npz'
+    x, y = load_coordinates_from_yaml(path)
+    num_electrodes = len(x)
+
+    # Duplicates (keeping the first occurrence).
+    _, unique = np.unique(np.stack([x, y], axis=1), axis=0, return_index=True)
+    unique = np.sort(unique)
+    x, y = x[unique], y[unique]
+    num_unique = len(x)
+
+    if params is not None:
+        in_view = get_in_view(x, y, params, margin)
+        x, y = x[in_view], y[in_view]
+
+    order = get_hilbert_order(x, y)
+    x, y = x[order], y[order]
+    np.savez(output_path, x=x, y=y)
+    logging.info(f"Compiled {num_electrodes} electrodes into {len(x)}: "
+                 f"{num_electrodes - num_unique} duplicates and "
+                 f"{num_unique - len(x)} never in view removed.")
+    return output_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compile YAML electrode layouts into .npz layouts.")
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--output', '-o', default=None,
+                        help="Output file (only with one input).")
+    parser.add_argument('--params', default=None,
+                        help="params.yaml, to remove the electrodes that are "
+                             "never in view.")
+    parser.add_argument('--margin', type=float, default=4,
+                        help="Noise (in standard deviations) up to which "
+                             "electrodes count as in view.")
+    args = parser.parse_args()
+    if args.output is not None and len(args.paths) > 1:
+        parser.error("--output can only be used with one input.")
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    compile_params = None if args.params is None else load_params(args.params)
+    for input_path in args.paths:
+        print(compile_layout(input_path, args.output, compile_params,
+                             args.margin))
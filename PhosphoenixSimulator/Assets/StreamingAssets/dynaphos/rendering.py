@@ -0,0 +1,448 @@
+import math
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+from dynaphos.sampling import get_nearest_pixels
+from dynaphos.utils import get_pixel_grid, set_thread_affinity
+
+
+def get_truncation_error(cutoff: float) -> float:
+    """Upper bound on the error (per phosphene, per pixel) of a unit-peak
+    Gaussian that is truncated at `cutoff` standard deviations.
+
+    E.g. 1.1e-2 for a cutoff of 3 and 3.4e-4 for a cutoff of 4.
+    """
+    return math.exp(-0.5 * cutoff ** 2)
+
+
+class GaussianLUT:
+    def __init__(self, size: int, cutoff: float, **data_kwargs):
+        """Look-up table for the unit-peak Gaussian exp(-0.5 * (d / sigma) ** 2)
+        as a function of the normalized distance u = d / sigma.
+
+        The table holds `size` bins of width h = cutoff / size on [0, cutoff],
+        each storing the Gaussian at the bin center, followed by a zero for
+        all u >= cutoff. The absolute error is therefore at most
+        max(h / 2 * exp(-1/2), exp(-cutoff ** 2 / 2)), see `error_bound`.
+
+        :param size: Number of bins.
+        :param cutoff: Normalized distance beyond which the Gaussian is zero.
+        :param data_kwargs: Device and dtype of the table.
+        """
+        self.size = size
+        self.cutoff = cutoff
+        self.step = cutoff / size
+        u = (torch.arange(size, device=data_kwargs.get('device')) + 0.5) * \
+            self.step
+        self.table = torch.cat([torch.exp(-0.5 * u ** 2),
+                                torch.zeros(1, device=u.device)]
+                               ).to(**data_kwargs)
+
+    @property
+    def error_bound(self) -> float:
+        return max(0.5 * self.step * math.exp(-0.5),
+                   get_truncation_error(self.cutoff))
+
+    def __call__(self, distances: torch.Tensor,
+                 sigma: torch.Tensor) -> torch.Tensor:
+        """Approximate exp(-0.5 * (distances / sigma) ** 2).
+
+        :param distances: Phosphene distance maps (..., n_phosphenes, H, W).
+        :param sigma: Phosphene sizes (..., n_phosphenes, 1, 1).
+        """
+        # Bin index; only the (n_phosphenes, 1, 1) scale involves a division.
+        # The scale is applied in two steps, as sigma * step underflows in
+        # half precision for small sigmas.
+        index = torch.mul(distances, 1 / sigma).mul_(1 / self.step)
+        index = index.clamp_(max=self.size).long()
+        return self.table[index]
+
+
+class WindowedRenderer:
+    def __init__(self, run_params: dict, x_coords: torch.Tensor,
+                 y_coords: torch.Tensor, radius: float,
+                 distance: Callable[[torch.Tensor, torch.Tensor], torch.Tensor]):
+        """Render each phosphene only within a square window around its
+        center, instead of over the full image.
+
+        All windows have the same size, so the phosphenes are evaluated as one
+        (n_phosphenes, k, k) stack and accumulated into a padded canvas with a
+        single scatter-add. Memory and per-frame cost scale with
+        n_phosphenes * k * k instead of n_phosphenes * res_x * res_y.
+
+        :param run_params: The 'run' section of the parameters.
+        :param x_coords: Horizontal phosphene locations (n_phosphenes, 1, 1),
+            in degrees.
+        :param y_coords: Vertical phosphene locations (n_phosphenes, 1, 1), in
+            degrees.
+        :param radius: Half-width of the window, in degrees.
+        :param distance: Maps horizontal and vertical offsets from the
+            phosphene center (in degrees) to the distance used in the Gaussian.
+        """
+        device = x_coords.device
+        self.resolution = tuple(run_params['resolution'])
+        x_range, y_range = get_pixel_grid(run_params, device=device)
+        x_min, y_min = x_range[0], y_range[0]
+        dx, dy = x_range[1] - x_min, y_range[1] - y_min
+
+        # Half-width of the window in pixels (the window is centered on the
+        # nearest pixel, which may be off by half a pixel). The canvas is
+        # padded by the same amount, so windows never have to be clipped at
+        # the image border.
+        self.pad = math.ceil(radius / min(float(dx), float(dy)) + 0.5)
+        offsets = torch.arange(-self.pad, self.pad + 1, device=device)
+        k = len(offsets)
+
+        res_x, res_y = self.resolution
+        rows, cols = get_nearest_pixels(run_params, x_coords, y_coords)
+        cols = cols + offsets.view(1, 1, k)
+        rows = rows + offsets.view(1, k, 1)
+        x = (x_min + cols * dx - x_coords).expand(-1, k, k)
+        y = (y_min + rows * dy - y_coords).expand(-1, k, k)
+        self.distances = distance(x, y)
+
+        # Flat indices of the window pixels in the padded canvas.
+        self._canvas_shape = (res_y + 2 * self.pad, res_x + 2 * self.pad)
+        self.indices = ((rows + self.pad) * self._canvas_shape[1] +
+                        cols + self.pad).ravel()
+
+    @classmethod
+    def from_arrays(cls, run_params: dict,
+                    arrays: Dict[str, torch.Tensor]) -> 'WindowedRenderer':
+        """Restore a renderer from its arrays (see to_arrays), e.g. from a
+        GeometryCache."""
+        renderer = cls.__new__(cls)
+        renderer.resolution = tuple(run_params['resolution'])
+        renderer.distances = arrays['distances']
+        renderer.indices = arrays['indices']
+        renderer.pad = renderer.distances.shape[-1] // 2
+        res_x, res_y = renderer.resolution
+        renderer._canvas_shape = (res_y + 2 * renderer.pad,
+                                  res_x + 2 * renderer.pad)
+        return renderer
+
+    def to_arrays(self) -> Dict[str, torch.Tensor]:
+        return dict(distances=self.distances, indices=self.indices)
+
+    def to(self, dtype: torch.dtype) -> 'WindowedRenderer':
+        """Render in another dtype (e.g. half precision, see get_render_kwargs).
+        The geometry is computed in the dtype of the coordinates."""
+        self.distances = self.distances.to(dtype)
+        return self
+
+    def render(self, intensity: torch.Tensor,
+               activation: torch.Tensor) -> torch.Tensor:
+        """Accumulate the windowed phosphenes into an image.
+
+        :param intensity: Phosphene intensities (..., n_phosphenes, 1, 1).
+        :param activation: Windowed Gaussians (..., n_phosphenes, k, k).
+        :return: Phosphene image (..., res_y, res_x), not clamped.
+        """
+        return self.crop(self.accumulate(intensity * activation))
+
+    def accumulate(self, contribution: torch.Tensor,
+                   canvas: Optional[torch.Tensor] = None,
+                   phosphenes: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Add the windows of (a subset of) the phosphenes to a canvas.
+
+        :param contribution: Windowed phosphenes (..., n, k, k).
+        :param canvas: Padded canvas (see crop) to add them to (in place). If
+            None, they are added to a new one.
+        :param phosphenes: Indices of the n phosphenes (default: all).
+        :return: The canvas.
+        """
+        contribution = contribution.flatten(-3)
+        if canvas is None:
+            canvas = torch.zeros(
+                contribution.shape[:-1] + (math.prod(self._canvas_shape),),
+                dtype=contribution.dtype, device=contribution.device)
+        indices = self.indices
+        if phosphenes is not None:
+            indices = indices.view(-1, self.distances[0].numel())[
+                phosphenes].ravel()
+        canvas.index_add_(-1, indices, contribution)
+        return canvas
+
+    def crop(self, canvas: torch.Tensor) -> torch.Tensor:
+        """The image (..., res_y, res_x) within a padded canvas (a view)."""
+        canvas = canvas.view(canvas.shape[:-1] + self._canvas_shape)
+        res_x, res_y = self.resolution
+        return canvas[..., self.pad:self.pad + res_y,
+                      self.pad:self.pad + res_x]
+
+
+class TiledRenderer:
+    def __init__(self, windows: WindowedRenderer, tile_size: int):
+        """Render the windowed phosphenes (see WindowedRenderer) in square
+        tiles of the image. The tiles are independent, so they can be
+        rendered in parallel (see render).
+
+        Each phosphene belongs to the tile of its center. A tile renders its
+        phosphenes into its own canvas, which extends beyond the tile by the
+        window radius, and the canvases are added into the image afterwards.
+        So no phosphene is evaluated twice, and the tiles do not write to
+        shared memory. The phosphenes are ordered by tile (see order), so that
+        the phosphenes of a tile are a slice of the windows.
+
+        :param windows: The render windows of the phosphenes.
+        :param tile_size: Width and height of the tiles, in pixels.
+        """
+        self.resolution = windows.resolution
+        self.pad = windows.pad
+        self._canvas_shape = windows._canvas_shape
+        self.tiles = self.get_tiles(self.resolution, tile_size)
+        res_x, res_y = self.resolution
+        width = self._canvas_shape[1]
+        indices = windows.indices.view(len(windows.distances), -1)
+        # Rows and columns of the window pixels in the padded canvas. The
+        # first pixel of a window is at the center of the window in the image.
+        rows, cols = indices // width, indices % width
+        num_tiles_x = math.ceil(res_x / tile_size)
+        tile = torch.div(rows[:, 0], tile_size, rounding_mode='floor').clamp(
+            0, math.ceil(res_y / tile_size) - 1) * num_tiles_x + \
+            torch.div(cols[:, 0], tile_size, rounding_mode='floor').clamp(
+                0, num_tiles_x - 1)
+
+        # Indices of the phosphenes of each tile, one tile after another.
+        self.order = torch.argsort(tile, stable=True)
+        self.distances = windows.distances[self.order]
+        ends = torch.cumsum(torch.bincount(tile, minlength=len(self.tiles)),
+                            0).tolist()
+        self.slices = list(zip([0] + ends[:-1], ends))
+        self.indices = []
+        self._tile_canvas_shapes = []
+        for (start, end), (y_start, y_end, x_start, x_end) in zip(
+                self.slices, self.tiles):
+            phosphenes = self.order[start:end]
+            canvas_width = x_end - x_start + 2 * self.pad
+            self.indices.append(((rows[phosphenes] - y_start) * canvas_width +
+                                 cols[phosphenes] - x_start).ravel())
+            self._tile_canvas_shapes.append(
+                (y_end - y_start + 2 * self.pad, canvas_width))
+
+        # The tiles with the most phosphenes first, so that the workers finish
+        # at about the same time.
+        self._tile_order = sorted(
+            range(len(self.tiles)),
+            key=lambda tile: self.slices[tile][0] - self.slices[tile][1])
+
+    @staticmethod
+    def get_tiles(resolution: Tuple[int, int], tile_size: int
+                  ) -> List[Tuple[int, int, int, int]]:
+        """The tiles (y_start, y_end, x_start, x_end) of an image of the given
+        (width, height); the tiles at the right and bottom edge may be
+        smaller."""
+        res_x, res_y = resolution
+        return [(y, min(y + tile_size, res_y), x, min(x + tile_size, res_x))
+                for y in range(0, res_y, tile_size)
+                for x in range(0, res_x, tile_size)]
+
+    def render(self, intensity: torch.Tensor, sigma: torch.Tensor,
+               gaussian: Callable[[torch.Tensor, torch.Tensor], torch.Tensor],
+               executor: Optional[Executor] = None) -> torch.Tensor:
+        """Render the phosphenes, tile by tile.
+
+        :param intensity: Phosphene intensities (..., n_phosphenes, 1, 1).
+        :param sigma: Phosphene sizes (..., n_phosphenes, 1, 1), in degrees.
+        :param gaussian: Maps the distances of the render windows and the
+            sigmas to the Gaussians (see GaussianSimulator.gaussian).
+        :param executor: Renders the tiles in parallel (see
+            init_render_worker). If None, they are rendered one by one.
+        :return: Phosphene image (..., res_y, res_x), not clamped.
+        """
+        batch_shape = intensity.shape[:-3]
+        intensity = intensity.index_select(-3, self.order)
+        sigma = sigma.index_select(-3, self.order)
+
+        def render_tile(tile: int) -> Optional[torch.Tensor]:
+            start, end = self.slices[tile]
+            if start == end:
+                return None
+            contribution = intensity[..., start:end, :, :] * gaussian(
+                self.distances[start:end], sigma[..., start:end, :, :])
+            canvas_shape = self._tile_canvas_shapes[tile]
+            canvas = torch.zeros(batch_shape + (math.prod(canvas_shape),),
+                                 dtype=contribution.dtype,
+                                 device=contribution.device)
+            canvas.index_add_(-1, self.indices[tile],
+                              contribution.flatten(-3))
+            return canvas.view(batch_shape + canvas_shape)
+
+        if executor is None:
+            canvases = map(render_tile, self._tile_order)
+        else:
+            canvases = executor.map(render_tile, self._tile_order)
+
+        # The canvases of neighbouring tiles overlap by the window radius.
+        image = torch.zeros(batch_shape + self._canvas_shape,
+                            dtype=intensity.dtype, device=intensity.device)
+        for tile, canvas in zip(self._tile_order, canvases):
+            if canvas is not None:
+                y_start, y_end, x_start, x_end = self.tiles[tile]
+                image[..., y_start:y_end + 2 * self.pad,
+                      x_start:x_end + 2 * self.pad] += canvas
+        res_x, res_y = self.resolution
+        return image[..., self.pad:self.pad + res_y,
+                     self.pad:self.pad + res_x]
+
+
+def init_render_worker(cpus: Optional[Sequence[int]] = None):
+    """Initializer of the threads that render tiles (see
+    TiledRenderer.render): pins the thread to cores `cpus`, and renders
+    each tile on one thread, as the tiles are the parallelism. torch sets the
+    number of threads per calling thread."""
+    set_thread_affinity(cpus)
+    torch.set_num_threads(1)
+
+
+class BucketedRenderer:
+    def __init__(self, run_params: dict, x_coords: torch.Tensor,
+                 y_coords: torch.Tensor, max_sigma: float, num_buckets: int,
+                 min_sigma: float, cutoff: float, windows: WindowedRenderer):
+        """Render phosphenes by quantizing their sizes into a number of sigma
+        buckets. Per bucket, the phosphene intensities are splatted as
+        impulses at the phosphene centers and blurred with one separable
+        (unit-peak) Gaussian. Per-frame cost scales with
+        num_buckets * res_x * res_y instead of n_phosphenes * res_x * res_y.
+
+        The bucket sigmas are spaced logarithmically between min_sigma and
+        max_sigma, so the relative sigma error is at most
+        sqrt(r) - 1 with r = (max_sigma / min_sigma) ** (1 / (num_buckets - 1)).
+        Larger phosphenes get the last bucket. The splat adds an error that
+        does not depend on the buckets, of up to 0.05 per phosphene and pixel
+        for a sigma of one pixel, 0.007 for two and 0.002 for three.
+        Phosphenes smaller than min_sigma are therefore rendered exactly,
+        within their render windows.
+
+        :param run_params: The 'run' section of the parameters.
+        :param x_coords: Horizontal phosphene locations (n_phosphenes, 1, 1),
+            in degrees.
+        :param y_coords: Vertical phosphene locations (n_phosphenes, 1, 1), in
+            degrees.
+        :param max_sigma: Sigma of the largest bucket, in degrees.
+        :param num_buckets: Number of sigma buckets.
+        :param min_sigma: Sigma of the smallest bucket, in degrees.
+        :param cutoff: Blur kernels are truncated at `cutoff` times the
+            largest bucket sigma.
+        :param windows: Render windows of the phosphenes smaller than
+            min_sigma, of at least `cutoff` times min_sigma.
+        """
+        device = x_coords.device
+        dtype = x_coords.dtype
+        self.resolution = tuple(run_params['resolution'])
+        res_x, res_y = self.resolution
+        x_range, y_range = get_pixel_grid(run_params, device=device)
+        x_min, y_min = x_range[0], y_range[0]
+        dx, dy = float(x_range[1] - x_min), float(y_range[1] - y_min)
+
+        self.windows = windows
+        self.min_sigma = min_sigma
+        self.num_buckets = num_buckets
+        max_sigma = max(max_sigma, min_sigma)
+        self._log_min_sigma = math.log(min_sigma)
+        self._log_ratio = math.log(max_sigma / min_sigma) / max(
+            num_buckets - 1, 1)
+        sigmas = torch.exp(self._log_min_sigma + self._log_ratio *
+                           torch.arange(num_buckets, device=device,
+                                        dtype=dtype))
+
+        # Unit-peak Gaussian kernels; their outer product is
+        # exp(-0.5 * (x ** 2 + y ** 2) / sigma ** 2).
+        def get_kernels(step):
+            radius = math.ceil(cutoff * max_sigma / step)
+            t = step * torch.arange(-radius, radius + 1, device=device,
+                                    dtype=dtype)
+            return torch.exp(-0.5 * (t / sigmas.view(-1, 1)) ** 2)
+
+        kernels_y = get_kernels(dy)
+        kernels_x = get_kernels(dx)
+        # Vertical blur per bucket (grouped), then horizontal blur that also
+        # sums over the buckets.
+        self._kernels_y = kernels_y.view(num_buckets, 1, -1, 1)
+        self._kernels_x = kernels_x.view(1, num_buckets, 1, -1)
+        self._padding_y = kernels_y.shape[-1] // 2
+        self._padding_x = kernels_x.shape[-1] // 2
+
+        # Cubic (Keys) splatting weights of the 4 x 4 pixels around each
+        # center: the blurred splat then interpolates the Gaussian at the
+        # center, with 3 to 15 times less error than bilinear weights for
+        # sigmas of 0.5 to 3 pixels. Pixels beyond the image border are
+        # clamped to it.
+        def get_weights(f):
+            f2, f3 = f ** 2, f ** 3
+            return torch.stack([-f3 + 2 * f2 - f, 3 * f3 - 5 * f2 + 2,
+                                -3 * f3 + 4 * f2 + f, f3 - f2], dim=-1) / 2
+
+        cols = ((x_coords - x_min) / dx).ravel()
+        rows = ((y_coords - y_min) / dy).ravel()
+        col0 = cols.floor().clamp(0, res_x - 2)
+        row0 = rows.floor().clamp(0, res_y - 2)
+        fx, fy = cols - col0, rows - row0
+        taps = torch.arange(-1, 3, device=device)
+        splat_cols = (col0.long().view(-1, 1) + taps).clamp(0, res_x - 1)
+        splat_rows = (row0.long().view(-1, 1) + taps).clamp(0, res_y - 1)
+        self._splat_weights = (get_weights(fy)[:, :, None] *
+                               get_weights(fx)[:, None, :]).flatten(1)
+        self._splat_indices = (splat_rows[:, :, None] * res_x +
+                               splat_cols[:, None, :]).flatten(1)
+
+    def to(self, dtype: torch.dtype) -> 'BucketedRenderer':
+        """Render in another dtype (e.g. half precision, see get_render_kwargs).
+        The geometry is computed in the dtype of the coordinates."""
+        self._kernels_y = self._kernels_y.to(dtype)
+        self._kernels_x = self._kernels_x.to(dtype)
+        self._splat_weights = self._splat_weights.to(dtype)
+        self.windows.to(dtype)
+        return self
+
+    def get_buckets(self, sigma: torch.Tensor) -> torch.Tensor:
+        """Index of the bucket closest (in log space) to each sigma."""
+        bucket = (torch.log(sigma) - self._log_min_sigma) / self._log_ratio \
+            if self._log_ratio > 0 else torch.zeros_like(sigma)
+        return torch.round(bucket).clamp(0, self.num_buckets - 1).long()
+
+    def render(self, intensity: torch.Tensor, sigma: torch.Tensor,
+               gaussian: Callable[[torch.Tensor, torch.Tensor], torch.Tensor]
+               ) -> torch.Tensor:
+        """Render the phosphenes.
+
+        :param intensity: Phosphene intensities (..., n_phosphenes, 1, 1).
+        :param sigma: Phosphene sizes (..., n_phosphenes, 1, 1), in degrees.
+        :param gaussian: Maps the distances of the render windows and sigma
+            to unit-peak Gaussians (see GaussianSimulator.gaussian).
+        :return: Phosphene image (..., res_y, res_x), not clamped.
+        """
+        res_x, res_y = self.resolution
+        batch_shape = intensity.shape[:-3]
+
+        # The small phosphenes are rendered exactly, the others in buckets.
+        exact = sigma < self.min_sigma
+        zero = intensity.new_zeros(())
+        exact_image = self.windows.render(
+            torch.where(exact, intensity, zero),
+            gaussian(self.windows.distances, sigma))
+        intensity = torch.where(exact, zero, intensity)
+
+        buckets = self.get_buckets(sigma.clamp(1e-22, None))
+        buckets = buckets.expand(batch_shape + buckets.shape[-3:])
+
+        # Splat the intensities into one image per bucket.
+        indices = buckets.view(batch_shape + (-1, 1)) * (res_x * res_y) + \
+            self._splat_indices
+        values = intensity.view(batch_shape + (-1, 1)) * self._splat_weights
+        canvas = torch.zeros(batch_shape + (self.num_buckets * res_x * res_y,),
+                             dtype=values.dtype, device=values.device)
+        canvas = canvas.view(-1, canvas.shape[-1])
+        canvas.scatter_add_(-1, indices.reshape(len(canvas), -1),
+                            values.reshape(len(canvas), -1))
+
+        # Separable blur per bucket, summed over the buckets.
+        canvas = canvas.view(-1, self.num_buckets, res_y, res_x)
+        canvas = torch.nn.functional.conv2d(
+            canvas, self._kernels_y, padding=(self._padding_y, 0),
+            groups=self.num_buckets)
+        image = torch.nn.functional.conv2d(
+            canvas, self._kernels_x, padding=(0, self._padding_x))
+        return image.view(batch_shape + (res_y, res_x)) + exact_image
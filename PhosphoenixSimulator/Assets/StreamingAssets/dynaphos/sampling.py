@@ -0,0 +1,143 @@
+import math
+from typing import Callable, Dict, Tuple
+
+import torch
+
+from dynaphos.utils import get_pixel_grid
+
+
+def get_nearest_pixels(run_params: dict, x_coords: torch.Tensor,
+                       y_coords: torch.Tensor
+                       ) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Row and column of the pixel closest to each phosphene center.
+
+    :param run_params: The 'run' section of the parameters.
+    :param x_coords: Horizontal phosphene locations, in degrees.
+    :param y_coords: Vertical phosphene locations, in degrees.
+    """
+    x_range, y_range = get_pixel_grid(run_params, device=x_coords.device)
+    dx, dy = x_range[1] - x_range[0], y_range[1] - y_range[0]
+    cols = torch.round((x_coords - x_range[0]) / dx).long()
+    rows = torch.round((y_coords - y_range[0]) / dy).long()
+    return rows, cols
+
+
+def get_center_indices(run_params: dict, x_coords: torch.Tensor,
+                       y_coords: torch.Tensor) -> torch.Tensor:
+    """Indices (flat indexing) of the pixels closest to the phosphene
+    centers."""
+    rows, cols = get_nearest_pixels(run_params, x_coords, y_coords)
+    return (rows * run_params['resolution'][0] + cols).ravel()
+
+
+class ReceptiveFields:
+    def __init__(self, run_params: dict, x_coords: torch.Tensor,
+                 y_coords: torch.Tensor, radius: torch.Tensor,
+                 distance: Callable[[torch.Tensor, torch.Tensor], torch.Tensor],
+                 max_offset: float):
+        """Sparse (CSR) index of the pixels inside the receptive field of each
+        phosphene.
+
+        The pixel indices of phosphene i are
+        self.indices[self.indptr[i]:self.indptr[i + 1]]. Sampling an image
+        gathers these pixels and reduces them with a segment max, so it runs
+        in time proportional to the total receptive field area.
+
+        :param run_params: The 'run' section of the parameters.
+        :param x_coords: Horizontal phosphene locations (n_phosphenes, 1, 1),
+            in degrees.
+        :param y_coords: Vertical phosphene locations (n_phosphenes, 1, 1), in
+            degrees.
+        :param radius: Receptive field radii (n_phosphenes, 1, 1), in degrees.
+        :param distance: Maps horizontal and vertical offsets from the
+            phosphene center (in degrees) to the distance that is compared with
+            the radius.
+        :param max_offset: Largest horizontal or vertical offset (in degrees)
+            of a pixel inside any receptive field.
+        """
+        device = x_coords.device
+        self.resolution = tuple(run_params['resolution'])
+        res_x, res_y = self.resolution
+        x_range, y_range = get_pixel_grid(run_params, device=device)
+        x_min, y_min = x_range[0], y_range[0]
+        dx, dy = x_range[1] - x_min, y_range[1] - y_min
+
+        # Candidate pixels: a window around the nearest pixel of each center.
+        pad = math.ceil(max_offset / min(float(dx), float(dy)) + 0.5)
+        offsets = torch.arange(-pad, pad + 1, device=device)
+        k = len(offsets)
+        rows, cols = get_nearest_pixels(run_params, x_coords, y_coords)
+        cols = cols + offsets.view(1, 1, k)
+        rows = rows + offsets.view(1, k, 1)
+        x = (x_min + cols * dx - x_coords).expand(-1, k, k)
+        y = (y_min + rows * dy - y_coords).expand(-1, k, k)
+
+        inside = (torch.less(distance(x, y), radius) &
+                  torch.ge(cols, 0) & torch.less(cols, res_x) &
+                  torch.ge(rows, 0) & torch.less(rows, res_y))
+        # Boolean indexing keeps the (phosphene, row, col) order, so the
+        # pixels of each phosphene are contiguous.
+        self.indices = (rows * res_x + cols).expand(-1, k, k)[inside]
+        self.lengths = inside.sum(dim=(-2, -1))
+        self.indptr = torch.cat([torch.zeros(1, dtype=torch.long,
+                                             device=device),
+                                 torch.cumsum(self.lengths, 0)])
+        self._values = None
+
+    @classmethod
+    def from_arrays(cls, run_params: dict,
+                    arrays: Dict[str, torch.Tensor]) -> 'ReceptiveFields':
+        """Restore receptive fields from their arrays (see to_arrays), e.g.
+        from a GeometryCache."""
+        receptive_fields = cls.__new__(cls)
+        receptive_fields.resolution = tuple(run_params['resolution'])
+        receptive_fields.indices = arrays['indices']
+        receptive_fields.lengths = arrays['lengths']
+        receptive_fields.indptr = arrays['indptr']
+        receptive_fields._values = None
+        return receptive_fields
+
+    def to_arrays(self) -> Dict[str, torch.Tensor]:
+        return dict(indices=self.indices, lengths=self.lengths,
+                    indptr=self.indptr)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.indices)
+
+    def sample(self, x: torch.Tensor) -> torch.Tensor:
+        """Maximum value of image x within each receptive field.
+
+        :param x: Image (res_y, res_x) or batch of images (N, 1, res_y, res_x).
+        :return: Sampled values (n_phosphenes,) or (N, n_phosphenes). Empty
+            receptive fields, and fields with only negative values, give zero.
+        """
+        if x.dim() > 2:
+            # The channel dimension is replaced by the phosphene dimension.
+            x = x.squeeze(-3)
+        # The gathered pixels are kept between calls, so that sampling only
+        # allocates its result.
+        shape = x.shape[:-2] + self.indices.shape
+        if self._values is None or self._values.shape != shape or \
+                self._values.dtype != x.dtype or \
+                self._values.device != x.device:
+            self._values = torch.empty(shape, dtype=x.dtype, device=x.device)
+        values = torch.index_select(x.flatten(-2), -1, self.indices,
+                                    out=self._values)
+        lengths = self.lengths.expand(values.shape[:-1] + self.lengths.shape)
+        return torch.segment_reduce(values, 'max', lengths=lengths,
+                                    axis=values.dim() - 1, initial=0)
+
+    def to_dense(self) -> torch.Tensor:
+        """Boolean mask (n_phosphenes, res_y, res_x) of the receptive
+        fields."""
+        res_x, res_y = self.resolution
+        mask = torch.zeros((len(self), res_y * res_x), dtype=torch.bool,
+                           device=self.indices.device)
+        phosphenes = torch.repeat_interleave(
+            torch.arange(len(self), device=self.indices.device), self.lengths)
+        mask[phosphenes, self.indices] = True
+        return mask.view(len(self), res_y, res_x)
@@ -1,15 +1,23 @@
+import copy
 import math
-from typing import Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
 
 import logging
 import numpy as np
 import torch
 import warnings
 
+from dynaphos.cache import GeometryCache
 from dynaphos.cortex_models import get_cortical_magnification
 from dynaphos.image_processing import scale_image, to_n_dim
-from dynaphos.utils import (to_tensor, get_data_kwargs, get_truncated_normal,
-                            get_deg2pix_coeff, set_deterministic,
+from dynaphos.rendering import (BucketedRenderer, GaussianLUT, TiledRenderer,
+                                WindowedRenderer, init_render_worker)
+from dynaphos.sampling import ReceptiveFields, get_center_indices
+from dynaphos.utils import (to_tensor, get_data_kwargs, get_render_kwargs,
+                            get_truncated_normal, get_deg2pix_coeff,
+                            get_num_cpus, get_pixel_grid, set_deterministic,
                             print_stats, sigmoid, to_numpy, Map)
 
 class State:
@@ -23,12 +31,38 @@ class State:
 
         self.reset()
 
-    def reset(self):
-        self.state = torch.zeros(self.shape, **self.data_kwargs)
+    def reset(self, index: Optional[int] = None):
+        """Reset the state, or only the state of batch element `index`."""
+        if index is None:
+            self.state = torch.zeros(self.shape, **self.data_kwargs)
+        else:
+            self.state = self.state.detach().clone()
+            self.state[index] = 0
 
     def get(self) -> torch.Tensor:
         return self.state
 
+    def configure(self, params: dict):
+        """Recompute what the state derives from the parameters (e.g. its
+        coefficients), keeping the state itself (see
+        GaussianSimulator.reconfigure)."""
+        self.params = params
+
+    def remap(self, shape: Tuple[int, ...], source: torch.Tensor,
+              target: torch.Tensor):
+        """Change the number of phosphenes, keeping the state of phosphenes
+        `source`, which become phosphenes `target`. The other phosphenes start
+        from a clean state.
+
+        :param shape: The new shape.
+        :param source: Indices of the kept phosphenes in the current state.
+        :param target: Their indices in the new state.
+        """
+        state = self.state
+        self.shape = shape
+        self.reset()
+        self.state[..., target, :, :] = state[..., source, :, :]
+
     def update(self, x: torch.Tensor):
         raise NotImplementedError
 
@@ -36,33 +70,79 @@ class State:
         return to_tensor(x, **self.data_kwargs)
 
 
-class Activation(State):
+class LeakyIntegrator(State):
     def __init__(self, params: dict, shape: Tuple[int, ...],
+                 decay_per_second: float, scale: float,
                  verbose: Optional[bool] = False):
+        """State that follows the leaky integrator
+        dS/dt = -decay_rate * S + scale * x, where the input x is on for the
+        stimulus duration and off for the rest of the frame.
+
+        The update uses the exact exponential solution of this equation over
+        one frame, S <- decay * S + gain * x, so it is stable and consistent
+        for any frame rate or decay constant without sub-stepping.
+
+        :param decay_per_second: Fraction of the state that remains after one
+            second without input.
+        :param scale: Scaling of the input.
+        """
         super().__init__(params, shape, verbose)
+        self.set_coefficients(decay_per_second, scale)
+
+    def set_coefficients(self, decay_per_second: float, scale: float):
+        """Compute the decay and gain of one frame.
 
-        self.fps = self.to_tensor(self.params['run']['fps'])
+        :param decay_per_second: Fraction of the state that remains after one
+            second without input.
+        :param scale: Scaling of the input.
+        """
+        frame_duration = 1 / self.params['run']['fps']
         # By default, the stimulus lasts as long as a frame. Can be adjusted:
-        self.rel_stim_duration = self.to_tensor(
-            self.params['default_stim']['relative_stim_duration'])
+        stim_duration = frame_duration * \
+            self.params['default_stim']['relative_stim_duration']
         # Convert decay-per-second to exponential decay constant.
-        self.decay_rate = -torch.log(self.to_tensor(
-            self.params['temporal_dynamics']['activation_decay_per_second']))
-        self.num_steps = int(torch.ceil(self.decay_rate / self.fps))
+        decay_rate = -math.log(decay_per_second)
+
+        # Integrate the input over the stimulus duration and let it decay for
+        # the remainder of the frame.
+        if decay_rate == 0:
+            gain = scale * stim_duration
+        else:
+            gain = (scale * -math.expm1(-decay_rate * stim_duration) /
+                    decay_rate *
+                    math.exp(-decay_rate * (frame_duration - stim_duration)))
+        self.decay = self.to_tensor(math.exp(-decay_rate * frame_duration))
+        self.gain = self.to_tensor(gain)
 
     def update(self, x: torch.Tensor):
-        """Update activation with leaky integrator.
+        """Update the state with the leaky integrator.
 
         :param x: Effective stimulation current.
         """
+        self.state = torch.addcmul(self.decay * self.state.detach(),
+                                   self.gain, x)
+
+
+class Activation(LeakyIntegrator):
+    def __init__(self, params: dict, shape: Tuple[int, ...],
+                 verbose: Optional[bool] = False):
+        super().__init__(
+            params, shape,
+            params['temporal_dynamics']['activation_decay_per_second'], 1,
+            verbose)
 
-        # If decay rate > frame rate, perform extra simulation steps for
-        # numerical stability.
-        for _ in range(self.num_steps):
-            # eq: \Delta A = (-\gamma * A + I) * \Delta t
-            self.state = self.state.detach() + (
-                (-self.state.detach() * self.decay_rate + x * self.rel_stim_duration) /
-                self.fps / self.num_steps)
+    def configure(self, params: dict):
+        super().configure(params)
+        self.set_coefficients(
+            params['temporal_dynamics']['activation_decay_per_second'], 1)
+
+    def update(self, x: torch.Tensor):
+        """Update activation with leaky integrator.
+
+        :param x: Effective stimulation current.
+        """
+        # eq: dA/dt = -\gamma * A + I
+        super().update(x)
 
         print_stats('activation', self.state, self.verbose)
 
@@ -71,10 +151,23 @@ class ActivationThreshold(State):
                  rng: np.random.Generator, verbose: Optional[bool] = False):
         super().__init__(params, shape, verbose)
         self.rng = rng
+        self.configure(params)
+
+    def configure(self, params: dict):
+        """Set the threshold distribution and draw new thresholds from it."""
+        super().configure(params)
         self._mu = self.params['thresholding']['activation_threshold']
         self._sd = self.params['thresholding']['activation_threshold_sd']
         self.reinitialize()
 
+    def remap(self, shape: Tuple[int, ...], source: torch.Tensor,
+              target: torch.Tensor):
+        """Like State.remap, but the other phosphenes get new thresholds."""
+        state = self.state
+        self.shape = shape
+        self.reinitialize()
+        self.state[..., target, :, :] = state[..., source, :, :]
+
     def reinitialize(self, activation_thresholds: Optional[np.ndarray] = None):
         """Set or re-initialize the activation thresholds for each electrode. Default: sample from truncated random
         normal distribution."""
@@ -85,39 +178,27 @@ class ActivationThreshold(State):
         else:
             self.state = torch.zeros(self.shape, **self.data_kwargs)
 
-class Trace(State):
+class Trace(LeakyIntegrator):
     def __init__(self, params: dict, shape: Tuple[int, ...],
                  verbose: Optional[bool] = False):
-        super().__init__(params, shape, verbose)
-
-        fps = self.params['run']['fps']
-
-        # By default, the stimulus lasts as long as a frame. Can be adjusted:
-        rel_stim_duration = \
-            self.params['default_stim']['relative_stim_duration']
-
-        # Convert decay-per-second to exponential decay constant.
-        decay_rate = -math.log(
-            self.params['temporal_dynamics']['trace_decay_per_second'])
-
-        # Scaling of the trace increment.
-        scale = self.params['temporal_dynamics']['trace_increase_rate']
-
-        # If decay rate > frame rate, perform extra simulation steps for
-        # numerical stability.
-        self.num_steps = math.ceil(decay_rate / fps)
-
-        self._a = self.to_tensor(-decay_rate / fps / self.num_steps)
-        self._b = self.to_tensor(rel_stim_duration * scale / fps /
-                                 self.num_steps)
+        # The scaling of the trace increment is the increase rate.
+        super().__init__(
+            params, shape,
+            params['temporal_dynamics']['trace_decay_per_second'],
+            params['temporal_dynamics']['trace_increase_rate'], verbose)
+
+    def configure(self, params: dict):
+        super().configure(params)
+        self.set_coefficients(
+            params['temporal_dynamics']['trace_decay_per_second'],
+            params['temporal_dynamics']['trace_increase_rate'])
 
     def update(self, x: torch.Tensor):
         """Update memory trace using a leaky integrator.
 
         :param x: Effective stimulation current.
         """
-        for _ in range(self.num_steps):
-            self.state = self.state.detach() + self._a * self.state.detach() + self._b * x
+        super().update(x)
 
         print_stats('trace', self.state, self.verbose)
 
@@ -125,6 +206,10 @@ class Trace(State):
 class Brightness(State):
     def __init__(self, params: dict, shape: Tuple[int, ...], verbose: Optional[bool] = False):
         super().__init__(params, shape, verbose)
+        self.configure(params)
+
+    def configure(self, params: dict):
+        super().configure(params)
         self.slope = self.to_tensor(
             self.params['brightness_saturation']['slope_brightness'])
         self.cps_half = self.to_tensor(
@@ -141,7 +226,13 @@ class Sigma(State):
     def __init__(self, params: dict, shape: Tuple[int, ...],
                  magnification: torch.Tensor, verbose: Optional[bool] = False):
         super().__init__(params, shape, verbose)
+        self.magnification = magnification
+        self.configure(params)
 
+    def configure(self, params: dict):
+        """Set the size equation and the scaling from current spread to
+        sigma (which depends on the cortical magnification)."""
+        super().configure(params)
         p = self.params['size']
         if p['size_equation'] == 'sqrt':  # Tehovnik 2007
             def f(x):
@@ -153,7 +244,8 @@ class Sigma(State):
         else:
             raise ValueError("Size equation should be 'sqrt' or 'sigmoid'.")
         self.f = f
-        self.scale = p['radius_to_sigma'] / magnification
+        self.scale = p['radius_to_sigma'] / self.magnification
+
     def update(self, x: torch.Tensor):
         """Compute the effect of the input current on phosphene size."""
 
@@ -162,11 +254,69 @@ class Sigma(State):
 
         print_stats('Sigma (in degrees)', self.state, self.verbose)
 
+    def get_max(self, max_amplitude: torch.Tensor) -> torch.Tensor:
+        """Largest sigma of each phosphene for amplitudes up to
+        max_amplitude (both size equations increase monotonically)."""
+        return torch.mul(self.f(max_amplitude), self.scale)
+
+
+# Parameters that the geometry of the simulator (see GaussianSimulator._get_geometry) depends on, by section (None: the
+# whole section).
+GEOMETRY_PARAMS = {
+    'run': ('resolution', 'output_resolution', 'view_angle', 'origin', 'dtype', 'seed', 'renderer', 'window_cutoff',
+            'max_amplitude', 'min_bucket_sigma'),
+    'cortex_model': None, 'sampling': None, 'size': None, 'gabor': None,
+}
+
+# Parts of the simulator that are precomputed from the parameters, and the parameters each depends on (by section; None:
+# the whole section). When parameters change, GaussianSimulator.reconfigure only recomputes the parts that depend on
+# them. Parameters that are not listed (e.g. the rheobase or the stimulus scale) are read whenever they are used.
+DEPENDENCIES = {
+    'activation': {'run': ('fps',), 'default_stim': ('relative_stim_duration',),
+                   'temporal_dynamics': ('activation_decay_per_second',)},
+    'trace': {'run': ('fps',), 'default_stim': ('relative_stim_duration',),
+              'temporal_dynamics': ('trace_decay_per_second', 'trace_increase_rate')},
+    'brightness': {'brightness_saturation': None},
+    'threshold': {'thresholding': ('use_threshold', 'activation_threshold', 'activation_threshold_sd')},
+    'sigma': {'size': None},
+    'stimulation': {'default_stim': ('pw_default', 'freq_default')},
+    'geometry': {'run': ('resolution', 'output_resolution', 'view_angle', 'origin', 'renderer', 'window_cutoff',
+                         'max_amplitude', 'num_sigma_buckets', 'min_bucket_sigma', 'use_gaussian_lut',
+                         'gaussian_lut_size', 'gaussian_lut_cutoff', 'tile_size'),
+                 'sampling': ('sampling_method', 'RF_size'), 'size': None, 'gabor': None},
+    'render_workers': {'run': ('renderer', 'render_workers', 'render_cpus')},
+}
+
+# Parameters that can only be changed by creating a new simulator (the phosphene locations are computed from the
+# cortex model before the simulator is created).
+REBUILD_PARAMS = {'run': ('gpu', 'dtype', 'seed', 'batch_size', 'min_angle', 'compile'), 'cortex_model': None}
+
+
+def get_changed_params(params: dict, new_params: dict) -> Set[Tuple[str, Optional[str]]]:
+    """The parameters that differ, as (section, key) pairs (key None: a section that is not a dict)."""
+    changed = set()
+    for section in params.keys() | new_params.keys():
+        old, new = params.get(section), new_params.get(section)
+        if isinstance(old, dict) and isinstance(new, dict):
+            changed.update((section, key) for key in old.keys() | new.keys() if old.get(key) != new.get(key))
+        elif old != new:
+            changed.add((section, None))
+    return changed
+
+
+def depends_on(changed: Set[Tuple[str, Optional[str]]], dependencies: dict) -> bool:
+    """Whether any of the changed parameters (see get_changed_params) is one of the dependencies (see
+    DEPENDENCIES)."""
+    return any(section in dependencies and (dependencies[section] is None or key is None or
+                                            key in dependencies[section])
+               for section, key in changed)
+
 
 class GaussianSimulator:
     def __init__(self, params: dict, coordinates: Map,
                  rng: Optional[np.random.Generator] = None, 
-                 theta: Optional[np.ndarray] = None):
+                 theta: Optional[np.ndarray] = None,
+                 cache: Optional[GeometryCache] = None):
         """initialize a simulator with provided parameters settings,
         given phosphene locations in polar coordinates
 
@@ -174,18 +324,105 @@ class GaussianSimulator:
         :param coordinates: Eccentricities and angles of phosphenes.
         :param theta: Orientations for gabor filtering (if 'gabor_filtering' set to True)
         :param rng: Numpy random number generator.
+        :param cache: Cache to load the precomputed geometry (phosphene maps, magnification, receptive fields and
+            render windows) from, or to store it in. Keyed by the GEOMETRY_PARAMS, the phosphene locations and theta.
         """
 
         self.params = params
         self.data_kwargs = get_data_kwargs(self.params)
+        # The phosphenes are rendered in the dtype of the parameters, also in half precision (the rest of the
+        # simulator then computes in float32, see get_data_kwargs).
+        self.render_kwargs = get_render_kwargs(self.params)
 
-        rng = np.random.default_rng() if rng is None else rng
+        self.rng = np.random.default_rng() if rng is None else rng
         set_deterministic(self.params['run']['seed'])
 
-        self.deg2pix_coeff = get_deg2pix_coeff(self.params['run'])
+        # All phosphene locations, also those out of view, which can come into view when the view changes (see
+        # reconfigure). use_subset replaces the arrays, so a shallow copy keeps them.
+        self._coordinates = copy.copy(coordinates)
+        self._in_view = None
+        self.theta = theta
+        self._cache = cache
+        self._render_workers = None
+        self._build_geometry(coordinates)
+        self._configure_render_workers()
+
+        self._configure_stimulation()
+        self._sqrt_pi_inv = 1 / torch.sqrt(self.to_tensor(torch.pi))
+        self._zero = self.to_tensor(0)
+        self._inf = self.to_tensor(torch.inf)
+
+        self.reset()
 
-        self.phosphene_maps = \
-            self.generate_phosphene_maps(coordinates, theta=theta)
+        # The update and render of a frame as one compiled graph (see compile in params.yaml).
+        self._compiled_step = None
+        if self.params['run']['compile']:
+            self._compiled_step = torch.compile(self._step, dynamic=False)
+            self._warm_up()
+
+    def _build_geometry(self, coordinates: Map):
+        """Compute the geometry of the simulator (the phosphenes in view, their maps, magnification, receptive fields
+        and render windows) for the current parameters, or load it from the cache.
+
+        When the geometry is rebuilt (see reconfigure), the phosphenes that remain in view keep their state (and
+        orientation), and the phosphenes that come into view start from a clean state.
+
+        :param coordinates: Locations of all phosphenes (the phosphenes out of view are removed from them).
+        """
+        self.deg2pix_coeff = get_deg2pix_coeff(self.params['run'])
+        # The phosphenes are rendered at the output resolution, which can differ from the resolution at which the
+        # stimulus is sampled.
+        self.render_params = dict(self.params['run'])
+        if self.params['run'].get('output_resolution') is not None:
+            self.render_params['resolution'] = list(self.params['run']['output_resolution'])
+
+        x_coords, y_coords = self.get_phosphene_locations(coordinates)
+        self._num_phosphenes = len(coordinates)
+        in_view = to_numpy(self.get_in_view(*map(self.to_tensor, self._coordinates.cartesian)))
+        source = target = None
+        if self._in_view is not None:
+            # Positions of the phosphenes that remain in view, among the old and among the new phosphenes.
+            remain = self._in_view & in_view
+            source, target = np.flatnonzero(remain[self._in_view]), np.flatnonzero(remain[in_view])
+        self._in_view = in_view
+
+        theta = self.theta
+        if self.params['gabor']['gabor_filtering'] and (theta is None or source is not None):
+            # Random rotation, shared by rendering and sampling.
+            new_theta = to_numpy(torch.mul(2 * math.pi, torch.rand(
+                (self.num_phosphenes, 1, 1), **self.data_kwargs)))
+            if theta is not None:
+                new_theta[target] = theta[source]
+            theta = new_theta
+        self.theta = theta
+
+        # Precomputed geometry, loaded from the cache if it holds an entry for these parameters and locations.
+        cache = self._cache
+        self._geometry = None
+        self._new_geometry = {}
+        if cache is not None:
+            geometry_params = {section: self.params[section] if keys is None else
+                               {key: self.params[section][key] for key in keys}
+                               for section, keys in GEOMETRY_PARAMS.items()}
+            cache_key = cache.key('simulator', geometry_params, *coordinates.polar, theta)
+            self._geometry = cache.load(cache_key)
+
+        self._renderer = self.params['run']['renderer']
+        if self._renderer == 'dense':
+            self.phosphene_maps = self._get_geometry('phosphene_maps', lambda: dict(
+                maps=self.generate_phosphene_maps(coordinates, remove_invalid=False, theta=theta)))['maps'].to(
+                self.render_kwargs['dtype'])
+        elif self._renderer in ['windowed', 'bucketed', 'tiled']:
+            # Phosphene maps are only stored within the render windows, if at
+            # all.
+            self.phosphene_maps = None
+        else:
+            raise ValueError("Renderer should be 'dense', 'windowed', "
+                             "'bucketed' or 'tiled'.")
+        if self._renderer == 'bucketed' and \
+                self.params['gabor']['gabor_filtering']:
+            raise ValueError("The bucketed renderer does not support gabor "
+                             "filtering.")
 
         batch_size = self.params['run']['batch_size']
         if batch_size != 0:
@@ -197,45 +434,209 @@ class GaussianSimulator:
 
         r, phi = coordinates.polar
         r = torch.reshape(self.to_tensor(r), self.shape[-3:])
-        self.magnification = get_cortical_magnification(
-            r, self.params['cortex_model'])
-
-        verbose = self.params['run']['print_stats']
-        self.activation = Activation(params, self.shape, verbose=verbose)
-        self.trace = Trace(params, self.shape)
-        self.sigma = Sigma(params, self.shape, self.magnification)
-        self.brightness = Brightness(params, self.shape)
-        self.threshold = ActivationThreshold(params, self.shape, rng)
+        self.magnification = self._get_geometry('magnification', lambda: dict(
+            magnification=get_cortical_magnification(r, self.params['cortex_model'])))['magnification']
+
+        if source is None:
+            verbose = self.params['run']['print_stats']
+            self.activation = Activation(self.params, self.shape, verbose=verbose)
+            self.trace = Trace(self.params, self.shape)
+            self.sigma = Sigma(self.params, self.shape, self.magnification)
+            self.brightness = Brightness(self.params, self.shape)
+            self.threshold = ActivationThreshold(self.params, self.shape, self.rng)
+        else:
+            source, target = torch.from_numpy(source), torch.from_numpy(target)
+            for state in (self.activation, self.trace, self.sigma, self.brightness, self.threshold):
+                state.remap(self.shape, source, target)
+            self.sigma.magnification = self.magnification
+            self.sigma.configure(self.params)
         self.effective_charge_per_second = None
 
         # Pre-allocate some helper variables.
         self._sampling_mask = None
-        self._phosphene_centers = None
+        self._image_buffer = None
+        self._rendered = None
         params_sampling = self.params['sampling']
         self._sampling_method = params_sampling['sampling_method']
-        self._sqrt_pi_inv = 1 / torch.sqrt(self.to_tensor(torch.pi))
+        self._phosphene_centers = get_center_indices(
+            self.params['run'], x_coords, y_coords)
+        self.receptive_fields = None
+        if self._sampling_method == 'receptive_fields':
+            rf_radius = params_sampling['RF_size'] / self.magnification
+            self.receptive_fields = ReceptiveFields.from_arrays(self.params['run'], self._get_geometry(
+                'receptive_fields', lambda: ReceptiveFields(
+                    self.params['run'], x_coords, y_coords, rf_radius,
+                    partial(self.phosphene_distance, theta=theta),
+                    self.get_max_offset(rf_radius)).to_arrays()))
+
+        self.windows = None
+        self.buckets = None
+        self.tiles = None
+        params_run = self.render_params
+        max_sigma = self.sigma.get_max(
+            self.to_tensor(params_run['max_amplitude']))
+        if self._renderer in ['windowed', 'tiled']:
+            windows = WindowedRenderer.from_arrays(params_run, self._get_geometry(
+                'windows', lambda: WindowedRenderer(
+                    params_run, x_coords, y_coords,
+                    self.get_max_offset(params_run['window_cutoff'] * max_sigma),
+                    partial(self.phosphene_distance, theta=theta)).to_arrays())).to(self.render_kwargs['dtype'])
+            if self._renderer == 'windowed':
+                self.windows = windows
+            else:
+                # The tiles are rendered from the render windows.
+                self.tiles = TiledRenderer(windows, params_run['tile_size'])
+        elif self._renderer == 'bucketed':
+            # The phosphenes smaller than the smallest bucket are rendered exactly, in their render windows.
+            min_sigma = params_run['min_bucket_sigma'] / get_deg2pix_coeff(params_run)
+            windows = WindowedRenderer.from_arrays(params_run, self._get_geometry(
+                'windows', lambda: WindowedRenderer(
+                    params_run, x_coords, y_coords,
+                    params_run['window_cutoff'] * min(min_sigma, float(max_sigma.max())),
+                    self.phosphene_distance).to_arrays()))
+            self.buckets = BucketedRenderer(
+                params_run, x_coords, y_coords, float(max_sigma.max()),
+                params_run['num_sigma_buckets'], min_sigma,
+                params_run['window_cutoff'], windows).to(self.render_kwargs['dtype'])
+
+        self._gaussian_lut = None
+        if self.params['run']['use_gaussian_lut']:
+            self._gaussian_lut = GaussianLUT(
+                self.params['run']['gaussian_lut_size'],
+                self.params['run']['gaussian_lut_cutoff'], **self.render_kwargs)
+            logging.debug(f"Gaussian look-up table error is at most "
+                          f"{self._gaussian_lut.error_bound:.1E}.")
+
+        if cache is not None and self._geometry is None:
+            cache.store(cache_key, self._new_geometry)
+        self._geometry = self._new_geometry = None
+
+    def _configure_render_workers(self):
+        """Start the threads that render the tiles of the tiled renderer (see render_workers in params.yaml), replacing
+        the previous ones."""
+        if self._render_workers is not None:
+            self._render_workers.shutdown(wait=False)
+        self._render_workers = None
+        num_workers = self.params['run']['render_workers'] or get_num_cpus()
+        if self._renderer == 'tiled' and num_workers > 1:
+            self._render_workers = ThreadPoolExecutor(num_workers, thread_name_prefix='render',
+                                                      initializer=init_render_worker,
+                                                      initargs=(self.params['run']['render_cpus'],))
+
+    def _configure_stimulation(self):
         self._pulse_width = (self.params['default_stim']['pw_default'] *
                              torch.ones(self.shape, **self.data_kwargs))
         self._frequency = (self.params['default_stim']['freq_default'] *
                            torch.ones(self.shape, **self.data_kwargs))
 
-        self._zero = self.to_tensor(0)
-        self._inf = self.to_tensor(torch.inf)
+    def reconfigure(self, params: dict) -> List[str]:
+        """Apply new parameters while running, recomputing only the parts of the simulator that depend on the
+        parameters that changed (see DEPENDENCIES). E.g. a change of the temporal dynamics only recomputes the
+        coefficients of the activation and trace, and a change of the view angle or resolution only rebuilds the
+        geometry. The state (activation, trace, etc.) is kept.
 
-        self.reset()
+        :param params: dict of dicts with all setting parameters.
+        :return: Names of the parts that were recomputed (see DEPENDENCIES).
+        :raises ValueError: if parameters changed that require a new simulator (see REBUILD_PARAMS); the simulator is
+            then left unchanged.
+        """
+        changed = get_changed_params(self.params, params)
+        rebuild = sorted(f'{section}.{key}' for section, key in changed if depends_on({(section, key)}, REBUILD_PARAMS))
+        if rebuild:
+            raise ValueError(f"Changing {', '.join(rebuild)} requires a new simulator.")
+        parts = [part for part, dependencies in DEPENDENCIES.items() if depends_on(changed, dependencies)]
+
+        self.params = params
+        for state in (self.activation, self.trace, self.sigma, self.brightness, self.threshold):
+            state.params = params
+        if 'activation' in parts:
+            self.activation.configure(params)
+        if 'trace' in parts:
+            self.trace.configure(params)
+        if 'brightness' in parts:
+            self.brightness.configure(params)
+        if 'threshold' in parts:
+            self.threshold.configure(params)
+        if 'geometry' in parts:
+            # Also rescales sigma to the new magnification.
+            self._build_geometry(copy.copy(self._coordinates))
+        elif 'sigma' in parts:
+            self.sigma.configure(params)
+        if 'stimulation' in parts or 'geometry' in parts:
+            self._configure_stimulation()
+        if 'render_workers' in parts:
+            self._configure_render_workers()
+        if self.compiled:
+            # Recompile now (e.g. for the new number of phosphenes) rather than at the next frame.
+            self._warm_up()
+        return parts
+
+    def copy(self) -> 'GaussianSimulator':
+        """A copy of the simulator that can be reconfigured (see reconfigure) while this simulator continues to run,
+        e.g. on another thread. The geometry is shared (reconfigure replaces it, rather than changing it), the state is
+        copied as it is now (see take_state), and the copy has its own render workers.
+
+        :return: The copy.
+        """
+        simulator = copy.copy(self)
+        for name in ('activation', 'trace', 'sigma', 'brightness', 'threshold'):
+            setattr(simulator, name, copy.copy(getattr(self, name)))
+        simulator._render_workers = None
+        simulator._configure_render_workers()
+        if self.compiled:
+            simulator._compiled_step = torch.compile(simulator._step, dynamic=False)
+        return simulator
+
+    def take_state(self, other: 'GaussianSimulator'):
+        """Continue from the temporal state (activation and trace) of another simulator with the same phosphene
+        locations, e.g. after reconfiguring a copy of it (see copy). Phosphenes that are only in view in this simulator
+        keep their own state. Does nothing if the other simulator has other phosphene locations.
+
+        :param other: The simulator to take the state from.
+        """
+        if other._coordinates is not self._coordinates:
+            return
+        remain = self._in_view & other._in_view
+        source = torch.from_numpy(np.flatnonzero(remain[other._in_view]))
+        target = torch.from_numpy(np.flatnonzero(remain[self._in_view]))
+        for state, other_state in ((self.activation, other.activation), (self.trace, other.trace)):
+            state.state = state.state.detach().clone()
+            state.state[..., target, :, :] = other_state.state[..., source, :, :]
+
+    def close(self):
+        """Stop the render workers (see render_workers in params.yaml). The tiles are then rendered on the calling
+        thread."""
+        if self._render_workers is not None:
+            self._render_workers.shutdown(wait=False)
+        self._render_workers = None
+
+    def _get_geometry(self, name: str, compute: Callable[[], Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        """Tensors of (a part of) the geometry of the simulator: loaded from the cache, or computed (and stored in the
+        cache with the rest of the geometry at the end of __init__)."""
+        if self._geometry is not None:
+            prefix = name + '.'
+            return {key[len(prefix):]: torch.from_numpy(array).to(self.data_kwargs['device'])
+                    for key, array in self._geometry.items() if key.startswith(prefix)}
+        tensors = compute()
+        self._new_geometry.update({f'{name}.{key}': tensor for key, tensor in tensors.items()})
+        return tensors
 
     @property
     def num_phosphenes(self):
-        return len(self.phosphene_maps)
+        return self._num_phosphenes
 
     def to_tensor(self, x: Union[int, float, np.ndarray]) -> torch.Tensor:
         return to_tensor(x, **self.data_kwargs)
 
-    def reset(self):
-        """Reset Memory of previous timestep."""
-        self.activation.reset()
-        self.trace.reset()
-        self.sigma.reset()
+    def reset(self, index: Optional[int] = None):
+        """Reset Memory of previous timestep.
+
+        :param index: If given, only reset batch element `index` (e.g. when a
+            new stream starts using that element).
+        """
+        self.activation.reset(index)
+        self.trace.reset(index)
+        self.sigma.reset(index)
 
     def gabor_rotation(self, x, y, theta=None) -> torch.Tensor:
         """Rotation of ellipsis."""
@@ -250,17 +651,43 @@ class GaussianSimulator:
         phosphene_maps = torch.sqrt(x_rotated ** 2 + y_rotated ** 2 * gamma ** 2)
         return phosphene_maps
 
-    def generate_phosphene_maps(self, coordinates: Map,
-                                remove_invalid: Optional[bool] = True,
-                                theta: Optional[np.ndarray] = None,
-                                ) -> torch.Tensor:
-        """Generate phosphene maps (for each phosphene distance to each pixel).
+    def phosphene_distance(self, x: torch.Tensor, y: torch.Tensor,
+                           theta: Optional[np.ndarray] = None
+                           ) -> torch.Tensor:
+        """Distance of pixel offsets x, y (in degrees) to the phosphene
+        center, as used in the Gaussian."""
+        if self.params['gabor']['gabor_filtering']:
+            return self.gabor_rotation(x, y, theta)
+        return torch.sqrt(x ** 2 + y ** 2)
+
+    def get_max_offset(self, radius: torch.Tensor) -> float:
+        """Largest horizontal or vertical offset (in degrees) from a
+        phosphene center at which phosphene_distance is below radius."""
+        if self.params['gabor']['gabor_filtering']:
+            # Elongated phosphenes extend further along the minor axis.
+            radius = radius / min(self.params['gabor']['gamma'], 1)
+        return float(radius.max())
+
+    def get_in_view(self, x_coords: torch.Tensor, y_coords: torch.Tensor
+                    ) -> torch.Tensor:
+        """Whether phosphene locations (in degrees) are inside of the view
+        angle, as a flat boolean tensor."""
+        # x,y limits of the simulation
+        x_org, y_org = self.params['run']['origin']
+        hemi_fov = self.params['run']['view_angle'] / 2
+        x_min, x_max = x_org - hemi_fov, x_org + hemi_fov
+        y_min, y_max = y_org - hemi_fov, y_org + hemi_fov
+        return (torch.ge(x_coords, x_min) & torch.less(x_coords, x_max) &
+                torch.ge(y_coords, y_min) & torch.less(y_coords, y_max)).ravel()
+
+    def get_phosphene_locations(self, coordinates: Map,
+                                remove_invalid: Optional[bool] = True
+                                ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Get the phosphene centers (in degrees) as (n_phosphenes, 1, 1)
+        tensors.
 
         :param coordinates: Coordinates of phosphenes.
         :param remove_invalid: Whether to remove phosphenes out of view.
-        :param theta: Orientations for gabor filtering (if 'gabor_filtering' set to True)
-        :return: an (n_phosphenes x resolution[0] x resolution[1]) array
-        describing distances from phosphene locations
         """
 
         # Phosphene coordinates
@@ -268,18 +695,8 @@ class GaussianSimulator:
         x_coords = torch.reshape(self.to_tensor(x_coords), (-1, 1, 1))
         y_coords = torch.reshape(self.to_tensor(y_coords), (-1, 1, 1))
 
-        # x,y limits of the simulation
-        res_x, res_y = self.params['run']['resolution']
-        x_org, y_org = self.params['run']['origin']
-        hemi_fov = self.params['run']['view_angle'] / 2
-        x_min, x_max = x_org - hemi_fov, x_org + hemi_fov
-        y_min, y_max = y_org - hemi_fov, y_org + hemi_fov
-     
         if remove_invalid:
-            # Check if phosphene locations are inside of view angle.
-            valid = (
-                torch.ge(x_coords, x_min) & torch.less(x_coords, x_max) &
-                torch.ge(y_coords, y_min) & torch.less(y_coords, y_max)).ravel()
+            valid = self.get_in_view(x_coords, y_coords)
             num_total = len(x_coords)
             num_valid = torch.sum(valid)
             logging.debug(f"{num_total - num_valid} of {num_total} phosphenes "
@@ -288,12 +705,29 @@ class GaussianSimulator:
             y_coords = y_coords[valid]
             coordinates.use_subset(to_numpy(valid))
 
+        return x_coords, y_coords
+
+    def generate_phosphene_maps(self, coordinates: Map,
+                                remove_invalid: Optional[bool] = True,
+                                theta: Optional[np.ndarray] = None,
+                                ) -> torch.Tensor:
+        """Generate phosphene maps (for each phosphene distance to each pixel).
+
+        :param coordinates: Coordinates of phosphenes.
+        :param remove_invalid: Whether to remove phosphenes out of view.
+        :param theta: Orientations for gabor filtering (if 'gabor_filtering' set to True)
+        :return: an (n_phosphenes x output_resolution[1] x
+        output_resolution[0]) array describing distances from phosphene
+        locations
+        """
+        x_coords, y_coords = self.get_phosphene_locations(coordinates,
+                                                          remove_invalid)
+
         # Get distance maps to phosphene centres (in degrees of visual angle).
         device = self.data_kwargs['device']
         num_phosphenes = len(x_coords)
 
-        x_range = torch.linspace(x_min, x_max, res_x, device=device)
-        y_range = torch.linspace(y_min, y_max, res_y, device=device)
+        x_range, y_range = get_pixel_grid(self.render_params, device=device)
 
         grid = torch.meshgrid(x_range, y_range, indexing='xy')
         grid_x = torch.tile(grid[0], (num_phosphenes, 1, 1))
@@ -301,12 +735,7 @@ class GaussianSimulator:
         x = grid_x - x_coords
         y = grid_y - y_coords
 
-        if self.params['gabor']['gabor_filtering']:
-            phosphene_maps = self.gabor_rotation(x, y, theta)
-        else:
-            phosphene_maps = torch.sqrt(x ** 2 + y ** 2)
-
-        return phosphene_maps
+        return self.phosphene_distance(x, y, theta)
 
     def update(self, amplitude: torch.Tensor,
                pulse_width: Optional[torch.Tensor] = None,
@@ -330,7 +759,7 @@ class GaussianSimulator:
 
         self.activation.update(charge_per_s)
 
-        #self.trace.update(charge_per_s)
+        self.trace.update(charge_per_s)
 
         self.sigma.update(amplitude.view(self.shape))
 
@@ -361,12 +790,25 @@ class GaussianSimulator:
         mapping.
 
         :return: Stack of Gaussian-shaped phosphene images
-        (n_phosphenes, resolution_y, resolution_x)
+        (n_phosphenes, resolution_y, resolution_x), or of the render windows
+        (n_phosphenes, k, k) when using the windowed renderer.
         """
-
-        # Calculate normalized Gaussian (peak has value 1).
-        sigma = self.sigma.get().clamp(1e-22, None)  # TODO: clamping redundant? Default division by zero gives inf.
-        exp = torch.exp(-0.5 * (self.phosphene_maps / sigma) ** 2)
+        if self.windows is None:
+            phosphene_maps = self.phosphene_maps
+        else:
+            phosphene_maps = self.windows.distances
+        return self.gaussian(phosphene_maps, self.sigma.get())
+
+    def gaussian(self, phosphene_maps: torch.Tensor, sigma: torch.Tensor) -> torch.Tensor:
+        """Normalized Gaussian (peak has value 1) of the phosphene maps or render windows, for the given sigmas (in the
+        dtype of the maps)."""
+        # TODO: clamping redundant? Default division by zero gives inf.
+        # (1e-22 is zero in half precision, which would give 0 / 0 at the phosphene centers.)
+        min_sigma = max(1e-22, torch.finfo(phosphene_maps.dtype).tiny)
+        sigma = sigma.to(phosphene_maps.dtype).clamp(min_sigma, None)
+        if self._gaussian_lut is not None:
+            return self._gaussian_lut(phosphene_maps, sigma)
+        exp = torch.exp(-0.5 * (phosphene_maps / sigma) ** 2)
         return exp
 
     def get_state(self):
@@ -393,24 +835,148 @@ class GaussianSimulator:
         :return: image with simulated phosphene representation
         """
 
+        if self._compiled_step is not None:
+            return self._compiled_step(amplitude, pulse_width, frequency)
+        return self._step(amplitude, pulse_width, frequency)
+
+    def _step(self, amplitude: torch.Tensor, pulse_width: Optional[torch.Tensor],
+              frequency: Optional[torch.Tensor]) -> torch.Tensor:
         # Update phosphene state.
         self.update(amplitude, pulse_width, frequency)
 
-        # Generate phosphene map.
-        activation = self.gaussian_activation()
+        return self.render()
+
+    @property
+    def compiled(self) -> bool:
+        """Whether the update and render of a frame are compiled into one graph (see __call__ and step)."""
+        return self._compiled_step is not None
+
+    def _warm_up(self):
+        """Compile the step by running it once, without changing the state."""
+        states = [(state, state.state) for state in (self.activation, self.trace, self.sigma, self.brightness)]
+        rendered, charge_per_second = self._rendered, self.effective_charge_per_second
+        self._rendered = None
+        self._compiled_step(torch.zeros(self.shape[:-2], **self.data_kwargs), None, None)
+        for state, value in states:
+            state.state = value
+        self._rendered, self.effective_charge_per_second = rendered, charge_per_second
+
+    def step(self, amplitude: torch.Tensor, out: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Update the state with the stimulation and render the 8-bit frame: __call__ followed by the conversion of
+        render_frame. When compiled, the update and render are one graph.
+
+        :param amplitude: Stimulation amplitudes for each electrode.
+        :param out: See render_frame.
+        :return: The frame (out, if given).
+        """
+        return self._to_frame(self(amplitude), out)
+
+    def render(self) -> torch.Tensor:
+        """Render the phosphene image of the current state.
 
+        :return: image with simulated phosphene representation
+        """
         # Thresholding: Set phosphene intensity to zero if tissue activation is lower than threshold.
         supra_threshold = torch.greater(self.activation.get(), self.threshold.get())
         intensity = torch.where(supra_threshold, self.brightness.get(), self._zero)
+        # Rendered in the render dtype (see get_render_kwargs).
+        intensity = intensity.to(self.render_kwargs['dtype'])
+
+        if self._renderer == 'bucketed':
+            # The buckets are chosen at the precision of the simulator, as rounding sigma changes the bucket of the
+            # phosphenes close to the bucket boundaries.
+            return self.buckets.render(intensity, self.sigma.get(), self.gaussian).clamp(0, 1)
+        sigma = self.sigma.get().to(self.render_kwargs['dtype'])
+        if self._renderer == 'tiled':
+            return self._render_tiles(intensity, sigma).clamp(0, 1)
+        if self.params['run']['incremental_render']:
+            return self._render_incremental(intensity, sigma).clamp(0, 1)
+        self._rendered = None
+
+        # Generate phosphene map.
+        activation = self.gaussian_activation()
 
         # Return phosphene image.
+        if self._renderer == 'windowed':
+            return self.windows.render(intensity, activation).clamp(0, 1)
         return torch.sum(intensity * activation, dim=self._electrode_dimension).clamp(0, 1)
 
+    @torch.compiler.disable  # Renders on the worker threads.
+    def _render_tiles(self, intensity: torch.Tensor, sigma: torch.Tensor) -> torch.Tensor:
+        """Render with the tiled renderer, on the render workers (see render_workers in params.yaml)."""
+        return self.tiles.render(intensity, sigma, self.gaussian, self._render_workers)
+
+    @torch.compiler.disable  # Data-dependent; would be recompiled for every frame (see compile in params.yaml).
+    def _render_incremental(self, intensity: torch.Tensor, sigma: torch.Tensor) -> torch.Tensor:
+        """Render by updating the previously rendered image: only the contributions of the phosphenes whose intensity
+        or sigma changed by more than incremental_tolerance (absolutely, resp. relatively) since they were last
+        rendered are replaced. The image is rendered in full every incremental_refresh_interval frames, which bounds
+        the accumulated rounding errors, and when most phosphenes changed. The image is kept in the dtype of the
+        simulator, also when rendering in half precision.
+
+        :param intensity: Phosphene intensities (after thresholding).
+        :param sigma: Phosphene sizes.
+        :return: Phosphene image, not clamped.
+        """
+        params_run = self.params['run']
+        rendered = self._rendered
+        if rendered is not None and rendered['frames'] + 1 < params_run['incremental_refresh_interval']:
+            tolerance = params_run['incremental_tolerance']
+            old_intensity, old_sigma = rendered['intensity'], rendered['sigma']
+            changed = (torch.abs(intensity - old_intensity) > tolerance) | \
+                ((torch.abs(sigma - old_sigma) > tolerance * old_sigma) & ((intensity > 0) | (old_intensity > 0)))
+            # Phosphenes that changed in any batch element.
+            phosphenes = torch.nonzero(changed.view(-1, self.num_phosphenes).any(dim=0)).ravel()
+            # Replacing a contribution costs about twice as much as rendering it.
+            if 2 * len(phosphenes) < self.num_phosphenes:
+                dim = self._electrode_dimension
+                new_intensity, new_sigma = intensity.index_select(dim, phosphenes), sigma.index_select(dim, phosphenes)
+                maps = self.phosphene_maps if self.windows is None else self.windows.distances
+                maps = maps[phosphenes]
+                change = new_intensity * self.gaussian(maps, new_sigma) - \
+                    old_intensity.index_select(dim, phosphenes) * \
+                    self.gaussian(maps, old_sigma.index_select(dim, phosphenes))
+                old_intensity.index_copy_(dim, phosphenes, new_intensity)
+                old_sigma.index_copy_(dim, phosphenes, new_sigma)
+                rendered['frames'] += 1
+                change = change.to(rendered['image'].dtype)
+                if self.windows is None:
+                    rendered['image'] += torch.sum(change, dim=dim)
+                    return rendered['image']
+                return self.windows.crop(self.windows.accumulate(change, rendered['image'], phosphenes))
+
+        contribution = (intensity * self.gaussian_activation()).to(self.data_kwargs['dtype'])
+        if self.windows is None:
+            image = torch.sum(contribution, dim=self._electrode_dimension)
+        else:
+            image = self.windows.accumulate(contribution)  # The padded canvas
+        self._rendered = dict(image=image, intensity=intensity.clone(), sigma=sigma.clone(), frames=0)
+        return image if self.windows is None else self.windows.crop(image)
+
+    def render_frame(self, out: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Render the phosphene image of the current state as an 8-bit frame (0-255), at the output resolution.
+
+        :param out: uint8 tensor of shape (..., output_resolution[1], output_resolution[0]) to write the frame into,
+            e.g. a (pinned) buffer that is reused for every frame. It may be on another device than the simulator.
+        :return: The frame (out, if given).
+        """
+        return self._to_frame(self.render(), out)
+
+    @staticmethod
+    def _to_frame(image: torch.Tensor, out: Optional[torch.Tensor]) -> torch.Tensor:
+        image = image.mul_(255).round_()
+        if out is None:
+            return image.to(torch.uint8)
+        return out.copy_(image)
+
+    @property
+    def output_resolution(self) -> Tuple[int, int]:
+        """(width, height) in pixels of the rendered images."""
+        return tuple(self.render_params['resolution'])
+
     @property
     def phosphene_centers(self):
         """Indices (flat indexing) of the phosphene centers"""
-        if self._phosphene_centers is None:
-            self._phosphene_centers = self.phosphene_maps.flatten(start_dim=1).argmin(dim=-1)
         return self._phosphene_centers
 
     def sample_centers(self, x: torch.Tensor) -> torch.Tensor:
@@ -420,26 +986,36 @@ class GaussianSimulator:
 
     def sample_receptive_fields(self, x: torch.Tensor) -> torch.Tensor:
         """Extracts the maximum value of activation mask x within the 'receptive field' of each phosphene"""
-        return torch.amax(self.sampling_mask * x, dim=(-2,-1))
+        return self.receptive_fields.sample(x)
 
     @property
     def sampling_mask(self):
         """Boolean mask (tensor) that defines which pixels are inside the receptive field / center of each phosphene"""
+        # The sampling mask is not used anymore (pixels are directly retrieved using the sparse receptive field index
+        # or the center indices), but still implemented here for backwards compatibility
         if self._sampling_mask is None:
-            params = self.params['sampling']
             if self._sampling_method == 'receptive_fields':
-                self._sampling_mask = torch.less(self.phosphene_maps, params['RF_size'] / self.magnification)
+                self._sampling_mask = self.receptive_fields.to_dense()
             elif self._sampling_method == 'center':
-                # Sampling mask is not used anymore in 'center' mode (pixels are directly retrieved using indexing),
-                # but still implemented here for backwards compatibility
-                p_map = self.phosphene_maps
-                flat_idx = torch.arange(p_map.shape[0], device=p_map.device) * p_map.shape[-2] * p_map.shape[-1]
-                self._sampling_mask = torch.zeros_like(p_map)
-                self._sampling_mask.flatten()[self.phosphene_centers + flat_idx] = 1
+                res_x, res_y = self.params['run']['resolution']
+                self._sampling_mask = torch.zeros((self.num_phosphenes, res_y * res_x), **self.data_kwargs)
+                self._sampling_mask[torch.arange(self.num_phosphenes), self.phosphene_centers] = 1
+                self._sampling_mask = self._sampling_mask.view(self.num_phosphenes, res_y, res_x)
             else:
                 raise NotImplementedError
         return self._sampling_mask
 
+    def _image_to_tensor(self, image: np.ndarray) -> torch.Tensor:
+        """An image as tensor, in the dtype and on the device of the simulator. When it is in another dtype, or the
+        simulator is not on the CPU, it is converted into a buffer that is reused by the next call. Otherwise the
+        tensor shares the memory of the image."""
+        tensor = torch.from_numpy(np.ascontiguousarray(image))
+        if tensor.dtype == self.data_kwargs['dtype'] and torch.device(self.data_kwargs['device']).type == 'cpu':
+            return tensor
+        if self._image_buffer is None or self._image_buffer.shape != tensor.shape:
+            self._image_buffer = torch.empty(tensor.shape, **self.data_kwargs)
+        return self._image_buffer.copy_(tensor)
+
     def sample_stimulus(self, activation_mask: Union[np.ndarray, torch.Tensor], rescale=False,
                         ) -> torch.Tensor:
         """Obtain a stimulation vector from an activation mask image that indicates the regional stimulation intensity.
@@ -449,23 +1025,34 @@ class GaussianSimulator:
 
         param rescale: If False (default), the pixel intensities indicate the stimulation amplitude in Amperes.
                         If True, the input pixels (in range [0, 1] or [0, 255]) are mapped to stimulation amplitudes
-                        using the default stimulus scale parameter specified in the params configuration file.
+                        using the default stimulus scale parameter specified in the params configuration file. For
+                        tensors (e.g. processed on the device of the simulator, see image_processing.to_device), the
+                        range of each image is determined on the device, without synchronizing with it.
 
         return: Stimulation tensor with the stimulation amplitudes for each phosphene. """
 
+        # Images in [0, 255] are scaled to [0, 1] after sampling, which gives the same result (the sampled pixels do
+        # not depend on the scale), but only scales one value per phosphene.
+        scale = None
         if isinstance(activation_mask, np.ndarray):
-            dtype = activation_mask.dtype
-            activation_mask = self.to_tensor(activation_mask)
-            if (dtype == np.dtype('uint8')) or (activation_mask.max() > 1):
-                activation_mask = scale_image(activation_mask, 1 / 255)
+            if (activation_mask.dtype == np.dtype('uint8')) or (activation_mask.max() > 1):
+                scale = 1 / 255
+            activation_mask = self._image_to_tensor(activation_mask)
+        elif rescale:
+            activation_mask = activation_mask.to(**self.data_kwargs)
+            in_pixels = activation_mask.amax(dim=(-2, -1)) > 1
+            scale = torch.where(in_pixels, 1 / 255, 1.).to(activation_mask.dtype)
         if self._sampling_method == 'receptive_fields':
             electrode_activation = self.sample_receptive_fields(activation_mask)
         elif self._sampling_method == 'center':
             electrode_activation = self.sample_centers(activation_mask)  # electrode activations between 0 and 1
         else:
             raise NotImplementedError
+        # The sampled activations are a new tensor, which can be scaled in place.
+        if scale is not None:
+            electrode_activation.mul_(scale)
         if rescale:
-            electrode_activation = torch.mul(electrode_activation, self.params['sampling']['stimulus_scale'])
+            electrode_activation.mul_(self.params['sampling']['stimulus_scale'])
         elif electrode_activation.max() >= 1e-3:
             warnings.warn("High values detected! Activation mask not longer rescaled as default behaviour. Please set "
                           "rescale=True to map pixels in range [0, 1] or [0, 255] to the default stimulus scale.",
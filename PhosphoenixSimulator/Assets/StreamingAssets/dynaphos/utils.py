@@ -1,9 +1,8 @@
 import logging
+import os
 import numpy as np
 import torch
 import yaml
-from matplotlib import pyplot as plt
-from scipy.stats import truncnorm
 from typing import Optional, Tuple, Union, Iterable
 
 
@@ -17,6 +16,20 @@ def get_deg2pix_coeff(run_params: dict) -> float:
     return deg2pix
 
 
+def get_pixel_grid(run_params: dict, device: Optional[str] = None
+                   ) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Horizontal and vertical pixel positions (in degrees) of the simulated
+    field of view."""
+    res_x, res_y = run_params['resolution']
+    x_org, y_org = run_params['origin']
+    hemi_fov = run_params['view_angle'] / 2
+    x_range = torch.linspace(x_org - hemi_fov, x_org + hemi_fov, res_x,
+                             device=device)
+    y_range = torch.linspace(y_org - hemi_fov, y_org + hemi_fov, res_y,
+                             device=device)
+    return x_range, y_range
+
+
 def calculate_dpi(params: dict) -> float:
     w_pixels = params['display']['screen_resolution'][0]
     h_pixels = params['display']['screen_resolution'][1]
@@ -27,6 +40,10 @@ def calculate_dpi(params: dict) -> float:
 
 
 def display_real_size(params: dict, image: np.ndarray):
+    # Imported here, as matplotlib (and scipy below) take long to import and
+    # are not needed to run the simulator.
+    from matplotlib import pyplot as plt
+
     mm_per_degree = \
         params['display']['dist_to_screen'] * np.tan(2 * np.pi / 360)
     view_angle = params['run']['view_angle']
@@ -53,17 +70,36 @@ def display_real_size(params: dict, image: np.ndarray):
 def load_coordinates_from_yaml(path: str, n_coordinates: Optional[int] = None,
                                rng: Optional[np.random.Generator] = None
                                ) -> Tuple[np.ndarray, np.ndarray]:
-    with open(path, 'r') as f:
-        coordinates = yaml.load(f, Loader=yaml.FullLoader)
-        x = np.array(coordinates['x'])
-        y = np.array(coordinates['y'])
+    """Load electrode coordinates from a layout: a compiled layout (.npz, see
+    dynaphos/layouts.py), or a YAML file with lists 'x' and 'y'.
+
+    :param path: Layout file.
+    :param n_coordinates: Number of electrodes to sample, without replacement
+        (all of them if the layout has fewer). The sampled electrodes keep the
+        order of the layout.
+    :param rng: Numpy random number generator.
+    """
+    if path.endswith('.npz'):
+        with np.load(path) as layout:
+            x = layout['x']
+            y = layout['y']
+    else:
+        with open(path, 'r') as f:
+            coordinates = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader',
+                                                      yaml.SafeLoader))
+            x = np.array(coordinates['x'])
+            y = np.array(coordinates['y'])
 
     if n_coordinates:
-        if rng is None:
-            rng = np.random.default_rng()
-        sample = rng.choice(len(x), n_coordinates)
-        x = x[sample]
-        y = y[sample]
+        if n_coordinates > len(x):
+            logging.warning(f"Requested {n_coordinates} electrodes, but the "
+                            f"layout has {len(x)}; using all of them.")
+        else:
+            if rng is None:
+                rng = np.random.default_rng()
+            sample = np.sort(rng.choice(len(x), n_coordinates, replace=False))
+            x = x[sample]
+            y = y[sample]
 
     return x, y
 
@@ -82,7 +118,24 @@ def to_numpy(x: torch.Tensor) -> np.ndarray:
     return x.cpu().numpy()
 
 
+# Half-precision dtypes (see dtype in params.yaml), which are only used to
+# render the phosphenes (see get_render_kwargs).
+HALF_PRECISION_DTYPES = ('float16', 'bfloat16')
+
+
 def get_data_kwargs(params: dict) -> dict:
+    """Device and dtype of the simulator (its state, geometry and the sampled
+    stimulus): the dtype in the parameters, or float32 for half precision."""
+    dtype = params['run']['dtype']
+    if dtype in HALF_PRECISION_DTYPES:
+        dtype = 'float32'
+    return dict(device=get_render_kwargs(params)['device'],
+                dtype=getattr(torch, dtype))
+
+
+def get_render_kwargs(params: dict) -> dict:
+    """Device and dtype in which the phosphenes are rendered (phosphene maps,
+    render windows, etc.): the dtype in the parameters."""
     dtype = getattr(torch, params['run']['dtype'])
     gpu = params['run']['gpu']
     device = 'cpu' if not torch.cuda.device_count() or gpu is None \
@@ -90,6 +143,25 @@ def get_data_kwargs(params: dict) -> dict:
     return dict(device=device, dtype=dtype)
 
 
+def get_num_cpus() -> int:
+    """Number of cores this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def set_thread_affinity(cpus: Optional[Iterable[int]]) -> bool:
+    """Pin the calling thread to cores `cpus` (None: leave it as it is).
+    Threads it starts afterwards (e.g. torch's) inherit the cores.
+
+    :return: Whether the thread was pinned: only supported on Linux.
+    """
+    if cpus is None or not hasattr(os, 'sched_setaffinity'):
+        return False
+    os.sched_setaffinity(0, cpus)  # 0: the calling thread (on Linux)
+    return True
+
+
 def cartesian_to_complex(x: np.ndarray, y: np.ndarray) -> np.ndarray:
     return x + 1j * y
 
@@ -116,6 +188,8 @@ def cartesian_to_polar(x: np.ndarray, y: np.ndarray
 def get_truncated_normal(size: Union[int, Iterable], mean: float, sd: float,
                          low: Optional[float] = 0.,
                          upp: Optional[float] = 1e-4) -> np.ndarray:
+    from scipy.stats import truncnorm
+
     return truncnorm.rvs(
         (low - mean) / sd, (upp - mean) / sd, loc=mean, scale=sd, size=size)
 
@@ -0,0 +1,48 @@
+import tkinter as tk
+from tkinter import ttk
+from typing import Callable
+
+from base_processing_algorithm import BaseProcessingAlgorithm, find_algorithms, load_algorithm
+
+
+# Initialize the GUI application
+class FilterApp(tk.Tk):
+    def __init__(self, python_dir: str, start: Callable[[BaseProcessingAlgorithm, 'FilterApp'], None]):
+        """Window to select the processing algorithm in, before the simulation starts. Only imported when no algorithm
+        is configured, so that a headless server does not import tkinter.
+
+        :param python_dir: Directory that holds the processing_algorithms/ package.
+        :param start: Starts the simulation with the selected algorithm (and this app, which it should destroy).
+        """
+        super().__init__()
+        self.title("Algorithm Selection")
+        self.python_dir = python_dir
+        self.start = start
+
+        # Dropdown for selecting filters
+        self.filter_var = tk.StringVar(self)
+        self.filter_dropdown = ttk.Combobox(self, textvariable=self.filter_var)
+        self.filter_dropdown.set("Select Algorithm")  # Set default value
+        self.filter_dropdown.pack(pady=10)
+
+        # Button to start the video processing
+        self.start_button = ttk.Button(self, text="Start Simulation", command=self.start_processing)
+        self.start_button.pack(pady=10)
+
+        # Populate the dropdown with available formatters
+        self.algorithms = self.get_algorithms()
+        self.filter_dropdown['values'] = list(self.algorithms.keys())
+
+    def get_algorithms(self):
+        # Modules that hold the algorithm classes, by class name. Only the selected module is imported.
+        return find_algorithms(self.python_dir + "/processing_algorithms")
+
+    def start_processing(self):
+        # Get the selected filter
+        algorithm_name = self.filter_var.get()
+        if algorithm_name in self.algorithms:
+            algorithm_class = load_algorithm(algorithm_name, self.python_dir + "/processing_algorithms")
+            algorithm = algorithm_class()
+            self.start(algorithm, self)  # Pass selected filter
+        else:
+            print("Please select a valid filter!")
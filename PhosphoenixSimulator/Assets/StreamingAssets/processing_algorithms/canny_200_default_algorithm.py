@@ -3,7 +3,7 @@ from base_processing_algorithm import BaseProcessingAlgorithm
 import cv2
 import numpy as np
 import torch
-from dynaphos.image_processing import canny_processor
+from dynaphos.image_processing import blur_processor, canny_processor, to_device
 from dynaphos.simulator import GaussianSimulator
 
 THRESHOLD_HIGH = 200
@@ -18,12 +18,13 @@ class Canny200DefaultAlgorithm(BaseProcessingAlgorithm):
 
     """
     def process(self, data: np.ndarray, params: dict, simulator: GaussianSimulator):
-        frame = data
+        # On the GPU, the frame stays on the device of the simulator until it is sampled
+        frame = to_device(data, **simulator.data_kwargs)
 
-        frame = cv2.GaussianBlur(frame, (3, 3), 0)
+        frame = blur_processor(frame, 3, self.buffers)
         
         #processed_img = None
-        processed_img = canny_processor(frame, THRESHOLD_HIGH//2, THRESHOLD_HIGH)
+        processed_img = canny_processor(frame, THRESHOLD_HIGH//2, THRESHOLD_HIGH, self.buffers)
 
         stim_pattern = simulator.sample_stimulus(processed_img, rescale=True)
         
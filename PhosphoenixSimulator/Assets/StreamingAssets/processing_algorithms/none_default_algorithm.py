@@ -3,6 +3,7 @@ from base_processing_algorithm import BaseProcessingAlgorithm
 import cv2
 import numpy as np
 import torch
+from dynaphos.image_processing import blur_processor, to_device
 from dynaphos.simulator import GaussianSimulator
 
 class NoneDefaultAlgorithm(BaseProcessingAlgorithm):
@@ -16,12 +17,13 @@ class NoneDefaultAlgorithm(BaseProcessingAlgorithm):
         Returns: torch.Tensor: the phosphene image.
         """
         
-        frame = data
+        # On the GPU, the frame stays on the device of the simulator until it is sampled
+        frame = to_device(data, **simulator.data_kwargs)
 
         # Resize and preprocess the frame
         #frame = cv2.resize(frame, params['run']['resolution'])
         #frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        frame = cv2.GaussianBlur(frame, (3, 3), 0)
+        frame = blur_processor(frame, 3, self.buffers)
         
         # Process the image with the selected filter
         processed_img = frame
@@ -3,7 +3,7 @@ from base_processing_algorithm import BaseProcessingAlgorithm
 import cv2
 import numpy as np
 import torch
-from dynaphos.image_processing import sobel_processor
+from dynaphos.image_processing import blur_processor, sobel_processor, to_device
 from dynaphos.simulator import GaussianSimulator
 
 class SobelDefaultAlgorithm(BaseProcessingAlgorithm):
@@ -18,16 +18,17 @@ class SobelDefaultAlgorithm(BaseProcessingAlgorithm):
         Returns: torch.Tensor: the phosphene image.
         """
 
-        frame = data
+        # On the GPU, the frame stays on the device of the simulator until it is sampled
+        frame = to_device(data, **simulator.data_kwargs)
 
         # Resize and preprocess the frame
         #frame = cv2.resize(frame, params['run']['resolution'])
         #frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        frame = cv2.GaussianBlur(frame, (3, 3), 0)
+        frame = blur_processor(frame, 3, self.buffers)
 
         # Process the image with the selected filter
         processed_img = None 
-        processed_img = sobel_processor(frame)
+        processed_img = sobel_processor(frame, self.buffers)
 
         stim_pattern = simulator.sample_stimulus(processed_img, rescale=True)
 
@@ -0,0 +1,73 @@
+import threading
+from typing import Generic, Optional, Sequence, TypeVar
+
+T = TypeVar('T')
+
+
+class TripleBuffer(Generic[T]):
+    def __init__(self, buffers: Sequence[T]):
+        """Hands the latest value from one writer thread to one reader
+        thread, without copies and without either of them waiting on the
+        other.
+
+        The writer fills `back` and publishes it, which swaps it with the
+        middle buffer. The reader acquires the middle buffer (if it holds a
+        newer value), which swaps it with the front buffer. The reader owns
+        the front buffer until it acquires again, and the writer owns the
+        back buffer until it publishes, so neither ever sees a buffer that is
+        being written or read. Values that are published again before the
+        reader acquired them are overwritten (and counted).
+
+        The lock only guards the swap of two references (never a copy), so
+        neither side is held up for more than a few bytecodes.
+
+        :param buffers: The three buffers.
+        """
+        if len(buffers) != 3:
+            raise ValueError("A triple buffer needs exactly three buffers.")
+        self._buffers = list(buffers)
+        self._front, self._middle, self._back = 0, 1, 2
+        self._fresh = False  # Whether the middle buffer has not been read.
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.produced = 0
+        self.consumed = 0
+        self.overwritten = 0
+
+    @property
+    def back(self) -> T:
+        """The buffer to write the next value into (writer only)."""
+        return self._buffers[self._back]
+
+    @property
+    def front(self) -> Optional[T]:
+        """The buffer that was acquired last (reader only)."""
+        return self._buffers[self._front] if self.consumed else None
+
+    @property
+    def has_new(self) -> bool:
+        """Whether a value was published since the last acquire."""
+        return self._fresh
+
+    def publish(self):
+        """Publish the back buffer as the latest value (writer only)."""
+        with self._lock:
+            self._back, self._middle = self._middle, self._back
+            if self._fresh:
+                self.overwritten += 1
+            self._fresh = True
+            self.produced += 1
+
+    def acquire(self) -> Optional[T]:
+        """Take the latest value, if there is a newer one (reader only).
+
+        :return: The newest published value, or None if nothing was published
+            yet. Without new values, the previous value is returned again.
+        """
+        with self._lock:
+            if self._fresh:
+                self._front, self._middle = self._middle, self._front
+                self._fresh = False
+                self.consumed += 1
+        return self.front
@@ -0,0 +1,348 @@
+"""Compressed encodings of the phosphene frames that are sent to Unity.
+
+Phosphene frames are mostly black, so instead of their raw bytes the server
+can send them encoded, as datagrams of kind ENCODED_FRAME (see protocol.py).
+The payload of such a frame starts with a 12-byte little-endian header:
+
+    encoding (uint8) | 3 reserved bytes | reference frame id (uint32) |
+    decoded length (uint32)
+
+followed by the encoded frame:
+
+- RAW: the bytes of the frame.
+- RLE: the number of runs n (uint32), n (zeros, nonzero bytes) pairs of
+  uint16, and then the nonzero bytes of all runs. Each run is a number of
+  zeros followed by a number of nonzero bytes; runs longer than 65535 bytes
+  are split.
+- DELTA: the RLE of the difference (modulo 256) with the frame of the
+  reference frame id, i.e. the previous frame.
+- DEFLATE: a raw deflate stream (RFC 1951, as read by .NET's DeflateStream).
+
+A frame is sent RAW when its encoding is not smaller than `max_ratio` times
+its size, so that encoding never costs more than a few bytes. With DELTA,
+every `key_frame_interval`-th frame is encoded as RLE, without reference, so
+that the receiver recovers from a lost frame; until then, it drops the delta
+frames of which it does not have the reference. The C# counterpart lives in
+FrameProtocol.cs.
+
+Run this module to receive, decode and display the frames locally instead of
+Unity:
+
+    python -m streaming.encoding --port 9003 --size 401 484
+"""
+import argparse
+import socket
+import struct
+import time
+import zlib
+from typing import Optional, Tuple
+
+import numpy as np
+
+from streaming.protocol import (ENCODED_FRAME, FRAME, MAX_DATAGRAM_SIZE,
+                                FrameBuffer, FrameReceiver)
+
+# Encodings.
+RAW = 0
+RLE = 1
+DELTA = 2
+DEFLATE = 3
+
+ENCODINGS = {'raw': RAW, 'rle': RLE, 'delta': DELTA, 'deflate': DEFLATE}
+
+ENCODING_HEADER = struct.Struct('<BxxxII')
+ENCODING_HEADER_SIZE = ENCODING_HEADER.size
+
+_RUN_COUNT = struct.Struct('<I')
+_MAX_RUN = 0xFFFF
+
+
+def get_runs(data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The runs of the RLE encoding of the bytes in data.
+
+    :return: The number of zeros and the number of nonzero bytes of each run
+        (uint16), such that the runs add up to the data.
+    """
+    nonzero = np.empty(len(data) + 2, bool)
+    nonzero[0] = nonzero[-1] = False
+    np.not_equal(data, 0, out=nonzero[1:-1])
+    # Starts and ends of the stretches of nonzero bytes, plus one run of the
+    # zeros at the end.
+    edges = np.flatnonzero(nonzero[1:] != nonzero[:-1])
+    starts = np.append(edges[::2], len(data))
+    ends = edges[1::2]
+    zeros = starts - np.concatenate([[0], ends])
+    literals = np.append(ends - starts[:-1], 0)
+
+    # Split the runs that do not fit in 16 bits: first the zeros, then the
+    # nonzero bytes.
+    zero_runs = np.maximum(-(-zeros // _MAX_RUN), 1)
+    literal_runs = np.maximum(-(-literals // _MAX_RUN), 1)
+    counts = zero_runs + literal_runs - 1
+    if (counts == 1).all():
+        return zeros.astype(np.uint16), literals.astype(np.uint16)
+    index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                counts)
+    zeros, literals, zero_runs = (np.repeat(x, counts) for x in
+                                  (zeros, literals, zero_runs))
+    split_zeros = np.where(index < zero_runs - 1, _MAX_RUN,
+                           zeros - (zero_runs - 1) * _MAX_RUN)
+    split_zeros[index >= zero_runs] = 0
+    literal_index = index - (zero_runs - 1)
+    split_literals = np.where(literal_index >= 0, np.clip(
+        literals - literal_index * _MAX_RUN, 0, _MAX_RUN), 0)
+    return split_zeros.astype(np.uint16), split_literals.astype(np.uint16)
+
+
+def rle_decode(encoded: np.ndarray, out: np.ndarray):
+    """Decode an RLE-encoded frame (without header) into out (flat uint8)."""
+    if len(encoded) < _RUN_COUNT.size:
+        raise ValueError("Truncated RLE frame.")
+    num_runs, = _RUN_COUNT.unpack_from(encoded)
+    runs_end = _RUN_COUNT.size + 4 * num_runs
+    if len(encoded) < runs_end:
+        raise ValueError("Truncated RLE frame.")
+    runs = encoded[_RUN_COUNT.size:runs_end].view('<u2').reshape(-1, 2)
+    zeros = runs[:, 0].astype(np.int64)
+    literals = runs[:, 1].astype(np.int64)
+    values = encoded[runs_end:]
+    ends = np.cumsum(zeros + literals)
+    if (ends[-1] if num_runs else 0) != len(out) or \
+            literals.sum() != len(values):
+        raise ValueError("The runs of the RLE frame do not add up to the "
+                         "frame.")
+    # Position of each nonzero byte in the frame.
+    shift = (ends - literals) - (np.cumsum(literals) - literals)
+    out[:] = 0
+    out[np.repeat(shift, literals) + np.arange(len(values))] = values
+
+
+class FrameEncoder:
+    def __init__(self, encoding: str, frame_size: int,
+                 max_ratio: Optional[float] = 0.75,
+                 key_frame_interval: Optional[int] = 35):
+        """Encodes the frames that are sent (see FrameSender).
+
+        :param encoding: 'raw', 'rle', 'delta' or 'deflate'.
+        :param frame_size: Size of the (raw) frames, in bytes.
+        :param max_ratio: Frames are sent raw when their encoding is not
+            smaller than this fraction of their size.
+        :param key_frame_interval: Every this many frames, a DELTA frame is
+            encoded without reference to the previous frame.
+        """
+        if encoding not in ENCODINGS:
+            raise NotImplementedError(f"Unknown encoding: {encoding}")
+        self.encoding = ENCODINGS[encoding]
+        self.frame_size = frame_size
+        self.max_ratio = max_ratio
+        self.key_frame_interval = key_frame_interval
+        self._output = np.empty(ENCODING_HEADER_SIZE + frame_size, np.uint8)
+        self._difference = np.empty(frame_size, np.uint8)
+        self._reference = np.zeros(frame_size, np.uint8)
+        self._reference_id = None
+        self._frames_since_key_frame = 0
+
+        # Statistics
+        self.frames_encoded = [0] * len(ENCODINGS)
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _encode_runs(self, data: np.ndarray, limit: int) -> Optional[int]:
+        """Write the RLE encoding of data behind the header, if it is at
+        most limit bytes.
+
+        :return: The size of the encoding, or None if it exceeds limit.
+        """
+        zeros, literals = get_runs(data)
+        values_start = ENCODING_HEADER_SIZE + _RUN_COUNT.size + 4 * len(zeros)
+        size = values_start - ENCODING_HEADER_SIZE + \
+            int(literals.sum(dtype=np.int64))
+        if size > limit:
+            return None
+        output = self._output
+        _RUN_COUNT.pack_into(output, ENCODING_HEADER_SIZE, len(zeros))
+        runs = output[ENCODING_HEADER_SIZE + _RUN_COUNT.size:values_start]
+        runs = runs.view('<u2').reshape(-1, 2)
+        runs[:, 0] = zeros
+        runs[:, 1] = literals
+        np.compress(data != 0, data,
+                    out=output[values_start:ENCODING_HEADER_SIZE + size])
+        return size
+
+    def encode(self, frame: np.ndarray, frame_id: int) -> memoryview:
+        """Encode a frame, including the header.
+
+        :param frame: The (C-contiguous) frame of frame_size bytes.
+        :param frame_id: Id with which the frame is sent, by which the next
+            DELTA frame refers to it.
+        :return: The encoded frame (valid until the next call).
+        """
+        data = frame.reshape(-1).view(np.uint8)
+        if len(data) != self.frame_size:
+            raise ValueError(f"Expected a frame of {self.frame_size} bytes, "
+                             f"got {len(data)}.")
+        limit = int(min(self.max_ratio, 1) * self.frame_size) - \
+            ENCODING_HEADER_SIZE
+        encoding = self.encoding
+        reference_id = 0
+        size = None
+        if encoding == DELTA:
+            if self._reference_id is None or \
+                    self._frames_since_key_frame + 1 >= \
+                    self.key_frame_interval:
+                encoding = RLE
+            else:
+                np.subtract(data, self._reference, out=self._difference)
+                size = self._encode_runs(self._difference, limit)
+                reference_id = self._reference_id
+        if encoding == RLE:
+            size = self._encode_runs(data, limit)
+        elif encoding == DEFLATE:
+            compressor = zlib.compressobj(1, zlib.DEFLATED, -15)
+            compressed = compressor.compress(data) + compressor.flush()
+            if len(compressed) <= limit:
+                size = len(compressed)
+                self._output[ENCODING_HEADER_SIZE:ENCODING_HEADER_SIZE + size] \
+                    = np.frombuffer(compressed, np.uint8)
+        if size is None:
+            # Does not pay off (or raw was asked for).
+            encoding, reference_id = RAW, 0
+            size = self.frame_size
+            self._output[ENCODING_HEADER_SIZE:] = data
+        ENCODING_HEADER.pack_into(self._output, 0, encoding, reference_id,
+                                  self.frame_size)
+
+        if self.encoding == DELTA:
+            self._reference[:] = data
+            self._reference_id = frame_id
+            self._frames_since_key_frame = 0 if reference_id == 0 else \
+                self._frames_since_key_frame + 1
+        self.frames_encoded[encoding] += 1
+        self.bytes_in += self.frame_size
+        self.bytes_out += ENCODING_HEADER_SIZE + size
+        return memoryview(self._output)[:ENCODING_HEADER_SIZE + size]
+
+    def summary(self) -> str:
+        counts = ', '.join(f"{count} {name}" for name, count in
+                           zip(ENCODINGS, self.frames_encoded) if count)
+        ratio = self.bytes_out / self.bytes_in if self.bytes_in else 1
+        return f"encoded {counts or 'no'} frames, to {ratio:.1%} of their size"
+
+
+class FrameDecoder:
+    def __init__(self, frame_size: int):
+        """Decodes the frames encoded by FrameEncoder.
+
+        :param frame_size: Size of the (decoded) frames, in bytes.
+        """
+        self.frame_size = frame_size
+        self._reference = np.zeros(frame_size, np.uint8)
+        self._reference_id = None
+
+        # Statistics
+        self.frames_decoded = [0] * len(ENCODINGS)
+        self.frames_without_reference = 0
+
+    def decode(self, payload: np.ndarray, frame_id: int,
+               out: np.ndarray) -> bool:
+        """Decode the payload of an ENCODED_FRAME.
+
+        :param payload: The payload (uint8), including the header.
+        :param frame_id: The id of the frame.
+        :param out: Array of frame_size bytes to decode the frame into.
+        :return: False if the frame is a DELTA frame of which the reference
+            was not received (out is then unchanged).
+        """
+        if len(payload) < ENCODING_HEADER_SIZE:
+            raise ValueError("Truncated encoded frame.")
+        encoding, reference_id, length = ENCODING_HEADER.unpack_from(payload)
+        if length != self.frame_size:
+            raise ValueError(f"Expected a frame of {self.frame_size} bytes, "
+                             f"got one of {length}.")
+        encoded = payload[ENCODING_HEADER_SIZE:]
+        data = out.reshape(-1).view(np.uint8)
+        if encoding == DELTA and reference_id != self._reference_id:
+            self.frames_without_reference += 1
+            return False
+        if encoding == RAW:
+            if len(encoded) != length:
+                raise ValueError("Truncated raw frame.")
+            data[:] = encoded
+        elif encoding == RLE:
+            rle_decode(encoded, data)
+        elif encoding == DELTA:
+            rle_decode(encoded, data)
+            np.add(data, self._reference, out=data)
+        elif encoding == DEFLATE:
+            decompressed = zlib.decompress(encoded, -15)
+            if len(decompressed) != length:
+                raise ValueError("The deflated frame has the wrong size.")
+            data[:] = np.frombuffer(decompressed, np.uint8)
+        else:
+            raise NotImplementedError(f"Unknown encoding: {encoding}")
+        self._reference[:] = data
+        self._reference_id = frame_id
+        self.frames_decoded[encoding] += 1
+        return True
+
+
+def run_consumer(port: int, size: Tuple[int, int], show: bool,
+                 max_datagram_size: Optional[int] = MAX_DATAGRAM_SIZE):
+    """Stand-in for Unity's phosphene renderer: receives the (encoded) frames
+    sent to `port`, decodes them, and reports the frame rate and the bytes
+    per frame (and optionally shows the frames)."""
+    width, height = size
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+    sock.bind(('localhost', port))
+    receiver = FrameReceiver(sock, max_datagram_size)
+    decoder = FrameDecoder(width * height)
+    frame = FrameBuffer(ENCODING_HEADER_SIZE + width * height,
+                        max_datagram_size)
+    image = np.zeros((height, width), np.uint8)
+    received_bytes = 0
+    start = time.perf_counter()
+    try:
+        while receiver.receive_into(frame):
+            received_bytes += frame.length
+            if frame.kind == ENCODED_FRAME:
+                if not decoder.decode(frame.data, frame.frame_id, image):
+                    continue
+            elif frame.kind == FRAME and frame.length == image.size:
+                image.reshape(-1)[:] = frame.data
+            else:
+                continue
+            if show:
+                import cv2
+                cv2.imshow(f'Port {port}', image)
+                cv2.waitKey(1)
+            if receiver.frames_received % 100 == 0:
+                elapsed = time.perf_counter() - start
+                counts = ', '.join(f"{count} {name}" for name, count in zip(
+                    ENCODINGS, decoder.frames_decoded) if count)
+                print(f"{receiver.frames_received} frames "
+                      f"({receiver.frames_received / elapsed:.1f} fps, "
+                      f"{received_bytes / receiver.frames_received:.0f} "
+                      f"bytes each; {counts or 'raw'}), "
+                      f"{receiver.frames_dropped} dropped, "
+                      f"{decoder.frames_without_reference} without "
+                      f"reference")
+    except KeyboardInterrupt:
+        pass
+    sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Stand-in for Unity, that receives and decodes the "
+                    "phosphene frames.")
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--size', type=int, nargs=2, default=(401, 484),
+                        metavar=('WIDTH', 'HEIGHT'),
+                        help="Frame size (cropWidthPixels cropHeightPixels).")
+    parser.add_argument('--show', action='store_true',
+                        help="Show the frames.")
+    parser.add_argument('--max-datagram-size', type=int,
+                        default=MAX_DATAGRAM_SIZE)
+    args = parser.parse_args()
+    run_consumer(args.port, args.size, args.show, args.max_datagram_size)
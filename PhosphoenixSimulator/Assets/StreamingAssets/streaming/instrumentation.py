@@ -0,0 +1,283 @@
+"""Latency instrumentation of the streaming server.
+
+Every stage of the processing of a frame records its duration into a
+histogram, for one in `sample_every` frames. Sampled frames additionally get a
+trace, which follows the frame (by the frame ids of the camera frames and of
+the phosphene frames it resulted in) through all stages. The histograms and the
+most recent traces are exported periodically to a local file, as JSON, CSV or
+a Prometheus text dump, together with the startup milestones (such as the time
+to the first phosphene frame) of a StartupTimer.
+"""
+import csv
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Sequence
+
+# Stages of the processing of a frame, in order.
+STAGES = ('receive', 'reassembly', 'resize', 'algorithm', 'update', 'render',
+          'output_resize', 'encode', 'send', 'glass_to_glass')
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Histogram:
+    def __init__(self, significant_bits: Optional[int] = 6,
+                 max_value_bits: Optional[int] = 40):
+        """HDR-style histogram of durations, in microseconds.
+
+        Values below 2 ** (significant_bits + 1) get a bucket of their own.
+        Above that, each power of two is split into 2 ** significant_bits
+        buckets, so that every recorded value is accurate to within a relative
+        error of 2 ** -significant_bits (1.6% by default), from microseconds
+        up to days, at a fixed memory cost. Recording is O(1).
+
+        :param significant_bits: Number of bits of precision.
+        :param max_value_bits: Values of 2 ** max_value_bits and above are
+            recorded in the last bucket.
+        """
+        self._bits = significant_bits
+        self._sub_buckets = 1 << significant_bits
+        self._max_value = (1 << max_value_bits) - 1
+        self.counts = [0] * self._get_index(self._max_value) + [0]
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _get_index(self, value: int) -> int:
+        shift = value.bit_length() - self._bits - 1
+        if shift <= 0:
+            return value
+        return (shift + 1) * self._sub_buckets + (value >> shift) - \
+            self._sub_buckets
+
+    def _get_value(self, index: int) -> int:
+        """Lowest value of a bucket."""
+        if index < 2 * self._sub_buckets:
+            return index
+        shift = index // self._sub_buckets - 1
+        return (index - shift * self._sub_buckets) << shift
+
+    def record(self, seconds: float):
+        value = min(max(int(seconds * 1e6), 0), self._max_value)
+        index = self._get_index(value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+            self.min = value if self.min is None else min(self.min, value)
+
+    def percentile(self, q: float) -> float:
+        """Value (in microseconds) below which q percent of the values
+        lie."""
+        rank = max(q / 100 * self.count, 1)
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(self._get_value(index), self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, float]:
+        """Summary statistics, in milliseconds."""
+        with self._lock:
+            summary = dict(count=self.count,
+                           mean=self.total / max(self.count, 1) / 1000,
+                           min=(self.min or 0) / 1000)
+            for q in PERCENTILES:
+                summary[f'p{q:g}'] = self.percentile(q) / 1000
+            summary['max'] = self.max / 1000
+        return summary
+
+
+class StartupTimer:
+    def __init__(self, start_time: Optional[float] = None):
+        """Times at which the milestones of the startup of the server (e.g.
+        'imports', 'simulator', 'first_phosphene_frame') were reached.
+
+        :param start_time: time.perf_counter() at the start of the process
+            (default: now).
+        """
+        self.start_time = time.perf_counter() if start_time is None else \
+            start_time
+        self.milestones = {}
+
+    def mark(self, milestone: str) -> bool:
+        """Record that a milestone was reached, unless it was already.
+
+        :return: Whether this is the first time the milestone was reached.
+        """
+        if milestone in self.milestones:
+            return False
+        self.milestones[milestone] = time.perf_counter() - self.start_time
+        return True
+
+    def format(self) -> str:
+        return ', '.join(f"{milestone} after {seconds:.2f} s" for
+                         milestone, seconds in self.milestones.items())
+
+
+class Instrumentation:
+    def __init__(self, sample_every: Optional[int] = 1,
+                 export_path: Optional[str] = None,
+                 export_format: Optional[str] = 'json',
+                 export_interval: Optional[float] = 10.,
+                 max_traces: Optional[int] = 100,
+                 stages: Sequence[str] = STAGES,
+                 startup: Optional[StartupTimer] = None):
+        """Per-stage latency histograms and frame traces.
+
+        :param sample_every: Instrument one in this many frames (0 disables
+            the instrumentation).
+        :param export_path: File to export to (None: no export).
+        :param export_format: 'json', 'csv' or 'prometheus'.
+        :param export_interval: Seconds between exports.
+        :param max_traces: Number of most recent traces to keep.
+        :param stages: Names of the stages.
+        :param startup: Startup milestones to export along.
+        """
+        if export_format not in ('json', 'csv', 'prometheus'):
+            raise NotImplementedError(f"Unknown export format: "
+                                      f"{export_format}")
+        self.sample_every = sample_every
+        self.export_path = None if export_path is None else \
+            os.path.expanduser(export_path)
+        self.export_format = export_format
+        self.export_interval = export_interval
+        self.histograms = {stage: Histogram() for stage in stages}
+        self.traces = deque(maxlen=max_traces)
+        self.startup = startup
+        self._start_time = time.time()
+        self._stop = threading.Event()
+        self._exporter = threading.Thread(target=self._export_periodically,
+                                          name='exporter', daemon=True)
+
+    def sampled(self, index: Optional[int]) -> bool:
+        """Whether the frame with the given index (or id) is instrumented."""
+        return bool(self.sample_every) and index is not None and \
+            index % self.sample_every == 0
+
+    def start_trace(self, index: int) -> Optional[dict]:
+        """Trace of the frame with the given index, or None if it is not
+        sampled. The trace is passed along to `now` and `record`."""
+        return dict(index=index, latency={}) if self.sampled(index) else None
+
+    @staticmethod
+    def now(trace: Optional[dict]) -> Optional[float]:
+        return time.perf_counter() if trace is not None else None
+
+    def record(self, stage: str, start: Optional[float],
+               trace: Optional[dict]) -> Optional[float]:
+        """Record the duration of a stage that started at `start` (as
+        returned by `now` or `record`), if the frame is sampled.
+
+        :return: The current time, i.e. the start of the next stage.
+        """
+        if trace is None:
+            return None
+        end = time.perf_counter()
+        self.record_duration(stage, end - start)
+        latency = trace['latency']
+        latency[stage] = latency.get(stage, 0) + (end - start) * 1000
+        return end
+
+    def record_duration(self, stage: str, seconds: float):
+        self.histograms[stage].record(seconds)
+
+    def finish_trace(self, trace: Optional[dict], **fields):
+        if trace is not None:
+            trace.update(fields)
+            self.traces.append(trace)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {stage: histogram.snapshot() for stage, histogram in
+                self.histograms.items() if histogram.count}
+
+    def to_json(self) -> str:
+        return json.dumps(dict(time=time.time(),
+                               uptime=time.time() - self._start_time,
+                               sample_every=self.sample_every,
+                               startup=None if self.startup is None else
+                               self.startup.milestones,
+                               stages=self.summary(),
+                               traces=list(self.traces)), indent=1)
+
+    def to_csv(self) -> str:
+        summary = self.summary()
+        columns = ['count', 'mean', 'min'] + \
+                  [f'p{q:g}' for q in PERCENTILES] + ['max']
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(['stage'] + [column if column == 'count' else
+                                     column + '_ms' for column in columns])
+        for stage, snapshot in summary.items():
+            writer.writerow([stage] + [snapshot[column] for column in columns])
+        return output.getvalue()
+
+    def to_prometheus(self) -> str:
+        name = 'phosphoenix_stage_latency_seconds'
+        lines = [f'# HELP {name} Latency of the stages of the processing of a '
+                 f'frame (one in {self.sample_every or 0} frames sampled).',
+                 f'# TYPE {name} summary']
+        for stage, histogram in self.histograms.items():
+            if not histogram.count:
+                continue
+            for q in PERCENTILES:
+                lines.append(f'{name}{{stage="{stage}",quantile="{q / 100:g}"}}'
+                             f' {histogram.percentile(q) / 1e6:g}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} '
+                         f'{histogram.total / 1e6:g}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        if self.startup is not None and self.startup.milestones:
+            name = 'phosphoenix_startup_seconds'
+            lines += [f'# HELP {name} Time from the start of the server until '
+                      f'a startup milestone was reached.',
+                      f'# TYPE {name} gauge']
+            lines += [f'{name}{{milestone="{milestone}"}} {seconds:g}' for
+                      milestone, seconds in self.startup.milestones.items()]
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+        """Write the histograms (and traces) to the export file."""
+        if self.export_path is None:
+            return
+        if self.export_format == 'json':
+            text = self.to_json()
+        elif self.export_format == 'csv':
+            text = self.to_csv()
+        else:
+            text = self.to_prometheus()
+        # Replace the file at once, so readers never see a partial export.
+        temporary_path = self.export_path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            f.write(text)
+        os.replace(temporary_path, self.export_path)
+
+    def _export_periodically(self):
+        while not self._stop.wait(self.export_interval):
+            self.export()
+
+    def start(self):
+        if self.export_path is not None and self.sample_every:
+            self._exporter.start()
+
+    def stop(self):
+        """Stop the periodic export, and export one last time."""
+        self._stop.set()
+        if self._exporter.is_alive():
+            self._exporter.join()
+        if self.sample_every:
+            self.export()
+
+    def format_summary(self) -> str:
+        return '\n'.join(f"{stage:>15}: p50 {snapshot['p50']:7.2f} ms, "
+                         f"p99 {snapshot['p99']:7.2f} ms, max "
+                         f"{snapshot['max']:7.2f} ms ({snapshot['count']} "
+                         f"frames)" for stage, snapshot in
+                         self.summary().items())
@@ -0,0 +1,144 @@
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple, Union
+
+from dynaphos.utils import set_thread_affinity
+
+_CLOSED = object()
+
+
+class LatestQueue:
+    def __init__(self, maxsize: int):
+        """Bounded queue whose put never blocks: when the queue is full, the
+        oldest item is dropped (latest frame wins), so that the latency a
+        queue adds stays bounded.
+
+        :param maxsize: Number of items the queue holds.
+        """
+        if maxsize < 1:
+            raise ValueError("Queue depths must be at least 1.")
+        self.maxsize = maxsize
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+        # Statistics
+        self.dropped = 0
+
+    def put(self, item: Any):
+        with self._condition:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._condition.notify()
+
+    def get(self) -> Any:
+        """Wait for the oldest item. Returns _CLOSED once the queue is closed
+        and empty."""
+        with self._condition:
+            while not self._items and not self._closed:
+                self._condition.wait()
+            return self._items.popleft() if self._items else _CLOSED
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class Stage:
+    def __init__(self, name: str, function: Callable[[Any], Any],
+                 queue: LatestQueue, output: Optional[LatestQueue],
+                 cpus: Optional[Sequence[int]] = None):
+        """Runs `function` on every item of `queue` on a worker thread, and
+        puts the results (unless None) into `output`. An item for which
+        `function` raises is dropped (and the error printed), so that one
+        failing frame does not stop the stage. The thread is pinned to cores
+        `cpus`, if given (see set_thread_affinity)."""
+        self.name = name
+        self.function = function
+        self.queue = queue
+        self.output = output
+        self.cpus = cpus
+        self.thread = threading.Thread(target=self.run, name=name,
+                                       daemon=True)
+
+        # Statistics
+        self.processed = 0
+        self.failed = 0
+        self.busy_time = 0.
+
+    def run(self):
+        set_thread_affinity(self.cpus)
+        while True:
+            item = self.queue.get()
+            if item is _CLOSED:
+                break
+            start = time.perf_counter()
+            try:
+                result = self.function(item)
+            except Exception:
+                print(f"Error in the {self.name} stage, the frame is dropped:")
+                traceback.print_exc()
+                self.failed += 1
+                result = None
+            self.busy_time += time.perf_counter() - start
+            self.processed += 1
+            if self.output is not None and result is not None:
+                self.output.put(result)
+        if self.output is not None:
+            self.output.close()
+
+
+class Pipeline:
+    def __init__(self, stages: Sequence[Tuple[str, Callable[[Any], Any]]],
+                 depths: Union[int, Sequence[int]] = 1,
+                 cpus: Optional[Dict[str, Sequence[int]]] = None):
+        """Chain of stages that each run on their own worker thread and are
+        connected by bounded LatestQueues. While one stage works on frame k,
+        the previous one can work on frame k + 1 (cv2 and torch release the
+        GIL), so throughput is bounded by the slowest stage instead of the sum
+        of all stages.
+
+        :param stages: Name and function of each stage. Each function maps
+            the output of the previous stage to the input of the next; None
+            drops the item.
+        :param depths: Depth of the queue in front of each stage (or one
+            depth for all of them).
+        :param cpus: Cores to pin the thread of each stage to, by the name
+            of the stage. Stages that are not listed are not pinned.
+        """
+        if isinstance(depths, int):
+            depths = [depths] * len(stages)
+        if len(depths) != len(stages):
+            raise ValueError(f"Expected {len(stages)} queue depths, got "
+                             f"{len(depths)}.")
+        cpus = cpus or {}
+        queues = [LatestQueue(depth) for depth in depths]
+        self.stages = [Stage(name, function, queue, output, cpus.get(name))
+                       for (name, function), queue, output in
+                       zip(stages, queues, queues[1:] + [None])]
+
+    def start(self):
+        for stage in self.stages:
+            stage.thread.start()
+
+    def submit(self, item: Any):
+        """Put an item into the queue of the first stage."""
+        self.stages[0].queue.put(item)
+
+    def close(self):
+        """Let the stages finish the queued items, and stop them."""
+        self.stages[0].queue.close()
+        for stage in self.stages:
+            stage.thread.join()
+
+    def summary(self) -> str:
+        return ', '.join(f"{stage.name}: {stage.processed} frames "
+                         f"({stage.queue.dropped} dropped, "
+                         f"{stage.failed} failed, "
+                         f"{stage.busy_time / max(stage.processed, 1) * 1000:.1f}"
+                         f" ms each)" for stage in self.stages)
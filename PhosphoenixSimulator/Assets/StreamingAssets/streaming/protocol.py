@@ -0,0 +1,242 @@
+"""Wire format of the frames that are exchanged with Unity over UDP.
+
+Every datagram starts with a 16-byte little-endian header:
+
+    magic (2 bytes, b'PX') | version (uint8) | kind (uint8) |
+    frame id (uint32) | offset (uint32) | total length (uint32)
+
+followed by the bytes [offset, offset + payload length) of a frame of
+`total length` bytes. A frame is split into as few datagrams as possible
+(near-64 KB payloads). Datagrams of a frame are sent in order; a frame with a
+missing datagram is dropped. A datagram of kind EXIT (without payload) ends the
+stream, and one of kind SHUTDOWN asks the server to stop. Frames of kind
+ENCODED_FRAME are compressed, see encoding.py. The C# counterpart lives in
+FrameProtocol.cs.
+"""
+import socket
+import struct
+import time
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+MAGIC = b'PX'
+VERSION = 1
+
+# Kinds of datagrams.
+FRAME = 0
+EXIT = 1
+SHUTDOWN = 2
+ENCODED_FRAME = 3
+
+HEADER = struct.Struct('<2sBBIII')
+HEADER_SIZE = HEADER.size
+
+# Largest UDP payload over IPv4. Note that macOS limits datagrams to 9216 bytes
+# by default (sysctl net.inet.udp.maxdgram).
+MAX_DATAGRAM_SIZE = 65507
+
+
+def send_control(sock: socket.socket, address: Tuple[str, int], kind: int,
+                 frame_id: Optional[int] = 0):
+    """Send a datagram without payload, e.g. of kind EXIT or SHUTDOWN."""
+    sock.sendto(HEADER.pack(MAGIC, VERSION, kind, frame_id, 0, 0), address)
+
+
+def parse_control(datagram: bytes) -> Optional[int]:
+    """Kind of a datagram without payload, or None if it is not one."""
+    if len(datagram) != HEADER_SIZE:
+        return None
+    magic, version, kind, _, _, _ = HEADER.unpack(datagram)
+    return kind if magic == MAGIC and version == VERSION else None
+
+
+class FrameBuffer:
+    def __init__(self, capacity: int,
+                 max_datagram_size: Optional[int] = MAX_DATAGRAM_SIZE):
+        """Preallocated buffer into which a frame is received.
+
+        The frame bytes are stored after HEADER_SIZE bytes of slack, and the
+        buffer has room for one more datagram beyond its capacity, so that
+        datagrams can be received in place (see FrameReceiver).
+
+        :param capacity: Largest frame size, in bytes.
+        :param max_datagram_size: Largest datagram size, in bytes.
+        """
+        self.capacity = capacity
+        self.raw = np.zeros(HEADER_SIZE + capacity + max_datagram_size,
+                            dtype=np.uint8)
+        self.frame_id = None
+        self.kind = FRAME
+        self.length = 0
+        # When the first byte of the frame arrived, and when it was complete
+        # (time.perf_counter).
+        self.received_at = None
+        self.completed_at = None
+
+    @property
+    def data(self) -> np.ndarray:
+        """The bytes of the received frame (a view, not a copy)."""
+        return self.raw[HEADER_SIZE:HEADER_SIZE + self.length]
+
+    def image(self, shape: Tuple[int, ...]) -> np.ndarray:
+        return self.data.reshape(shape)
+
+
+class FrameReceiver:
+    def __init__(self, sock: socket.socket,
+                 max_datagram_size: Optional[int] = MAX_DATAGRAM_SIZE):
+        """Reassembles frames from the datagrams received on sock.
+
+        Each datagram is received with recv_into directly behind the bytes of
+        the frame received so far. Its header temporarily overwrites the last
+        HEADER_SIZE bytes of those, which are restored right after. This way
+        the payloads end up in place without any further copies.
+
+        :param sock: Bound UDP socket.
+        :param max_datagram_size: Largest datagram size, in bytes.
+        """
+        self.sock = sock
+        self.max_datagram_size = max_datagram_size
+        self._header = bytearray(HEADER_SIZE)
+        self._saved = np.zeros(HEADER_SIZE, dtype=np.uint8)
+        self._skipped_frame_id = None
+        self.shutdown_requested = False
+
+        # Statistics
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.invalid_datagrams = 0
+
+    def _drop(self, frame_id: int):
+        """Drop the (incomplete) frame with the given id, including any of
+        its datagrams that are still to come."""
+        self.frames_dropped += 1
+        self._skipped_frame_id = frame_id
+
+    def receive_into(self, frame: FrameBuffer) -> bool:
+        """Receive datagrams until a frame is complete.
+
+        :param frame: Buffer to reassemble the frame in.
+        :return: True if a frame was received, False if the stream ended or a
+            shutdown was requested.
+        """
+        raw = frame.raw
+        view = memoryview(raw)
+        frame_id = None
+        filled = 0
+        received_at = None
+        while True:
+            # The payload lands at raw[HEADER_SIZE + filled], so the header
+            # lands on the last HEADER_SIZE bytes received so far.
+            self._saved[:] = raw[filled:filled + HEADER_SIZE]
+            n = self.sock.recv_into(view[filled:filled + self.max_datagram_size])
+            self._header[:] = view[filled:filled + HEADER_SIZE]
+            raw[filled:filled + HEADER_SIZE] = self._saved
+
+            if n < HEADER_SIZE:
+                self.invalid_datagrams += 1
+                continue
+            magic, version, kind, datagram_frame_id, offset, total_length = \
+                HEADER.unpack(self._header)
+            if magic != MAGIC or version != VERSION:
+                self.invalid_datagrams += 1
+                continue
+
+            if kind == EXIT or kind == SHUTDOWN:
+                if frame_id is not None:
+                    self.frames_dropped += 1
+                self.shutdown_requested = kind == SHUTDOWN
+                return False
+            if kind not in (FRAME, ENCODED_FRAME) or \
+                    datagram_frame_id == self._skipped_frame_id:
+                continue
+
+            length = n - HEADER_SIZE
+            if datagram_frame_id != frame_id:
+                if frame_id is not None:
+                    # A new frame started before the current one completed.
+                    self.frames_dropped += 1
+                if offset != 0 or total_length > frame.capacity:
+                    # Missed the start of the frame, or it does not fit.
+                    self._drop(datagram_frame_id)
+                    frame_id = None
+                    filled = 0
+                    continue
+                if filled != 0:
+                    # The first datagram of the new frame landed behind the
+                    # data of the dropped frame; move it to the start.
+                    raw[HEADER_SIZE:HEADER_SIZE + length] = \
+                        raw[HEADER_SIZE + filled:HEADER_SIZE + filled + length]
+                frame_id = datagram_frame_id
+                filled = 0
+                received_at = time.perf_counter()
+            elif offset != filled:
+                # A datagram of this frame got lost.
+                self._drop(frame_id)
+                frame_id = None
+                filled = 0
+                continue
+
+            filled += length
+            if filled >= total_length:
+                frame.frame_id = frame_id
+                frame.kind = kind
+                frame.length = total_length
+                frame.received_at = received_at
+                frame.completed_at = time.perf_counter()
+                self.frames_received += 1
+                return True
+
+
+class FrameSender:
+    def __init__(self, sock: socket.socket,
+                 max_datagram_size: Optional[int] = MAX_DATAGRAM_SIZE,
+                 encoder=None):
+        """Sends frames in the wire format, using as few datagrams as
+        possible.
+
+        :param sock: UDP socket.
+        :param max_datagram_size: Largest datagram size, in bytes.
+        :param encoder: If given, the frames are sent as ENCODED_FRAME,
+            encoded by this encoding.FrameEncoder.
+        """
+        self.sock = sock
+        self.encoder = encoder
+        self.frame_id = 0
+        self._datagram = bytearray(max_datagram_size)
+        self._view = memoryview(self._datagram)
+        self._max_payload = max_datagram_size - HEADER_SIZE
+
+    def send(self, frame: np.ndarray, address: Tuple[str, int]):
+        """Send the bytes of a (C-contiguous) array as one frame."""
+        self.send_encoded(self.encode(frame), address)
+
+    def encode(self, frame: np.ndarray
+               ) -> Tuple[int, Union[bytes, memoryview]]:
+        """Number the next frame and encode it (if there is an encoder), so
+        that it can be sent by send_encoded. Separate from sending, so that
+        both can be timed.
+
+        :return: The kind of the frame and its payload.
+        """
+        self.frame_id = (self.frame_id + 1) & 0xFFFFFFFF
+        if self.encoder is None:
+            return FRAME, memoryview(frame).cast('B')
+        return ENCODED_FRAME, self.encoder.encode(frame, self.frame_id)
+
+    def send_encoded(self, encoded: Tuple[int, Union[bytes, memoryview]],
+                     address: Tuple[str, int]):
+        """Send a frame that was encoded by encode."""
+        kind, data = encoded
+        total_length = len(data)
+        for offset in range(0, total_length, self._max_payload):
+            length = min(self._max_payload, total_length - offset)
+            HEADER.pack_into(self._datagram, 0, MAGIC, VERSION, kind,
+                             self.frame_id, offset, total_length)
+            self._view[HEADER_SIZE:HEADER_SIZE + length] = \
+                data[offset:offset + length]
+            self.sock.sendto(self._view[:HEADER_SIZE + length], address)
+
+    def send_exit(self, address: Tuple[str, int]):
+        send_control(self.sock, address, EXIT, self.frame_id)
@@ -0,0 +1,50 @@
+import os
+import time
+from typing import Callable, Optional
+
+
+class ParamsWatcher:
+    def __init__(self, path: str, load: Callable[[str], dict],
+                 interval: Optional[float] = 1.):
+        """Watches a parameter file (params.yaml), so that changes can be
+        applied while the server is running.
+
+        :param path: The parameter file.
+        :param load: Function that loads the parameters from the file.
+        :param interval: Seconds between checks of the modification time of
+            the file.
+        """
+        self.path = path
+        self.load = load
+        self.interval = interval
+        self._modified = self._get_modified()
+        self._next_check = time.perf_counter() + interval
+
+    def _get_modified(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def poll(self) -> Optional[dict]:
+        """The parameters, if the file changed since the last time. Cheap
+        enough to call every frame: the file is only checked once per
+        interval.
+
+        :return: The new parameters, or None if the file did not change (or
+            could not be loaded, e.g. while it is being saved; it is then
+            loaded at the next change).
+        """
+        now = time.perf_counter()
+        if now < self._next_check:
+            return None
+        self._next_check = now + self.interval
+        modified = self._get_modified()
+        if modified is None or modified == self._modified:
+            return None
+        self._modified = modified
+        try:
+            return self.load(self.path)
+        except Exception as e:
+            print(f"Could not load {self.path}: {e}")
+            return None
@@ -0,0 +1,89 @@
+import threading
+import time
+from typing import Optional
+
+
+class FrameScheduler:
+    def __init__(self, fps: float, policy: Optional[str] = 'deadline'):
+        """Paces the main loop at (at most) `fps` frames per second, sleeping
+        in between instead of spinning.
+
+        With the 'deadline' policy, a frame is due every 1 / fps seconds,
+        whether or not a new camera frame arrived (the phosphenes keep
+        evolving over time). With the 'new_frame' policy, the loop sleeps
+        until a new camera frame arrives, but still not more often than once
+        per 1 / fps seconds.
+
+        When processing a frame overruns the next deadline, the deadlines that
+        passed are skipped instead of being caught up on, and the miss is
+        counted.
+
+        :param fps: Frame rate.
+        :param policy: 'deadline' or 'new_frame'.
+        """
+        if policy not in ('deadline', 'new_frame'):
+            raise NotImplementedError(f"Unknown scheduling policy: {policy}")
+        self.period = 1 / fps
+        self.policy = policy
+        self.shutdown = threading.Event()
+        self.new_frame = threading.Event()
+        self._deadline = None
+
+        # Statistics
+        self.frames = 0
+        self.missed_deadlines = 0
+        self.skipped_frames = 0
+        self.max_lateness = 0.
+
+    def notify(self):
+        """Signal that a new camera frame arrived (or a stream ended)."""
+        self.new_frame.set()
+
+    def request_shutdown(self, *_):
+        """Stop the main loop. Can be used as a signal handler."""
+        self.shutdown.set()
+        self.new_frame.set()
+
+    def wait_for_frame(self) -> bool:
+        """Sleep until a new camera frame arrives.
+
+        :return: False if a shutdown was requested.
+        """
+        self.new_frame.wait()
+        self.new_frame.clear()
+        return not self.shutdown.is_set()
+
+    def wait(self) -> bool:
+        """Sleep until the next frame is due.
+
+        :return: False if a shutdown was requested.
+        """
+        now = time.perf_counter()
+        if self._deadline is None:
+            self._deadline = now
+        elif now > self._deadline:
+            # The previous frame overran the deadline of this one. Skip the
+            # deadlines that passed entirely.
+            lateness = now - self._deadline
+            skipped = int(lateness // self.period)
+            self.missed_deadlines += 1
+            self.skipped_frames += skipped
+            self.max_lateness = max(self.max_lateness, lateness)
+            self._deadline += skipped * self.period
+
+        if self.policy == 'new_frame':
+            if not self.wait_for_frame():
+                return False
+            # After idling, the next frame is due right away.
+            self._deadline = max(self._deadline, time.perf_counter())
+
+        if self.shutdown.wait(max(self._deadline - time.perf_counter(), 0)):
+            return False
+        self._deadline += self.period
+        self.frames += 1
+        return True
+
+    def summary(self) -> str:
+        return (f"{self.frames} frames, {self.missed_deadlines} missed "
+                f"deadlines (at most {self.max_lateness * 1000:.1f} ms late), "
+                f"{self.skipped_frames} skipped frames")
@@ -0,0 +1,364 @@
+"""Shared-memory transport of frames between processes on the same machine.
+
+A FrameRing is a named shared-memory block holding a ring of frame slots. The
+producer writes every frame into the next slot; the consumer reads the most
+recent one. Each slot is guarded by a sequence counter (a seqlock): it is odd
+while the slot is being written, so a read that overlapped a write is detected
+and retried. After publishing a frame, the producer rings a "doorbell": a tiny
+UDP datagram to the consumer. Only the doorbell goes through the network stack,
+and a lost doorbell merely delays the consumer until its poll timeout. The same
+socket receives the EXIT and SHUTDOWN datagrams of protocol.py.
+
+The ring of a port is named `ring_name(port)`, and the consumer listens for
+doorbells on that same port, so the [input port, output port] pairs in
+params.yaml configure both transports.
+
+Run this module to start a stand-in for Unity:
+
+    python -m streaming.shared_memory producer --port 4906 --size 401 484
+    python -m streaming.shared_memory consumer --port 9003
+"""
+import argparse
+import os
+import socket
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+from streaming.protocol import (EXIT, FrameBuffer, HEADER_SIZE, SHUTDOWN,
+                                parse_control)
+
+MAGIC = 0x4D535850  # b'PXSM'
+VERSION = 1
+
+# Header: magic, version, number of slots, slot capacity (uint32), number of
+# frames written so far, closed flag (uint64).
+RING_HEADER = struct.Struct('<IIIIQQ')
+RING_HEADER_SIZE = 64
+# Slot header: sequence counter, frame id, frame length (uint64).
+SLOT_HEADER_SIZE = 64
+
+DOORBELL = struct.Struct('<Q')
+
+
+def ring_name(port: int) -> str:
+    return f'phosphoenix_{port}'
+
+
+def _align(size: int, alignment: Optional[int] = 64) -> int:
+    return -(-size // alignment) * alignment
+
+
+class FrameRing:
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        """Ring of frame slots in shared memory. Use `create` or `attach`.
+
+        :param shm: The shared-memory block.
+        :param owner: Whether this process created the block (and unlinks it
+            on close).
+        """
+        self.shm = shm
+        self.owner = owner
+        magic, version, self.num_slots, self.capacity, _, _ = \
+            RING_HEADER.unpack_from(shm.buf)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{shm.name} is not a version {VERSION} frame "
+                             f"ring.")
+        self._slot_size = SLOT_HEADER_SIZE + _align(self.capacity)
+        self.torn_reads = 0
+
+        buffer = shm.buf
+        # Counters are accessed through numpy views, which read and write
+        # the (aligned) 64-bit words at once.
+        self._write_count = np.ndarray((), '<u8', buffer, 16)
+        self._closed = np.ndarray((), '<u8', buffer, 24)
+        offsets = RING_HEADER_SIZE + self._slot_size * np.arange(
+            self.num_slots)
+        self._slot_headers = [np.ndarray((3,), '<u8', buffer, offset)
+                              for offset in offsets]
+        self._slot_data = [np.ndarray((self.capacity,), np.uint8, buffer,
+                                      offset + SLOT_HEADER_SIZE)
+                           for offset in offsets]
+
+    @classmethod
+    def create(cls, name: str, capacity: int,
+               num_slots: Optional[int] = 3) -> 'FrameRing':
+        """Create a ring of `num_slots` slots of `capacity` bytes each,
+        replacing any stale ring of the same name."""
+        size = RING_HEADER_SIZE + num_slots * (SLOT_HEADER_SIZE +
+                                               _align(capacity))
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        shm.buf[:RING_HEADER_SIZE + num_slots * SLOT_HEADER_SIZE] = bytes(
+            RING_HEADER_SIZE + num_slots * SLOT_HEADER_SIZE)
+        RING_HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, num_slots, capacity,
+                              0, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'FrameRing':
+        """Attach to a ring that was created by another process."""
+        shm = shared_memory.SharedMemory(name)
+        if os.name == 'posix':
+            # Otherwise, the resource tracker of this process unlinks the
+            # block when this process exits (before Python 3.13).
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def write_count(self) -> int:
+        """Number of frames written so far (the id of the latest frame)."""
+        return int(self._write_count)
+
+    @property
+    def closed(self) -> bool:
+        """Whether the producer ended the stream."""
+        return bool(self._closed)
+
+    def write(self, frame: np.ndarray) -> int:
+        """Write a frame into the next slot and publish it.
+
+        :param frame: Array of at most `capacity` bytes.
+        :return: The id of the frame.
+        """
+        data = frame.reshape(-1).view(np.uint8)
+        frame_id = self.write_count + 1
+        header = self._slot_headers[(frame_id - 1) % self.num_slots]
+        header[0] += 1  # Odd: being written.
+        header[1] = frame_id
+        header[2] = len(data)
+        self._slot_data[(frame_id - 1) % self.num_slots][:len(data)] = data
+        header[0] += 1  # Even: complete.
+        self._write_count[...] = frame_id
+        self._closed[...] = 0
+        return frame_id
+
+    def close_stream(self):
+        self._closed[...] = 1
+
+    def read_latest(self, out: np.ndarray, after: Optional[int] = 0
+                    ) -> Optional[Tuple[int, int]]:
+        """Copy the latest frame into out, if it is newer than frame `after`.
+
+        :param out: Buffer of at least `capacity` bytes.
+        :param after: Id of the frame that was read last.
+        :return: Id and length of the frame, or None if there is no newer
+            frame.
+        """
+        while True:
+            frame_id = self.write_count
+            if frame_id <= after:
+                return None
+            slot = (frame_id - 1) % self.num_slots
+            header = self._slot_headers[slot]
+            sequence = int(header[0])
+            length = int(header[2])
+            if sequence % 2 or int(header[1]) != frame_id:
+                # The producer has moved on to this slot already.
+                continue
+            out[:length] = self._slot_data[slot][:length]
+            if int(header[0]) == sequence:
+                return frame_id, length
+            # Torn read: the slot was overwritten while copying.
+            self.torn_reads += 1
+
+    def close(self):
+        # Release the numpy views before closing the mapping.
+        del self._write_count, self._closed
+        del self._slot_headers, self._slot_data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedMemoryReceiver:
+    def __init__(self, sock: socket.socket, ring: FrameRing,
+                 poll_interval: Optional[float] = 0.1):
+        """Receives frames from a FrameRing. Same interface as
+        protocol.FrameReceiver.
+
+        :param sock: Bound UDP socket on which the doorbells arrive.
+        :param ring: The ring to read from.
+        :param poll_interval: Maximum time (in seconds) to wait for a doorbell
+            before checking the ring anyway.
+        """
+        self.sock = sock
+        self.ring = ring
+        self.poll_interval = poll_interval
+        self.sock.settimeout(poll_interval)
+        self._last_frame_id = 0
+        self._end_reported = False
+        self.shutdown_requested = False
+
+        # Statistics
+        self.frames_received = 0
+        self.frames_dropped = 0  # Frames that were overwritten before read.
+
+    def _wait(self) -> Optional[int]:
+        """Wait for a doorbell (or the poll timeout).
+
+        :return: The kind of a control datagram that arrived, if any.
+        """
+        kind = None
+        try:
+            kind = parse_control(self.sock.recv(HEADER_SIZE))
+            # Skip the doorbells of frames that are read now as well.
+            self.sock.setblocking(False)
+            while kind is None:
+                kind = parse_control(self.sock.recv(HEADER_SIZE))
+        except (socket.timeout, BlockingIOError):
+            pass
+        finally:
+            self.sock.settimeout(self.poll_interval)
+        return kind
+
+    def receive_into(self, frame: FrameBuffer) -> bool:
+        """Wait for a new frame and copy it into frame.
+
+        :return: True if a frame was received, False if the stream ended or a
+            shutdown was requested.
+        """
+        out = frame.raw[HEADER_SIZE:HEADER_SIZE + frame.capacity]
+        while True:
+            received_at = time.perf_counter()
+            result = self.ring.read_latest(out, self._last_frame_id)
+            if result is not None:
+                frame_id, frame.length = result
+                frame.received_at = received_at
+                frame.completed_at = time.perf_counter()
+                frame.frame_id = frame_id
+                self.frames_dropped += frame_id - self._last_frame_id - 1
+                self.frames_received += 1
+                self._last_frame_id = frame_id
+                self._end_reported = False
+                return True
+            if self.ring.closed and not self._end_reported:
+                self._end_reported = True
+                return False
+            kind = self._wait()
+            if kind == EXIT or kind == SHUTDOWN:
+                self.shutdown_requested = kind == SHUTDOWN
+                return False
+
+
+class SharedMemorySender:
+    def __init__(self, sock: socket.socket, ring: FrameRing):
+        """Sends frames through a FrameRing. Same interface as
+        protocol.FrameSender.
+
+        :param sock: UDP socket from which the doorbells are sent.
+        :param ring: The ring to write to.
+        """
+        self.sock = sock
+        self.ring = ring
+        self.frame_id = 0
+
+    def send(self, frame: np.ndarray, address: Tuple[str, int]):
+        """Write a frame into the ring and ring the doorbell at address."""
+        self.frame_id = self.ring.write(frame)
+        self._ring_doorbell(address)
+
+    def send_exit(self, address: Tuple[str, int]):
+        self.ring.close_stream()
+        self._ring_doorbell(address)
+
+    def _ring_doorbell(self, address: Tuple[str, int]):
+        try:
+            self.sock.sendto(DOORBELL.pack(self.frame_id), address)
+        except OSError:
+            # Nobody listening (yet); the consumer polls the ring anyway.
+            pass
+
+
+def run_producer(port: int, size: Tuple[int, int], fps: float,
+                 video: Optional[str] = None):
+    """Stand-in for Unity's camera: writes frames (synthetic moving bars, or
+    the frames of a video) into the ring of `port` created by
+    PhospheneGeneration.py."""
+    import cv2
+
+    width, height = size
+    ring = FrameRing.attach(ring_name(port))
+    sender = SharedMemorySender(socket.socket(socket.AF_INET,
+                                              socket.SOCK_DGRAM), ring)
+    capture = cv2.VideoCapture(video) if video is not None else None
+    x = np.arange(width)
+    frame_count = 0
+    try:
+        while True:
+            if capture is not None:
+                success, image = capture.read()
+                if not success:
+                    break
+                image = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY),
+                                   (width, height))
+            else:
+                bars = ((x + 4 * frame_count) // 32) % 2 * 255
+                image = np.broadcast_to(bars.astype(np.uint8), (height, width))
+            sender.send(np.ascontiguousarray(image), ('localhost', port))
+            frame_count += 1
+            time.sleep(1 / fps)
+    except KeyboardInterrupt:
+        pass
+    sender.send_exit(('localhost', port))
+    ring.close()
+    print(f"Sent {frame_count} frames")
+
+
+def run_consumer(port: int, size: Optional[Tuple[int, int]] = None):
+    """Stand-in for Unity's phosphene renderer: reads the frames from the
+    ring of `port`, and reports the frame rate (and optionally shows them)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('localhost', port))
+    while True:
+        try:
+            ring = FrameRing.attach(ring_name(port))
+            break
+        except FileNotFoundError:
+            time.sleep(0.5)
+    receiver = SharedMemoryReceiver(sock, ring)
+    frame = FrameBuffer(ring.capacity, 0)
+    start = time.perf_counter()
+    try:
+        while receiver.receive_into(frame):
+            if size is not None:
+                import cv2
+                cv2.imshow(ring_name(port), frame.image(size[::-1]))
+                cv2.waitKey(1)
+            if receiver.frames_received % 100 == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{receiver.frames_received} frames "
+                      f"({receiver.frames_received / elapsed:.1f} fps), "
+                      f"{receiver.frames_dropped} dropped, "
+                      f"{ring.torn_reads} torn reads")
+    except KeyboardInterrupt:
+        pass
+    ring.close()
+    sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Stand-in for Unity, for the shared-memory transport.")
+    parser.add_argument('role', choices=['producer', 'consumer'])
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--size', type=int, nargs=2, default=None,
+                        metavar=('WIDTH', 'HEIGHT'),
+                        help="Frame size (producer), or show the frames "
+                             "(consumer).")
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--video', default=None,
+                        help="Video to stream instead of moving bars.")
+    args = parser.parse_args()
+    if args.role == 'producer':
+        run_producer(args.port, args.size or (401, 484), args.fps, args.video)
+    else:
+        run_consumer(args.port, args.size)
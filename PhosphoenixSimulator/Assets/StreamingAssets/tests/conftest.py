@@ -0,0 +1,32 @@
+import copy
+import os
+import sys
+
+import pytest
+
+# The packages (dynaphos, streaming) and the processing algorithms are imported
+# from StreamingAssets, as by PhospheneGeneration.py.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dynaphos.cortex_models import load_visual_field_coordinates  # noqa: E402
+from dynaphos.utils import load_params  # noqa: E402
+
+_PARAMS = load_params(os.path.join(ROOT, 'params.yaml'))
+
+
+@pytest.fixture
+def params() -> dict:
+    """The default parameters (params.yaml), without a geometry cache."""
+    params = copy.deepcopy(_PARAMS)
+    params['run']['cache_dir'] = None
+    return params
+
+
+@pytest.fixture
+def coordinates(params):
+    """Phosphene locations of 400 electrodes of the default layout."""
+    return load_visual_field_coordinates(
+        params['cortex_model'],
+        os.path.join(ROOT, 'grid_coords_dipole_valid.npz'), n_coordinates=400,
+        seed=params['run']['seed'])
@@ -0,0 +1,33 @@
+import os
+import shutil
+
+import numpy as np
+
+from dynaphos.cache import GeometryCache
+
+
+def test_prune_skips_removed_entries(tmp_path, monkeypatch):
+    cache = GeometryCache(str(tmp_path), max_entries=1)
+    for key in ('a', 'b', 'c'):
+        cache.store(key, {'x': np.zeros(3)})
+    os.utime(tmp_path / 'c', (1e9, 2e9))
+
+    # Another process removes entries while this one is pruning.
+    getmtime = os.path.getmtime
+
+    def getmtime_removed(path):
+        if path.endswith('b'):
+            shutil.rmtree(path)
+        return getmtime(path)
+
+    rmtree = shutil.rmtree
+
+    def rmtree_removed(path, *args, **kwargs):
+        rmtree(path, *args, **kwargs)
+        rmtree(path, *args, **kwargs)
+
+    monkeypatch.setattr(os.path, 'getmtime', getmtime_removed)
+    monkeypatch.setattr(shutil, 'rmtree', rmtree_removed)
+    cache.prune()
+
+    assert os.listdir(tmp_path) == ['c']
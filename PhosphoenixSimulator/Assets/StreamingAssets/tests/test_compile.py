@@ -0,0 +1,81 @@
+import copy
+
+import numpy as np
+import pytest
+import torch
+
+from dynaphos.image_processing import canny_processor
+from dynaphos.simulator import GaussianSimulator
+
+NUM_FRAMES = 10
+STATES = ('activation', 'trace', 'sigma', 'brightness')
+
+
+@pytest.fixture(scope='module', autouse=True)
+def inductor():
+    """Skip the tests if torch.compile can not compile (e.g. without a C++
+    compiler for inductor)."""
+    try:
+        torch.compile(lambda x: x + 1)(torch.zeros(1))
+    except Exception as e:
+        pytest.skip(f"torch.compile is not available: {e!r}")
+
+
+def get_stimulus(simulator: GaussianSimulator, frame: int) -> torch.Tensor:
+    """Stimulation of vertical edges that move 4 pixels per frame."""
+    res_x, res_y = simulator.params['run']['resolution']
+    x = np.arange(res_x)
+    stripes = ((x + 4 * frame) // 32) % 2 * 255
+    image = np.broadcast_to(stripes.astype(np.uint8), (res_y, res_x)).copy()
+    return simulator.sample_stimulus(canny_processor(image, 100, 200),
+                                     rescale=True)
+
+
+def assert_steps_match(eager: GaussianSimulator, compiled: GaussianSimulator,
+                       frames: range):
+    """The states match to 1e-5 (relative) and the frames to 1 gray level."""
+    for frame in frames:
+        expected = eager.step(get_stimulus(eager, frame))
+        actual = compiled.step(get_stimulus(compiled, frame))
+        assert (expected.int() - actual.int()).abs().max() <= 1
+        for name in STATES:
+            torch.testing.assert_close(getattr(compiled, name).get(),
+                                       getattr(eager, name).get(),
+                                       rtol=1e-5, atol=1e-9)
+
+
+def get_simulators(params: dict, coordinates):
+    simulators = []
+    for compile in (False, True):
+        simulator_params = copy.deepcopy(params)
+        simulator_params['run']['compile'] = compile
+        simulators.append(GaussianSimulator(simulator_params, coordinates,
+                                            rng=np.random.default_rng(0)))
+    return simulators
+
+
+@pytest.mark.parametrize('renderer', ['dense', 'windowed'])
+def test_compiled_step_matches_eager(params, coordinates, renderer):
+    params['run']['renderer'] = renderer
+    if renderer == 'dense':
+        # The dense phosphene maps of 400 electrodes take 170 MB at 256².
+        params['run']['resolution'] = [128, 128]
+    eager, compiled = get_simulators(params, coordinates)
+    assert compiled.compiled and not eager.compiled
+    assert_steps_match(eager, compiled, range(NUM_FRAMES))
+
+
+def test_compiled_step_matches_eager_after_reconfigure(params, coordinates):
+    params['run']['renderer'] = 'windowed'
+    eager, compiled = get_simulators(params, coordinates)
+    assert_steps_match(eager, compiled, range(NUM_FRAMES))
+
+    # Changes the number of phosphenes, which recompiles the step.
+    num_phosphenes = eager.num_phosphenes
+    for simulator in (eager, compiled):
+        new_params = copy.deepcopy(simulator.params)
+        new_params['run']['view_angle'] = 14
+        new_params['temporal_dynamics']['activation_decay_per_second'] = 0.5
+        simulator.reconfigure(new_params)
+    assert compiled.num_phosphenes == eager.num_phosphenes != num_phosphenes
+    assert_steps_match(eager, compiled, range(NUM_FRAMES, 2 * NUM_FRAMES))
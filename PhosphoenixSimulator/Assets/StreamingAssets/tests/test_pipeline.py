@@ -0,0 +1,30 @@
+import threading
+
+from streaming.pipeline import Pipeline
+
+
+def test_failing_item_is_dropped(capsys):
+    results = []
+    done = threading.Event()
+
+    def process(item):
+        if item == 1:
+            raise RuntimeError("Cannot process item 1.")
+        return item
+
+    def collect(item):
+        results.append(item)
+        if item == 2:
+            done.set()
+
+    # Deep enough queues that no item is dropped because a stage fell behind.
+    pipeline = Pipeline([('process', process), ('collect', collect)], 3)
+    pipeline.start()
+    for item in range(3):
+        pipeline.submit(item)
+    assert done.wait(10)
+    pipeline.close()
+
+    assert results == [0, 2]
+    assert pipeline.stages[0].failed == 1
+    assert "Error in the process stage" in capsys.readouterr().out
@@ -0,0 +1,72 @@
+import os
+import tracemalloc
+
+import cv2
+import numpy as np
+import pytest
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+from base_processing_algorithm import find_algorithms, load_algorithm
+from dynaphos.image_processing import Buffers
+from dynaphos.simulator import GaussianSimulator
+
+ALGORITHMS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'processing_algorithms')
+NUM_FRAMES = 20
+
+# What "no allocations in the steady state" means here: the buffers of the
+# images are reused, so only small Python objects (far less than an image of
+# 256 x 256 pixels) are allocated on the Python heap, and torch only allocates
+# the stimulation vector that is returned (it is handed over to the simulate
+# stage, so it has to be new), plus a few scalars per frame (26 bytes, inside
+# the segment reduction of the receptive fields).
+MAX_PYTHON_BYTES = 16384
+MAX_TORCH_SCALAR_BYTES = 64
+
+
+@pytest.mark.parametrize('name', find_algorithms(ALGORITHMS))
+def test_preprocessing_does_not_allocate(params, coordinates, name):
+    # The renderer does not matter for the preprocessing; the windowed one is
+    # the fastest to set up.
+    params['run']['renderer'] = 'windowed'
+    simulator = GaussianSimulator(params, coordinates)
+    algorithm = load_algorithm(name, ALGORITHMS)()
+    res_x, res_y = params['run']['resolution']
+    rng = np.random.default_rng(0)
+    camera = [cv2.GaussianBlur(rng.integers(0, 256, (484, 401), np.uint8),
+                               (0, 0), 2) for _ in range(4)]
+    buffers = Buffers()
+
+    def preprocess(i):
+        # As the preprocess stage of the server (see Session.read_frame).
+        frame = cv2.resize(camera[i % len(camera)], (res_x, res_y),
+                           dst=buffers.get('resized', (res_y, res_x),
+                                           np.uint8),
+                           interpolation=cv2.INTER_LINEAR)
+        return algorithm.process(frame, params, simulator)
+
+    # Warm up: the buffers are allocated.
+    for i in range(NUM_FRAMES):
+        stimulation = preprocess(i)
+
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        for i in range(NUM_FRAMES):
+            preprocess(i)
+        python_bytes = tracemalloc.get_traced_memory()[1] - start
+    finally:
+        tracemalloc.stop()
+    assert python_bytes < MAX_PYTHON_BYTES
+
+    with profile(activities=[ProfilerActivity.CPU],
+                 profile_memory=True) as profiler:
+        for i in range(NUM_FRAMES):
+            preprocess(i)
+    torch_bytes = sum(event.self_cpu_memory_usage
+                      for event in profiler.key_averages()
+                      if event.self_cpu_memory_usage > 0) / NUM_FRAMES
+    result_bytes = stimulation.numel() * stimulation.element_size()
+    assert isinstance(stimulation, torch.Tensor)
+    assert torch_bytes <= result_bytes + MAX_TORCH_SCALAR_BYTES
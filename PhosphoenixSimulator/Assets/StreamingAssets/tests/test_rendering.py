@@ -0,0 +1,51 @@
+import copy
+
+import numpy as np
+import torch
+
+from dynaphos.rendering import get_truncation_error
+from dynaphos.simulator import GaussianSimulator
+
+
+def render(params: dict, coordinates, image: np.ndarray) -> torch.Tensor:
+    simulator = GaussianSimulator(copy.deepcopy(params), coordinates,
+                                  rng=np.random.default_rng(0))
+    stimulus = simulator.sample_stimulus(image, rescale=True)
+    for _ in range(3):
+        frame = simulator(stimulus)
+    return frame
+
+
+def get_image(params: dict) -> np.ndarray:
+    res_x, res_y = params['run']['resolution']
+    return np.random.default_rng(0).integers(0, 256, (res_y, res_x),
+                                             dtype=np.uint8)
+
+
+def test_bucketed_error_decreases_with_buckets(params, coordinates):
+    image = get_image(params)
+    dense = render(params, coordinates, image)
+
+    params['run']['renderer'] = 'bucketed'
+    max_errors, mean_errors = [], []
+    for num_buckets in (4, 16, 64):
+        params['run']['num_sigma_buckets'] = num_buckets
+        error = torch.abs(render(params, coordinates, image) - dense)
+        max_errors.append(error.max().item())
+        mean_errors.append(error.mean().item())
+
+    assert mean_errors[0] > mean_errors[1] > mean_errors[2]
+    assert max_errors[0] > max_errors[2]
+    # The splatting error of the bucketed phosphenes (see min_bucket_sigma in
+    # params.yaml).
+    assert max_errors[2] < 0.05
+
+
+def test_bucketed_renders_small_phosphenes_exactly(params, coordinates):
+    image = get_image(params)
+    dense = render(params, coordinates, image)
+
+    # All phosphenes are smaller than the smallest bucket.
+    params['run'].update(renderer='bucketed', min_bucket_sigma=100)
+    error = torch.abs(render(params, coordinates, image) - dense)
+    assert error.max() < get_truncation_error(params['run']['window_cutoff'])